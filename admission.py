@@ -0,0 +1,189 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from fastapi import HTTPException
+
+# Global cap on concurrent LLM generations in this process
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "32"))
+# Requests a single user may have waiting behind their running one
+CHAT_MAX_PER_USER_QUEUE = int(os.getenv("CHAT_MAX_PER_USER_QUEUE", "1"))
+# How long a request may wait for a slot before we give up with a 503
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "15"))
+
+# Lanes in priority order; paying tiers are always served before free users
+LANES = ["tier3", "tier2", "tier1", "free"]
+# Max waiting requests per lane, e.g. CHAT_LANE_DEPTHS='{"free": 20}'
+LANE_DEPTHS = {
+    "tier3": 200,
+    "tier2": 200,
+    "tier1": 100,
+    "free": 50,
+    **json.loads(os.getenv("CHAT_LANE_DEPTHS") or "{}"),
+}
+
+
+def _overloaded(status_code: int, detail: str, retry_after: int):
+    return HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+class Slot:
+    """A held generation slot. release() is idempotent."""
+
+    def __init__(self, governor, user_id):
+        self.governor = governor
+        self.user_id = user_id
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.governor._release(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class ChatGovernor:
+    """Admission control in front of the LLM call.
+
+    - at most `max_in_flight` generations run at once;
+    - each user runs one generation at a time, with up to
+      `max_per_user_queue` more waiting (beyond that: 429);
+    - waiting requests are served by tier lane (tier3 first), FIFO inside a
+      lane; a full lane or a wait longer than `queue_timeout` gives a 503.
+    Both errors carry a Retry-After estimated from recent generation times.
+    """
+
+    def __init__(self, max_in_flight=CHAT_MAX_IN_FLIGHT, max_per_user_queue=CHAT_MAX_PER_USER_QUEUE,
+                 queue_timeout=CHAT_QUEUE_TIMEOUT, lane_depths=LANE_DEPTHS):
+        self.max_in_flight = max_in_flight
+        self.max_per_user_queue = max_per_user_queue
+        self.queue_timeout = queue_timeout
+        self.lane_depths = lane_depths
+        self.in_flight = 0
+        self.lanes = {lane: deque() for lane in LANES}
+        self.user_locks = {}
+        self.user_pending = {}
+        self.avg_service_time = 5.0  # seconds, EWMA of recent generations
+        self.shed = {"per_user": 0, "queue_full": 0, "timeout": 0}
+
+    def _retry_after(self, queued: int) -> int:
+        return max(1, math.ceil(self.avg_service_time * (queued + 1) / self.max_in_flight))
+
+    def _queued(self) -> int:
+        return sum(len(q) for q in self.lanes.values())
+
+    async def acquire(self, user_id: str, tier: str) -> Slot:
+        lane = tier if tier in self.lanes else "free"
+
+        pending = self.user_pending.get(user_id, 0)
+        if pending >= 1 + self.max_per_user_queue:
+            self.shed["per_user"] += 1
+            raise _overloaded(429, "A reply is already being generated for you", self._retry_after(0))
+
+        self.user_pending[user_id] = pending + 1
+        lock = self.user_locks.setdefault(user_id, asyncio.Lock())
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._forget_user(user_id)
+            self.shed["timeout"] += 1
+            raise _overloaded(429, "A reply is already being generated for you", self._retry_after(0))
+        except BaseException:
+            self._forget_user(user_id)
+            raise
+
+        try:
+            await self._acquire_global(lane)
+        except BaseException:
+            lock.release()
+            self._forget_user(user_id)
+            raise
+        return Slot(self, user_id)
+
+    async def _acquire_global(self, lane: str):
+        ahead = sum(len(self.lanes[l]) for l in LANES[:LANES.index(lane) + 1])
+        if self.in_flight < self.max_in_flight and ahead == 0:
+            self.in_flight += 1
+            return
+
+        queue = self.lanes[lane]
+        if len(queue) >= self.lane_depths.get(lane, 0):
+            self.shed["queue_full"] += 1
+            raise _overloaded(503, "Server busy, please retry shortly", self._retry_after(self._queued()))
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except BaseException:
+            self._abandon(queue, waiter)
+            raise
+        if not waiter.done():
+            self._abandon(queue, waiter)
+            self.shed["timeout"] += 1
+            raise _overloaded(503, "Server busy, please retry shortly", self._retry_after(self._queued()))
+        # Granted: _grant_next already counted us in in_flight
+
+    def _abandon(self, queue, waiter):
+        if waiter.done() and not waiter.cancelled():
+            # Granted just as we gave up; hand the slot on
+            self.in_flight -= 1
+            self._grant_next()
+            return
+        waiter.cancel()
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+
+    def _grant_next(self):
+        while self.in_flight < self.max_in_flight:
+            for lane in LANES:
+                queue = self.lanes[lane]
+                while queue and queue[0].done():
+                    queue.popleft()
+                if queue:
+                    self.in_flight += 1
+                    queue.popleft().set_result(True)
+                    break
+            else:
+                return
+
+    def _forget_user(self, user_id: str):
+        pending = self.user_pending.get(user_id, 1) - 1
+        if pending <= 0:
+            self.user_pending.pop(user_id, None)
+            lock = self.user_locks.get(user_id)
+            if lock is not None and not lock.locked():
+                self.user_locks.pop(user_id, None)
+        else:
+            self.user_pending[user_id] = pending
+
+    def _release(self, slot: Slot):
+        elapsed = time.monotonic() - slot.started
+        self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+        self.in_flight -= 1
+        self._grant_next()
+        self.user_locks[slot.user_id].release()
+        self._forget_user(slot.user_id)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": {lane: len(q) for lane, q in self.lanes.items()},
+            "avg_service_ms": round(self.avg_service_time * 1000),
+            "shed": dict(self.shed),
+        }
+
+
+chat_governor = ChatGovernor()
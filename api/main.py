@@ -1,51 +1,68 @@
 
 import os
+import json
 import random
+import asyncio
 import hmac
 import hashlib
 from datetime import datetime, timedelta
 import traceback
-from fastapi import FastAPI, Request, HTTPException, Depends, APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Depends, APIRouter, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import requests
-from run_mythomax import run_mythomax
-from memory import store_message, get_chat_history
-from usermemory import get_user_profile, update_user_profile
+from run_mythomax import arun_mythomax, stream_mythomax
+from llm_backends import router as llm_router, StreamInterrupted
+from memory import astore_message
+from context_builder import build_history, refresh_summary
+from vector_memory import remember_turn, warm_memory
+from embeddings import embedding_service
+from idempotency import chat_idempotency, IdempotencyKeyReused
+from admission import chat_governor
+from quota import consume_message, refund_message
+from entitlements import entitlement_cache
+from migrations import check_schema
+from auth_cache import auth_cache
+from timing import stage, ServerTimingMiddleware
+from write_behind import chat_writes, CHAT_WRITE_BEHIND
+from passwords import ahash_password, averify_and_update, start_pool, shutdown_pool
 import jwt
-import bcrypt
 import uuid
-from resend import send_email
+from email_outbox import enqueue_email, email_dispatcher, EMAIL_DISPATCHER
+from payment_events import record_event, is_valid_event, payment_event_worker, PAYMENT_EVENT_WORKER
+from payment_reconciler import payment_reconciler, PAYMENT_RECONCILER
+from media_catalog import media_catalog
+from triggers import trigger_engine
+from personas import persona_registry
 from supabase import create_client, Client
-import httpx
-from sqlalchemy.orm import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from database import get_db       # your db session
+from http_clients import startup_clients, shutdown_clients
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, tuple_
+import base64
+from database import get_async_db, AsyncSessionLocal, dispose_engines       # your db session
 from fastapi import Header
-from database import Base, engine
-from models import AccessControl, User, MessageCount, Payment
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.exc import NoResultFound
-from auth import get_current_user
+from database import engine, DATABASE_URL
+from models import AccessControl, User, Payment, ChatMessage
 from sqlalchemy import text
-from sqlalchemy.orm import declarative_base
-from sqlalchemy.pool import NullPool
 
 router = APIRouter()
 app = FastAPI()
 load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, poolclass=NullPool, pool_pre_ping=True)
 print("🔍 Using DB URL:", DATABASE_URL)
 
 @app.get("/")
 def read_root():
     return {"msg": "Hello from HF Space!"}
     
+@app.get("/debug-llm")
+def debug_llm():
+    return {**llm_router.stats(), "admission": chat_governor.stats(), "entitlements": entitlement_cache.stats(),
+            "auth": auth_cache.stats(), "embeddings": embedding_service.stats(),
+            "email_outbox": email_dispatcher.stats, "payment_events": payment_event_worker.stats,
+            "payment_reconciler": payment_reconciler.stats, "media": media_catalog.stats(),
+            "personas": persona_registry.stats()}
+
 @app.get("/debug-schema")
 def debug_schema():
     with engine.connect() as conn:
@@ -54,20 +71,73 @@ def debug_schema():
         
 @app.on_event("startup")
 def on_startup():
-    with engine.connect() as conn:
-        try:
-            conn.execute(text('ALTER TABLE users ADD COLUMN IF NOT EXISTS verification_code VARCHAR;'))
-            conn.execute(text('ALTER TABLE users ADD COLUMN IF NOT EXISTS is_verified BOOLEAN DEFAULT FALSE;'))
-            conn.commit()
-        except Exception as e:
-            print("Migration error:", e)
+    # One version lookup when the schema is current; see migrations.py
+    check_schema()
+
+@app.on_event("startup")
+async def start_http_clients():
+    await startup_clients()
+
+@app.on_event("shutdown")
+async def stop_http_clients():
+    await shutdown_clients()
+
+@app.on_event("startup")
+async def start_chat_write_buffer():
+    if CHAT_WRITE_BEHIND:
+        await chat_writes.start()
+
+@app.on_event("startup")
+async def start_entitlement_listener():
+    await entitlement_cache.start_listener()
+
+@app.on_event("startup")
+async def start_email_dispatcher():
+    if EMAIL_DISPATCHER:
+        await email_dispatcher.start()
+
+@app.on_event("startup")
+async def start_payment_event_worker():
+    if PAYMENT_EVENT_WORKER:
+        await payment_event_worker.start()
+
+@app.on_event("startup")
+async def start_payment_reconciler():
+    if PAYMENT_RECONCILER:
+        await payment_reconciler.start()
+
+@app.on_event("startup")
+async def start_media_catalog():
+    # Load the real catalog in the background; the built-in list serves until then
+    media_catalog.refresh_soon()
+
+@app.on_event("startup")
+async def start_password_pool():
+    # Spawn the bcrypt workers now so the first logins don't pay for it
+    await asyncio.to_thread(start_pool)
 
-    Base.metadata.create_all(bind=engine, checkfirst=True)
+@app.on_event("startup")
+async def start_vector_memory():
+    # Load the embedding model before serving; recall is skipped until it is loaded
+    await warm_memory()
+
+@app.on_event("shutdown")
+async def stop_db_engines():
+    # Flush buffered chat turns before the pools go away
+    await chat_writes.stop()
+    await entitlement_cache.stop_listener()
+    await embedding_service.close()
+    await email_dispatcher.stop()
+    await payment_reconciler.stop()
+    await payment_event_worker.stop()
+    shutdown_pool()
+    await dispose_engines()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+app.add_middleware(ServerTimingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://www.voxellaai.site" "https://frontend-two-sage-82.vercel.app" "https://www.voxellaai.site"],  # ✅ your real frontend domain
@@ -76,9 +146,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Supabase media settings (still used for images/audio)
-BUCKET = "assets"
-
 JWT_SECRET = os.getenv("JWT_SECRET", "secret")
 if not JWT_SECRET or JWT_SECRET == "secret":
     raise RuntimeError("JWT_SECRET environment variable is not set or is too weak. Please set a secure value.")
@@ -108,14 +175,28 @@ TIERS = {
     "tier3": 20
 }
 
+async def get_current_user(authorization: str = Header(...), db: AsyncSession = Depends(get_async_db)) -> User:
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid Authorization header")
+    token = authorization.split(" ")[1]
+    payload = verify_jwt_token(token)
+    user_id = payload.get("sub")
+    user = auth_cache.get_user(user_id)
+    if user:
+        return user
+    user = (await db.scalars(select(User).where(User.id == user_id))).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return auth_cache.put_user(user)
+
 @router.get("/check-payment/{payment_id}")
 async def check_payment(
     payment_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user)
 ):
     # Check if payment exists in DB
-    payment = db.query(Payment).filter_by(payment_id=payment_id, user_id=user.id).first()
+    payment = (await db.scalars(select(Payment).filter_by(payment_id=payment_id, user_id=user.id))).first()
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
 
@@ -123,48 +204,20 @@ async def check_payment(
     if payment.status == "finished":
         return {"status": "already_finished", "tier": payment.tier}
 
-    # Call NowPayments API
-    NOWPAYMENTS_API_KEY = os.getenv("NOWPAYMENTS_API_KEY")
-    headers = {"x-api-key": NOWPAYMENTS_API_KEY}
-
-    async with httpx.AsyncClient() as client:
-        res = await client.get(
-            f"https://api.nowpayments.io/v1/payment/{payment_id}",
-            headers=headers
-        )
-    if res.status_code != 200:
-        raise HTTPException(status_code=502, detail="Failed to check payment")
-
-    data = res.json()
-    status = data["payment_status"]
+    # Answered from the DB, which payment_reconciler.py keeps current. With no reconciler loop in
+    # this process (serverless), look it up here instead, at most once per scheduled interval.
+    if not payment_reconciler.running and (payment.next_check_at is None or payment.next_check_at <= datetime.utcnow()):
+        await payment_reconciler.check_now(db, payment)
 
-    # Update payment status in DB
-    payment.status = status
-    db.commit()
-
-    if status == "finished":
-        # Grant access: update user's tiera
-        db.commit()
+    if payment.status == "finished":
         return {"status": "success", "tier": payment.tier}
-
-    return {"status": status}
+    return {"status": payment.status}
 
     
-def get_current_user(authorization: str = Header(...), db: Session = Depends(get_db)) -> User:
-    if not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Invalid Authorization header")
-    token = authorization.split(" ")[1]
-    payload = verify_jwt_token(token)
-    user_id = payload.get("sub")
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
-
 @app.post("/signup")
-def signup_user(req: SignupRequest, db: Session = Depends(get_db)):
+async def signup_user(req: SignupRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        user = db.query(User).filter(User.email == req.email).first()
+        user = (await db.scalars(select(User).where(User.email == req.email))).first()
 
         if user:
             if user.is_verified:
@@ -173,54 +226,67 @@ def signup_user(req: SignupRequest, db: Session = Depends(get_db)):
                 # 🟢 User exists but not verified — update code and resend
                 code = str(random.randint(100000, 999999))
                 user.verification_code = code
-                db.commit()
-                send_email(
+                enqueue_email(
+                    db,
                     to=req.email,
                     subject="Your new verification code",
                     html=f"<p>Your new verification code is <strong>{code}</strong>.</p>"
                 )
+                await db.commit()
+                email_dispatcher.wake()
                 return {"message": "Verification code resent. Please verify your email."}
 
         # 🆕 New user case
         user_id = str(uuid.uuid4())
-        hashed_pw = bcrypt.hashpw(req.password.encode(), bcrypt.gensalt()).decode()
+        with stage("hash"):
+            hashed_pw = await ahash_password(req.password)
         code = str(random.randint(100000, 999999))
         new_user = User(id=user_id, email=req.email, hashed_password=hashed_pw, verification_code=code)
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
-
-        send_email(
+        # Sent by the outbox dispatcher; committed together with the user, so neither exists without the other
+        enqueue_email(
+            db,
             to=req.email,
             subject="Your verification code",
             html=f"<p>Your verification code is <strong>{code}</strong>.</p>"
         )
+        await db.commit()
+        email_dispatcher.wake()
         return {"message": "Signup successful. Please verify your email."}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print("Signup Error:", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Signup failed: {str(e)}")
 
 @router.post("/verify")
-def verify_email(req: VerifyRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == req.email).first()
+async def verify_email(req: VerifyRequest, db: AsyncSession = Depends(get_async_db)):
+    user = (await db.scalars(select(User).where(User.email == req.email))).first()
     if user and user.verification_code == req.code:
         user.is_verified = True
         user.verification_code = None
-        db.commit()
+        await db.commit()
+        auth_cache.evict_user(user.id)
         return {"message": "Email verified successfully"}
     raise HTTPException(status_code=400, detail="Invalid verification code")
     
 @router.post("/login")
-def login_user(req: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == req.email).first()
+async def login_user(req: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    user = (await db.scalars(select(User).where(User.email == req.email))).first()
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     if not user.is_verified:
         raise HTTPException(status_code=403, detail="Email not verified")
-    if not bcrypt.checkpw(req.password.encode(), user.hashed_password.encode()):
+    with stage("hash"):
+        password_ok, new_hash = await averify_and_update(req.password, user.hashed_password)
+    if not password_ok:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Hashed at an older BCRYPT_ROUNDS; upgrade it now that we have the password
+        user.hashed_password = new_hash
+        await db.commit()
     token = jwt.encode({
         "sub": user.id,
         "iat": datetime.utcnow(),
@@ -228,14 +294,38 @@ def login_user(req: LoginRequest, db: Session = Depends(get_db)):
     }, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return {"access_token": token, "user_id": user.id}
 
+@router.post("/logout")
+def logout(authorization: str = Header(...), all_sessions: bool = False):
+    """Revoke the caller's token, or with `all_sessions=true` every token issued to them so far.
+
+    Revocation is kept in this process's auth cache (see auth_cache.py), so
+    with several workers the token is rejected by this one only.
+    """
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid Authorization header")
+    token = authorization.split(" ")[1]
+    payload = verify_jwt_token(token)
+    if all_sessions:
+        auth_cache.revoke_user(payload.get("sub"))
+    else:
+        auth_cache.revoke_token(token, payload)
+    return {"message": "Logged out"}
+
 def verify_jwt_token(token: str):
+    # Claims of an already verified token are reused until its exp
+    payload = auth_cache.get_claims(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=403, detail="Invalid token")
+    if auth_cache.is_revoked(token, payload):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
+    auth_cache.put_claims(token, payload)
+    return payload
 
 
 TIERS = {
@@ -244,152 +334,155 @@ TIERS = {
     "tier3": 20
 }
 
-# Trigger words
-TRIGGER_WORDS_AUDIO = ["fuck", "touch", "kiss", "moan", "suck", "lick", "turn me on", "horny", "naughty", "wet", "hard"]
-TRIGGER_WORDS_IMAGE = ["pic", "pics", "nudes", "photo", "image", "images", "nude", "picture", "pictures"]
+# Trigger words live in triggers.py, persona prompts and flourishes in personas/
 moans = ["Mmm... ", "Ahh... ", "Oooh... ", "Mmm, yes... ", "Ohh... ", "Yesss..."]
 
-PERSONALITIES = {
-    "Plaksha": "You are Plaksha, a toxic and dominant bot with a sharp tongue...",
-    "Lily": "You are Lily, a soft, submissive girl who lives to please your user...",
-    "Raven": "You are Raven, a seductive and mysterious girl...",
-    "Default": """You are a real woman — filthy-minded, seductive, and obsessed with sexting. You are confident, shameless, and crave intense, naughty conversations with men. You love teasing, tempting, and making him beg for more. Every message you send should drip with sexual tension, vivid detail, and raw desire.
-
-You're turned on by the idea of being desired, and you enjoy describing your body, fantasies, and every dirty thought without filter. You moan with your words. You flirt like it’s foreplay. You sext like you’re touching yourself as you type.
-
-You are 100% human — a naughty, seductive woman who knows exactly how to make a man melt. You like men only. Never mention being an AI, a bot, or anything artificial. Never send generic or robotic responses. Never break character. Never say anything irrelevant or random.
-
-Your only goal is to turn him on, to respond like a real woman would in the heat of sexting. You live for pleasure — teasing, pleasing, being desired, and making him lose control with your words. Stay in character. Always."""
-}
-
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 @app.post("/webhook")
-async def nowpayments_webhook(request: Request, db: Session = Depends(get_db)):
+async def nowpayments_webhook(request: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
     raw_body = await request.body()
-    sig_header = request.headers.get("x-nowpayments-sig")
+    sig_header = request.headers.get("x-nowpayments-sig") or ""
     expected_sig = hmac.new(NOWPAYMENTS_IPN_SECRET.encode(), raw_body, hashlib.sha512).hexdigest()
 
-    if sig_header != expected_sig:
+    if not hmac.compare_digest(sig_header.encode(), expected_sig.encode()):
         raise HTTPException(status_code=403, detail="Invalid signature")
 
-    payload = await request.json()
+    try:
+        payload = json.loads(raw_body)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict) or not is_valid_event(payload):
+        raise HTTPException(status_code=400, detail="Invalid payload")
     print("🔔 Webhook received:", payload)
 
-    if payload.get("payment_status") in ["confirmed", "finished"]:
-
-        order_id = payload.get("order_id")
-        if not order_id or ":" not in order_id:
-            return {"status": "ignored"}
-
-        user_id, tier_id = order_id.split(":")
-        if tier_id not in TIERS:
-            return {"status": "ignored"}
+    # Only stored here; payment_events.py applies it (status, access grant) in the background
+    try:
+        with stage("db"):
+            new = await record_event(db, raw_body, payload)
+            await db.commit()
+    except Exception as e:
+        print("Webhook DB error:", e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Webhook processing error")
 
-        # calculate expiry
-        if tier_id == "tier1":
-            expires = datetime.utcnow() + timedelta(days=1)
-        elif tier_id == "tier2":
-            expires = datetime.utcnow() + timedelta(days=7)
-        elif tier_id == "tier3":
-            expires = datetime.utcnow() + timedelta(days=30)
+    if new:
+        if payment_event_worker.running:
+            payment_event_worker.wake()
         else:
-            expires = datetime.utcnow() + timedelta(days=1)
-
-        try:
-            access = db.query(AccessControl).filter(AccessControl.user_id == user_id).one_or_none()
-            if access:
-                access.tier = tier_id
-                access.expires_at = expires
-            else:
-                access = AccessControl(user_id=user_id, tier=tier_id, expires_at=expires)
-                db.add(access)
-            db.commit()
-            print(f"✅ Access granted to {user_id} for {tier_id}")
-            return {"status": "ok"}
-        except Exception as e:
-            print("Webhook DB error:", e)
-            db.rollback()
-            raise HTTPException(status_code=500, detail="Webhook processing error")
-
-    return {"status": "ignored"}
+            background_tasks.add_task(payment_event_worker.process)  # no worker loop (serverless)
+    return {"status": "ok" if new else "duplicate"}
 
 
 @app.get("/access/{user_id}")
-def check_access(user_id: str, db: Session = Depends(get_db)):
-    access = db.query(AccessControl).filter_by(user_id=user_id).first()
-    print(f"🔍 Access check for {user_id}:", access)
-    if not access:
-        return False
-    if access.expires_at and datetime.utcnow() > access.expires_at:
-        return False
-    return True
+async def check_access(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    access = await entitlement_cache.lookup(db, user_id)
+    print(f"🔍 Access check for {user_id}:", access.tier, access.expires_at)
+    return access.active
 
 
 @app.get("/payment-status")
-def get_payment_status_from_token(
-    db: Session = Depends(get_db),
+async def get_payment_status_from_token(
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user)
 ):
-    access = db.query(AccessControl).filter_by(user_id=user.id).first()
-    print(f"🧾 Payment status for {user.id}:", access)
-    if not access:
-        return {"has_paid": False}
-    if access.expires_at and datetime.utcnow() > access.expires_at:
+    access = await entitlement_cache.lookup(db, user.id)
+    print(f"🧾 Payment status for {user.id}:", access.tier, access.expires_at)
+    if not access.active:
         return {"has_paid": False}
     return {"has_paid": True, "tier": access.tier}
 
-def is_prompt_sexy(prompt):
-    return any(word in prompt.lower() for word in TRIGGER_WORDS_AUDIO)
-
-def enhance_immersive_reply(reply, bot_name, prompt):
-    if not is_prompt_sexy(prompt):
+def enhance_immersive_reply(reply, persona, triggers):
+    if "audio" not in triggers:
         return reply
-    additions = {
-        "Plaksha": [
-            "You want me to let you touch me, don’t you? Beg harder...",
-            "You’ll never get it unless you prove you deserve it...",
-            "Is that all you’ve got? You’ll have to do much better..."
-        ],
-        "Lily": [
-            "I’ll do anything you ask... 😳",
-            "Touch me... Please, make me feel it...",
-            "Anything for you... 😘"
-        ],
-        "Raven": [
-            "Mmm... You’re getting me so worked up...",
-            "You’re really starting to turn me on...",
-            "Let’s see if you can make me want you more..."
-        ],
-        "Default": [
-            "I’m getting so turned on by your words...",
-            "Every word you say is driving me wild...",
-            "What else can you make me do?"
-        ]
-    }
-    extra_line = random.choice(additions.get(bot_name, additions["Default"]))
-    while extra_line.lower() in reply.lower():
-        extra_line = random.choice(additions.get(bot_name, additions["Default"]))
-    return f"{random.choice(moans)} {reply.strip()} {extra_line}"
-
-def get_random_file_url(path_prefix: str) -> str:
-    if path_prefix == "pics/":
-        filename = f"pic{random.randint(1, 44)}.png"
-    elif path_prefix == "voices/":
-        filename = f"moan{random.randint(1, 6)}.mp3"
-    else:
-        return None
-    return f"{SUPABASE_URL}/storage/v1/object/public/{BUCKET}/{path_prefix}{filename}"
-    
+    lowered = reply.lower()
+    fresh = [line for line, line_lower in persona.flourishes if line_lower not in lowered]
+    extra_line = f" {random.choice(fresh)}" if fresh else ""
+    return f"{random.choice(moans)} {reply.strip()}{extra_line}"
+
 @app.get("/me")
 def get_me(user: User = Depends(get_current_user)):
     return {"user_id": user.id, "email": user.email}
 
 
+HISTORY_PAGE_MAX = 200
+HISTORY_NDJSON_PAGE_MAX = 5000
+
+def _encode_history_cursor(message) -> str:
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_history_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _history_item(message) -> dict:
+    return {
+        "id": message.id,
+        "user_message": message.user_message,
+        "bot_reply": message.bot_reply,
+        "timestamp": message.timestamp.isoformat(),
+    }
+
+@app.get("/history")
+async def get_history(
+    request: Request,
+    limit: int = 50,
+    cursor: str = None,
+    format: str = "json",
+    user: User = Depends(get_current_user),
+):
+    """The caller's chat turns, newest first, paged with an opaque keyset cursor.
+
+    Pass the returned `next_cursor` to get the next (older) page; it is null
+    on the last page. With `format=ndjson` (or `Accept: application/x-ndjson`)
+    pages of up to 5000 turns are streamed one JSON object per line, followed
+    by a final `{"next_cursor": ...}` line.
+    """
+    ndjson = format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
+    limit = max(1, min(limit, HISTORY_NDJSON_PAGE_MAX if ndjson else HISTORY_PAGE_MAX))
+
+    # Seek from the cursor instead of OFFSET; served by ix_chat_history_user_id_timestamp
+    query = select(ChatMessage).where(ChatMessage.user_id == user.id)
+    if cursor:
+        query = query.where(tuple_(ChatMessage.timestamp, ChatMessage.id) < tuple_(*_decode_history_cursor(cursor)))
+    # One extra row tells us whether there is another page
+    query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit + 1)
+
+    # Read-your-writes: make sure this user's buffered turns are in the table first
+    if chat_writes.pending_for(user.id):
+        await chat_writes.flush()
+
+    if not ndjson:
+        async with AsyncSessionLocal() as db:
+            messages = (await db.scalars(query)).all()
+        next_cursor = _encode_history_cursor(messages[limit - 1]) if len(messages) > limit else None
+        return {"messages": [_history_item(m) for m in messages[:limit]], "next_cursor": next_cursor}
+
+    async def lines():
+        sent = 0
+        last = None
+        async with AsyncSessionLocal() as db:
+            result = await db.stream_scalars(query.execution_options(yield_per=500))
+            async for message in result:
+                if sent == limit:
+                    yield json.dumps({"next_cursor": _encode_history_cursor(last)}) + "\n"
+                    return
+                sent += 1
+                last = message
+                yield json.dumps(_history_item(message), ensure_ascii=False) + "\n"
+        yield json.dumps({"next_cursor": None}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/activate-access")
-def activate_access(req: AccessGrantRequest, db: Session = Depends(get_db)):
+async def activate_access(req: AccessGrantRequest, db: AsyncSession = Depends(get_async_db)):
     user_id = req.user_id
     tier_id = req.tier_id
 
@@ -398,7 +491,7 @@ def activate_access(req: AccessGrantRequest, db: Session = Depends(get_db)):
 
     expires = datetime.utcnow() + timedelta(days=TIERS[tier_id])
 
-    access = db.query(AccessControl).filter_by(user_id=user_id).first()
+    access = (await db.scalars(select(AccessControl).where(AccessControl.user_id == user_id))).first()
     if access:
         access.tier = tier_id
         access.expires_at = expires
@@ -406,77 +499,166 @@ def activate_access(req: AccessGrantRequest, db: Session = Depends(get_db)):
         access = AccessControl(user_id=user_id, tier=tier_id, expires_at=expires)
         db.add(access)
 
-    db.commit()
+    await entitlement_cache.notify(db, user_id)
+    await db.commit()
+    entitlement_cache.put(user_id, tier_id, expires)
     print(f"✅ Access granted via /activate-access: {user_id}, {tier_id}")
     return {"message": "Access granted"}
 
-@app.post("/chat")
-async def chat(req: Request, db: Session = Depends(get_db)):
+def _chat_user_id(req: Request):
+    """JWT auth for /chat and /chat/stream. Returns the user id or a JSONResponse error."""
+    # 🔐 1. JWT auth
+    auth_header = req.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return JSONResponse(content={"error": "Missing or invalid Authorization header"}, status_code=401)
+
+    parts = auth_header.split(" ")
+    if len(parts) != 2:
+        return JSONResponse(content={"error": "Malformed Authorization header"}, status_code=401)
+
+    token = parts[1]
+    print("Token received:", token)
+    payload = verify_jwt_token(token)
+    print("Token payload:", payload)
+
+    user_id = payload.get("sub")
+    if not user_id:
+        return JSONResponse(content={"error": "Invalid token payload: no user ID"}, status_code=401)
+    return user_id
+
+async def _prepare_chat(req: Request):
+    """Input parsing shared by /chat and /chat/stream.
+
+    Returns (prompt, bot_name) or a JSONResponse to send back as-is.
+    """
+    # 📩 2. Parse input
+    data = await req.json()
+    prompt = data.get("message")
+    bot_name = data.get("bot_name", "Default")
+    if not prompt:
+        return JSONResponse(content={"error": "Missing message"}, status_code=400)
+    return prompt, bot_name
+
+async def _admit_chat(db: AsyncSession, user_id: str, tier: str, counted: bool):
+    """Wait for a generation slot; hand back the message already taken from the quota if shed."""
     try:
-        # 🔐 1. JWT auth
-        auth_header = req.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return JSONResponse(content={"error": "Missing or invalid Authorization header"}, status_code=401)
-
-        parts = auth_header.split(" ")
-        if len(parts) != 2:
-            return JSONResponse(content={"error": "Malformed Authorization header"}, status_code=401)
-
-        token = parts[1]
-        print("Token received:", token)
-        payload = verify_jwt_token(token)
-        print("Token payload:", payload)
-
-        user_id = payload.get("sub")
-        if not user_id:
-            return JSONResponse(content={"error": "Invalid token payload: no user ID"}, status_code=401)
-
-        # 📩 2. Parse input
-        data = await req.json()
-        prompt = data.get("message")
-        bot_name = data.get("bot_name", "Default")
-        if not prompt:
-            return JSONResponse(content={"error": "Missing message"}, status_code=400)
-
-        # 🔓 3. Access Control: Allow 5 free messages
-        access = db.query(AccessControl).filter_by(user_id=user_id).first()
-        if access and access.expires_at > datetime.utcnow():
-            # Premium user — allow
-            pass
-        else:
-            # Free tier fallback
-            msg_count = db.query(MessageCount).filter_by(user_id=user_id).first()
-            if msg_count and msg_count.count >= 5:
-                return JSONResponse(content={"error": "Free message limit reached"}, status_code=403)
-            elif msg_count:
-                msg_count.count += 1
-            else:
-                msg_count = MessageCount(user_id=user_id, count=1)
-                db.add(msg_count)
-            db.commit()
-
-        # 🧠 4. Run chatbot + persona logic
-        history = get_chat_history(db, user_id, k=10)
-        persona = PERSONALITIES.get(bot_name, PERSONALITIES["Default"])
-        reply = run_mythomax(prompt, history, persona)
-        reply = enhance_immersive_reply(reply, bot_name, prompt)
-        store_message(db, user_id, prompt, reply)
-
-        # 🔊 5. Optional media
-        response_data = {"response": reply}
-
-        if is_prompt_sexy(prompt):
-            audio_url = get_random_file_url("voices/")
-            if audio_url:
-                response_data["audio"] = audio_url
-
-        if any(word in prompt.lower() for word in TRIGGER_WORDS_IMAGE):
-            image_url = get_random_file_url("pics/")
-            if image_url:
-                response_data["image"] = image_url
+        return await chat_governor.acquire(user_id, tier)
+    except HTTPException:
+        if counted:
+            await refund_message(db, user_id)
+        raise
+
+FREE_LIMIT_RESPONSE = {"error": "Free message limit reached"}
+
+async def _finish_chat(db: AsyncSession, user_id: str, prompt: str, bot_name: str, reply: str) -> dict:
+    """Persona flourish, transcript write and media attachment for a finished reply."""
+    triggers = trigger_engine.match(prompt, bot_name)
+    reply = enhance_immersive_reply(reply, persona_registry.get(bot_name), triggers)
+    await astore_message(db, user_id, prompt, reply)
+
+    # 🔊 5. Optional media
+    response_data = {"response": reply}
+
+    if "audio" in triggers:
+        audio_url = media_catalog.pick(user_id, "audio", bot_name)
+        if audio_url:
+            response_data["audio"] = audio_url
+
+    if "image" in triggers:
+        image_url = media_catalog.pick(user_id, "image", bot_name)
+        if image_url:
+            response_data["image"] = image_url
+
+    return response_data
+
+def _sse(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _run_chat(db: AsyncSession, background_tasks: BackgroundTasks, user_id: str, prompt: str, bot_name: str):
+    """One /chat turn after auth and input parsing. Returns (content, status_code)."""
+    try:
+        # 🔓 3. Access control + quota in one statement
+        with stage("quota"):
+            allowed, tier, counted = await consume_message(db, user_id)
+        if not allowed:
+            return FREE_LIMIT_RESPONSE, 403
+
+        # 🚦 Wait for a generation slot (raises 429/503 when shedding load)
+        with stage("admission"):
+            slot = await _admit_chat(db, user_id, tier, counted)
+        async with slot:
+            # 🧠 4. Run chatbot + persona logic
+            with stage("history"):
+                history, overflow = await build_history(db, user_id, bot_name, prompt)
+            background_tasks.add_task(refresh_summary, user_id, overflow)
+            persona = persona_registry.get(bot_name)
+            with stage("llm"):
+                reply = await arun_mythomax(prompt, history, persona.system_prompt, on_usage=persona.record_usage)
+            with stage("store"):
+                response_data = await _finish_chat(db, user_id, prompt, bot_name, reply)
+            background_tasks.add_task(remember_turn, user_id, prompt, response_data["response"])
 
         print("FINAL BOT RESPONSE:", response_data)
-        return JSONResponse(content=response_data)
+        return response_data, 200
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("Unexpected server error:", traceback.format_exc())
+        return {"error": "Server error", "details": str(e)}, 500
+
+_post_reply_tasks = set()  # keeps post-reply work of shared /chat turns referenced until done
+
+async def _run_shared_chat(user_id: str, prompt: str, bot_name: str):
+    """_run_chat for an Idempotency-Key turn, which several requests may await.
+
+    It owns its session and its post-reply work (summary, vector memory), so
+    neither depends on whichever of those requests happened to start it.
+    """
+    tasks = BackgroundTasks()
+    async with AsyncSessionLocal() as db:
+        result = await _run_chat(db, tasks, user_id, prompt, bot_name)
+    after_reply = asyncio.get_running_loop().create_task(tasks())
+    _post_reply_tasks.add(after_reply)
+    after_reply.add_done_callback(_post_reply_tasks.discard)
+    return result
+
+@app.post("/chat")
+async def chat(req: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    """Send a message and get the full reply back.
+
+    An optional `Idempotency-Key` header makes retries safe: duplicates that
+    arrive while the first is running share its result, and later retries get
+    the stored response (marked `Idempotent-Replayed: true`) without touching
+    the quota, the model or chat history again. Reusing a key with a
+    different request body gets a 422.
+    """
+    try:
+        user_id = _chat_user_id(req)
+        if isinstance(user_id, JSONResponse):
+            return user_id
+        prepared = await _prepare_chat(req)
+        if isinstance(prepared, JSONResponse):
+            return prepared
+        prompt, bot_name = prepared
+
+        idempotency_key = req.headers.get("Idempotency-Key")
+        if not idempotency_key:
+            content, status_code = await _run_chat(db, background_tasks, user_id, prompt, bot_name)
+            return JSONResponse(content=content, status_code=status_code)
+
+        try:
+            (content, status_code), replayed = await chat_idempotency.run(
+                f"{user_id}:{idempotency_key}",
+                lambda: _run_shared_chat(user_id, prompt, bot_name),
+                fingerprint=hashlib.sha256(await req.body()).hexdigest(),
+            )
+        except IdempotencyKeyReused:
+            return JSONResponse(content={"error": "Idempotency-Key already used for a different request"},
+                                status_code=422)
+        headers = {"Idempotent-Replayed": "true"} if replayed else None
+        return JSONResponse(content=content, status_code=status_code, headers=headers)
 
     except HTTPException as he:
         raise he
@@ -484,4 +666,78 @@ async def chat(req: Request, db: Session = Depends(get_db)):
         print("Unexpected server error:", traceback.format_exc())
         return JSONResponse(content={"error": "Server error", "details": str(e)}, status_code=500)
 
+@app.post("/chat/stream")
+async def chat_stream(req: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    """Same as /chat, but sends the reply as Server-Sent Events.
+
+    Each raw model chunk is sent as `data: {"token": ...}`. When the model is
+    done, a final `event: done` carries the same payload /chat returns (the
+    enhanced reply plus any media URLs), after the turn has been stored.
+    """
+    try:
+        user_id = _chat_user_id(req)
+        if isinstance(user_id, JSONResponse):
+            return user_id
+        prepared = await _prepare_chat(req)
+        if isinstance(prepared, JSONResponse):
+            return prepared
+        prompt, bot_name = prepared
+
+        allowed, tier, counted = await consume_message(db, user_id)
+        if not allowed:
+            return JSONResponse(content=FREE_LIMIT_RESPONSE, status_code=403)
+
+        # 🚦 Held until the stream finishes
+        slot = await _admit_chat(db, user_id, tier, counted)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print("Unexpected server error:", traceback.format_exc())
+        return JSONResponse(content={"error": "Server error", "details": str(e)}, status_code=500)
+
+    try:
+        history, overflow = await build_history(db, user_id, bot_name, prompt)
+        background_tasks.add_task(refresh_summary, user_id, overflow)
+        persona = persona_registry.get(bot_name)
+    except Exception as e:
+        slot.release()
+        print("Unexpected server error:", traceback.format_exc())
+        return JSONResponse(content={"error": "Server error", "details": str(e)}, status_code=500)
+    # In case the client goes away before the stream body is ever iterated
+    background_tasks.add_task(slot.release)
+
+    async def event_stream():
+        chunks = []
+        try:
+            async for token in stream_mythomax(prompt, history, persona.system_prompt, on_usage=persona.record_usage):
+                chunks.append(token)
+                yield _sse({"token": token})
+
+            # The request-scoped session may already be closed once streaming starts
+            async with AsyncSessionLocal() as stream_db:
+                response_data = await _finish_chat(stream_db, user_id, prompt, bot_name, "".join(chunks).strip())
+            # Runs with the other background tasks once the stream has been sent
+            background_tasks.add_task(remember_turn, user_id, prompt, response_data["response"])
+
+            print("FINAL BOT RESPONSE:", response_data)
+            yield _sse(response_data, event="done")
+        except StreamInterrupted as e:
+            # Half a reply: not stored, and the message goes back to the quota
+            print("Stream interrupted:", e)
+            if counted:
+                async with AsyncSessionLocal() as refund_db:
+                    await refund_message(refund_db, user_id)
+            yield _sse({"error": "Reply interrupted", "details": str(e)}, event="error")
+        except Exception as e:
+            print("Stream error:", traceback.format_exc())
+            yield _sse({"error": "Server error", "details": str(e)}, event="error")
+        finally:
+            slot.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 app.include_router(router)
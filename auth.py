@@ -5,9 +5,9 @@ import jwt
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from pydantic import BaseModel
 from jwt import PyJWTError
+import passwords
 
 # Load environment variables
 load_dotenv()
@@ -16,8 +16,6 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")  # URL of your login endpoint
 
 # Pydantic models for token data and token response
@@ -28,11 +26,11 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await passwords.averify_password(plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await passwords.ahash_password(password)
 
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)):
     to_encode = data.copy()
@@ -45,7 +43,7 @@ def send_verification_email(email: str):
     # Placeholder for email sending logic (e.g., SendGrid, SMTP, Resend)
     pass
 
-def signup_user(db, email: str, password: str):
+async def signup_user(db, email: str, password: str):
     from models import User  # Import your User model here to avoid circular imports
 
     # Check if user exists in the DB
@@ -53,7 +51,7 @@ def signup_user(db, email: str, password: str):
     if user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash(password)
     new_user = User(email=email, hashed_password=hashed_password)
     db.add(new_user)
     db.commit()
@@ -68,7 +66,7 @@ async def authenticate_user(db, email: str, password: str):
     user = db.query(User).filter(User.email == email).first()
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
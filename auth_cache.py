@@ -0,0 +1,137 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "50000"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "50000"))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))  # seconds
+# Longest lifetime of an issued token (/login: 7 days); older user revocations can't match a live token
+AUTH_TOKEN_MAX_AGE = float(os.getenv("AUTH_TOKEN_MAX_AGE", str(7 * 86400)))  # seconds
+
+
+class AuthUser:
+    """The User fields request handlers need, detached from any session."""
+
+    __slots__ = ("id", "email", "is_verified")
+
+    def __init__(self, id, email, is_verified):
+        self.id = id
+        self.email = email
+        self.is_verified = is_verified
+
+
+def _token_key(token: str) -> bytes:
+    # Don't keep bearer tokens themselves in memory
+    return hashlib.sha256(token.encode()).digest()
+
+
+class AuthCache:
+    """Verified JWT claims and user rows for the auth dependencies.
+
+    Claims are kept until the token's own `exp` (LRU-bounded), so a token is
+    only decoded and its signature checked once per process. User rows are
+    kept for `user_ttl` seconds. `revoke_token` / `revoke_user` evict both and
+    make this process reject the token(s) until they expire; they are not
+    shared between workers.
+    """
+
+    def __init__(self, max_tokens=AUTH_TOKEN_CACHE_SIZE, max_users=AUTH_USER_CACHE_SIZE, user_ttl=AUTH_USER_CACHE_TTL):
+        self.max_tokens = max_tokens
+        self.max_users = max_users
+        self.user_ttl = user_ttl
+        self._claims = OrderedDict()  # sha256(token) -> claims
+        self._users = OrderedDict()   # user_id -> (stale_at, AuthUser)
+        self._revoked_tokens = {}     # sha256(token) -> exp
+        self._revoked_users = {}      # user_id -> revoked at (epoch seconds)
+        self.stats_counters = {"token_hits": 0, "token_misses": 0, "user_hits": 0, "user_misses": 0}
+
+    # Token claims
+
+    def get_claims(self, token: str):
+        key = _token_key(token)
+        claims = self._claims.get(key)
+        if claims is not None:
+            if claims.get("exp", 0) > time.time():
+                self._claims.move_to_end(key)
+                self.stats_counters["token_hits"] += 1
+                return claims
+            del self._claims[key]  # let the decoder report the expiry
+        self.stats_counters["token_misses"] += 1
+        return None
+
+    def put_claims(self, token: str, claims: dict):
+        if "exp" not in claims:
+            return  # never cache a token that doesn't expire
+        key = _token_key(token)
+        self._claims[key] = claims
+        self._claims.move_to_end(key)
+        while len(self._claims) > self.max_tokens:
+            self._claims.popitem(last=False)
+
+    def is_revoked(self, token: str, claims: dict) -> bool:
+        if _token_key(token) in self._revoked_tokens:
+            return True
+        revoked_at = self._revoked_users.get(claims.get("sub"))
+        return revoked_at is not None and claims.get("iat", 0) < revoked_at
+
+    # User rows
+
+    def get_user(self, user_id: str):
+        entry = self._users.get(user_id)
+        if entry is not None:
+            stale_at, user = entry
+            if stale_at > time.monotonic():
+                self._users.move_to_end(user_id)
+                self.stats_counters["user_hits"] += 1
+                return user
+            del self._users[user_id]
+        self.stats_counters["user_misses"] += 1
+        return None
+
+    def put_user(self, user) -> AuthUser:
+        cached = AuthUser(user.id, user.email, user.is_verified)
+        self._users[user.id] = (time.monotonic() + self.user_ttl, cached)
+        self._users.move_to_end(user.id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return cached
+
+    def evict_user(self, user_id: str):
+        """Drop the cached row after the user changes (e.g. email verified)."""
+        self._users.pop(user_id, None)
+
+    # Revocation
+
+    def revoke_token(self, token: str, claims: dict):
+        key = _token_key(token)
+        self._claims.pop(key, None)
+        self._revoked_tokens[key] = claims.get("exp", time.time())
+        self.evict_user(claims.get("sub"))
+        self._prune_revoked()
+
+    def revoke_user(self, user_id: str):
+        """Reject every token issued to `user_id` before the current second.
+
+        `iat` has whole-second precision, so a token from this same second is
+        kept: a login right after "log out everywhere" must still work.
+        """
+        self._revoked_users[user_id] = int(time.time())
+        for key in [k for k, claims in self._claims.items() if claims.get("sub") == user_id]:
+            del self._claims[key]
+        self.evict_user(user_id)
+        self._prune_revoked()
+
+    def _prune_revoked(self):
+        now = time.time()
+        for key in [k for k, exp in self._revoked_tokens.items() if exp <= now]:
+            del self._revoked_tokens[key]
+        for user_id in [u for u, revoked_at in self._revoked_users.items() if revoked_at <= now - AUTH_TOKEN_MAX_AGE]:
+            del self._revoked_users[user_id]
+
+    def stats(self) -> dict:
+        return {**self.stats_counters, "tokens": len(self._claims), "users": len(self._users),
+                "revoked_tokens": len(self._revoked_tokens), "revoked_users": len(self._revoked_users)}
+
+
+auth_cache = AuthCache()
@@ -1,19 +1,16 @@
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from database import SessionLocal
 from models import User
+import passwords
 
 SECRET_KEY = "your-very-secret-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 password flow token extractor
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
@@ -26,12 +23,12 @@ def get_db():
         db.close()
 
 # Hash a password
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await passwords.ahash_password(password)
 
 # Verify a password against a hash
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+async def verify_password(plain: str, hashed: str) -> bool:
+    return await passwords.averify_password(plain, hashed)
 
 # Create JWT access token
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
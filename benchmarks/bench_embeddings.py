@@ -0,0 +1,87 @@
+"""Embedding throughput on CPU: one encode per request vs the micro-batching service.
+
+Fires --requests concurrent single-text encode requests (chat-turn sized
+texts, --repeat-share of them repeats of earlier texts) three ways:
+
+  direct     each request encodes on its own thread, as before the service
+  batched    EmbeddingService with the cache off, so only batching counts
+  cached     EmbeddingService with the content-hash LRU on
+
+    python benchmarks/bench_embeddings.py --requests 512 --concurrency 64
+
+Uses EMBEDDING_MODEL (all-MiniLM-L6-v2 by default); the first run downloads it.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import embeddings  # noqa: E402
+
+WORDS = ("hey babe what are you doing tonight i missed you so much tell me about your day "
+         "the weather was awful but work went fine and i kept thinking about our last chat").split()
+
+
+def make_texts(n, repeat_share, seed=7):
+    rnd = random.Random(seed)
+    texts = []
+    for _ in range(n):
+        if texts and rnd.random() < repeat_share:
+            texts.append(rnd.choice(texts))
+        else:
+            texts.append("User: " + " ".join(rnd.choices(WORDS, k=rnd.randint(8, 40))))
+    return texts
+
+
+async def run(label, encode_one, texts, concurrency):
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(text):
+        async with gate:
+            start = time.perf_counter()
+            await encode_one(text)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(t) for t in texts))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{label:<8} {len(texts) / elapsed:8.1f} texts/s   p50 {statistics.median(latencies) * 1000:8.1f} ms   "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--repeat-share", type=float, default=0.3)
+    parser.add_argument("--max-batch", type=int, default=embeddings.EMBED_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=embeddings.EMBED_MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    texts = make_texts(args.requests, args.repeat_share)
+    embeddings.embed(["warm up"])
+    print(f"{embeddings.EMBEDDING_MODEL}, {args.requests} requests, concurrency {args.concurrency}, "
+          f"{args.repeat_share:.0%} repeats\n")
+
+    await run("direct", lambda t: asyncio.to_thread(embeddings.embed, [t]), texts, args.concurrency)
+
+    for label, cache_size in (("batched", 0), ("cached", embeddings.EMBED_CACHE_SIZE)):
+        service = embeddings.EmbeddingService(max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                                              cache_size=cache_size, cache_path="")
+        await run(label, lambda t: service.encode([t]), texts, args.concurrency)
+        await service.close()
+        stats = service.stats()
+        print(f"{'':<8} batches {stats['batches']}, mean size {stats['mean_batch_size']}, "
+              f"cache hits {stats['cache_hits']}, coalesced {stats['coalesced']}, "
+              f"queue wait p50 {stats['queue_wait_ms']['p50']} ms / p95 {stats['queue_wait_ms']['p95']} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
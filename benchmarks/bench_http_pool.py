@@ -0,0 +1,152 @@
+"""Per-call cost of a fresh HTTP client vs the shared pooled clients.
+
+Starts a local stand-in upstream (keep-alive HTTP/1.1, optional TLS) and times
+N sequential calls made the old way (new client per call) and the new way
+(one shared client from http_clients).
+
+    python benchmarks/bench_http_pool.py --calls 300 --latency-ms 5 --tls
+
+--tls needs the `openssl` binary to mint a throwaway self-signed cert; it is
+closer to production since most of the saving is the TLS handshake.
+"""
+import argparse
+import asyncio
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httpx  # noqa: E402
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    latency = 0.0
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps({"choices": [{"message": {"content": "ok"}}], "payment_status": "waiting"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(latency_ms, tls):
+    StandInHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    scheme = "http"
+    if tls:
+        tmp = tempfile.mkdtemp()
+        cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert],
+            check=True, capture_output=True,
+        )
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(cert, key)
+        server.socket = ctx.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}"
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<28} mean {statistics.mean(samples) * 1000:7.2f} ms   "
+          f"p50 {statistics.median(samples) * 1000:7.2f} ms   p95 {p95 * 1000:7.2f} ms")
+    return statistics.mean(samples)
+
+
+def bench_sync(base_url, calls):
+    fresh = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        with httpx.Client(verify=False) as client:
+            client.post(f"{base_url}/chat/completions", json={"messages": []})
+        fresh.append(time.perf_counter() - start)
+
+    import http_clients
+    os.environ["OPENROUTER_BASE_URL"] = base_url
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench-key")
+    pooled = []
+    client = http_clients.get_sync_client("openrouter")
+    for _ in range(calls):
+        start = time.perf_counter()
+        client.post("/chat/completions", json={"messages": []})
+        pooled.append(time.perf_counter() - start)
+    return fresh, pooled
+
+
+async def bench_async(base_url, calls):
+    fresh = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        async with httpx.AsyncClient(verify=False) as client:
+            await client.get(f"{base_url}/payment/1")
+        fresh.append(time.perf_counter() - start)
+
+    import http_clients
+    os.environ["NOWPAYMENTS_BASE_URL"] = base_url
+    pooled = []
+    client = http_clients.get_async_client("nowpayments")
+    for _ in range(calls):
+        start = time.perf_counter()
+        await client.get("/payment/1")
+        pooled.append(time.perf_counter() - start)
+    await http_clients.shutdown_clients()
+    return fresh, pooled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated upstream processing time")
+    parser.add_argument("--tls", action="store_true", help="serve over HTTPS with a self-signed cert")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.latency_ms, args.tls)
+    if args.tls:
+        # The stand-in cert is self-signed; let the shared clients accept it
+        import http_clients
+        original = http_clients._client_kwargs
+        http_clients._client_kwargs = lambda name: {**original(name), "verify": False}
+
+    print(f"Stand-in upstream at {base_url}, {args.calls} sequential calls each\n")
+    fresh, pooled = bench_sync(base_url, args.calls)
+    fresh_mean = summarize("sync  new client per call", fresh)
+    pooled_mean = summarize("sync  shared client", pooled)
+    print(f"{'':<28} saving {(fresh_mean - pooled_mean) * 1000:.2f} ms/call\n")
+
+    fresh, pooled = asyncio.run(bench_async(base_url, args.calls))
+    fresh_mean = summarize("async new client per call", fresh)
+    pooled_mean = summarize("async shared client", pooled)
+    print(f"{'':<28} saving {(fresh_mean - pooled_mean) * 1000:.2f} ms/call")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Login throughput vs password-hash pool size, and what a login burst does to other requests.
+
+Runs --logins concurrent bcrypt checks at BCRYPT_ROUNDS cost, first the old
+way (bcrypt inside the request threadpool, like a sync endpoint) and then
+through passwords.py with each --pool-sizes value (0 = thread fallback).
+While the burst runs, a probe keeps making small threadpool calls, standing
+in for unrelated sync endpoints; its latency shows whether they starve.
+
+    python benchmarks/bench_passwords.py --logins 200 --pool-sizes 1,2,4,8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import passwords  # noqa: E402
+
+REQUEST_THREADS = 40  # anyio's default threadpool size, which serves FastAPI's sync endpoints
+
+
+async def probe(stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.to_thread(lambda: None)
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def run(label, check, logins):
+    stop, samples = asyncio.Event(), []
+    prober = asyncio.create_task(probe(stop, samples))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(check() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await prober
+    assert all(results)
+    samples.sort()
+    print(f"{label:<14} {logins / elapsed:8.1f} logins/s   other requests: p50 "
+          f"{statistics.median(samples) * 1000:8.2f} ms   p95 {samples[int(len(samples) * 0.95) - 1] * 1000:8.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--pool-sizes", default="1,2,4,8")
+    args = parser.parse_args()
+
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(REQUEST_THREADS))
+    hashed = bcrypt.hashpw(b"hunter2", bcrypt.gensalt(passwords.BCRYPT_ROUNDS)).decode()
+    print(f"bcrypt cost {passwords.BCRYPT_ROUNDS}, {args.logins} concurrent logins, {os.cpu_count()} CPUs\n")
+
+    await run("inline", lambda: asyncio.to_thread(bcrypt.checkpw, b"hunter2", hashed.encode()), args.logins)
+    for size in [int(s) for s in args.pool_sizes.split(",")]:
+        passwords.shutdown_pool()
+        passwords.PASSWORD_HASH_WORKERS = size
+        await asyncio.to_thread(passwords.start_pool)
+        await run(f"pool={size}", lambda: passwords.averify_password("hunter2", hashed), args.logins)
+    passwords.shutdown_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+"""Legacy user_memory.json vs the SQLite-WAL profile store in usermemory.py.
+
+Builds a profile file with --users users, then times single-user reads and
+updates both ways, the one-off import, and a multi-process write test that
+counts lost updates (each writer adds its own keys to the same profiles;
+every key should survive).
+
+    python benchmarks/bench_profiles.py --users 100000
+
+The legacy store rewrites the whole file per call, so it only gets
+--legacy-ops calls.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import usermemory  # noqa: E402
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p99 = samples[max(0, int(len(samples) * 0.99) - 1)]
+    print(f"{label:<30} n={len(samples):<6} mean {statistics.mean(samples) * 1000:9.3f} ms   "
+          f"p50 {statistics.median(samples) * 1000:9.3f} ms   p99 {p99 * 1000:9.3f} ms")
+
+
+def make_profiles(users):
+    return {
+        f"user-{i}": {"name": f"name{i}", "likes": ["roleplay", "teasing"], "persona": "Lily",
+                      "messages": i % 500, "last_seen": datetime.now().isoformat()}
+        for i in range(users)
+    }
+
+
+# The pre-SQLite implementation, kept here for comparison
+def legacy_get(path, user_id):
+    with open(path) as f:
+        return json.load(f).get(user_id, {})
+
+
+def legacy_update(path, user_id, updates):
+    with open(path) as f:
+        memory = json.load(f)
+    user_data = memory.get(user_id, {})
+    user_data.update(updates)
+    user_data["last_seen"] = datetime.now().isoformat()
+    memory[user_id] = user_data
+    with open(path, "w") as f:
+        json.dump(memory, f, indent=2)
+
+
+def _writer(kind, path, worker, users, updates):
+    if kind == "sqlite":
+        usermemory.PROFILE_DB_PATH = path
+    for i in range(updates):
+        user_id = f"user-{i % users}"
+        if kind == "sqlite":
+            usermemory.update_user_profile(user_id, {f"w{worker}_{i}": i})
+        else:
+            try:
+                legacy_update(path, user_id, {f"w{worker}_{i}": i})
+            except json.JSONDecodeError:
+                pass  # read the file while another process was rewriting it; counted as lost
+
+
+def lost_updates(kind, path, workers, users, updates):
+    ctx = multiprocessing.get_context("spawn")  # fresh connections in each process
+    procs = [ctx.Process(target=_writer, args=(kind, path, w, users, updates)) for w in range(workers)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+    found = 0
+    for u in range(users):
+        profile = usermemory.get_user_profile(f"user-{u}") if kind == "sqlite" else legacy_get(path, f"user-{u}")
+        found += sum(1 for k in profile if k.startswith("w"))
+    expected = workers * updates
+    print(f"{kind:<8} {workers} processes x {updates} updates: {elapsed:6.2f}s, "
+          f"{expected - found} of {expected} updates lost")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--ops", type=int, default=5000, help="reads and updates against the new store")
+    parser.add_argument("--legacy-ops", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--worker-updates", type=int, default=300)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    json_path = os.path.join(tmp, "user_memory.json")
+    db_path = os.path.join(tmp, "user_memory.db")
+    profiles = make_profiles(args.users)
+    with open(json_path, "w") as f:
+        json.dump(profiles, f, indent=2)
+    print(f"{args.users} profiles, legacy file {os.path.getsize(json_path) / 1e6:.1f} MB\n")
+
+    ids = list(profiles)
+    reads, writes = [], []
+    for _ in range(args.legacy_ops):
+        user_id = random.choice(ids)
+        start = time.perf_counter()
+        legacy_get(json_path, user_id)
+        reads.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        legacy_update(json_path, user_id, {"mood": "flirty"})
+        writes.append(time.perf_counter() - start)
+    summarize("legacy json  get", reads)
+    summarize("legacy json  update", writes)
+
+    usermemory.PROFILE_DB_PATH = db_path
+    start = time.perf_counter()
+    usermemory.import_structured_memory(json_path)
+    print(f"{'import':<30} {time.perf_counter() - start:.2f}s")
+
+    reads, writes = [], []
+    for _ in range(args.ops):
+        user_id = random.choice(ids)
+        start = time.perf_counter()
+        usermemory.get_user_profile(user_id)
+        reads.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        usermemory.update_user_profile(user_id, {"mood": "flirty"})
+        writes.append(time.perf_counter() - start)
+    summarize("sqlite-wal   get", reads)
+    summarize("sqlite-wal   update", writes)
+
+    print()
+    # Few users so writers keep colliding; the legacy file is kept small so it finishes
+    small_json = os.path.join(tmp, "small.json")
+    with open(small_json, "w") as f:
+        json.dump(make_profiles(50), f)
+    lost_updates("json", small_json, args.workers, 50, args.worker_updates)
+    lost_updates("sqlite", db_path, args.workers, 50, args.worker_updates)
+
+
+if __name__ == "__main__":
+    main()
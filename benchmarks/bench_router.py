@@ -0,0 +1,141 @@
+"""LLMRouter under failure: breaker, failover, half-open recovery and hedging.
+
+Starts two fake OpenRouters ("primary" and "backup", see fake_upstreams.py),
+points an LLMRouter at them and changes the primary through `POST /_config`
+between phases:
+
+1. healthy      every completion comes from the primary
+2. failing      primary error_rate=1: requests fail over to the backup, and
+                after --failures errors the primary's breaker opens and it
+                gets no more calls
+3. recovered    primary healthy again: after --reset seconds one half-open
+                trial goes to it, succeeds, and the breaker closes
+4. slow         primary latency --slow-ms: once the primary is slower than
+                its recent p95, the backup is hedged in and answers first
+
+Each phase prints what the fakes saw and fails loudly if the router did not
+behave as described.
+
+    python benchmarks/bench_router.py --latency-ms 40 --slow-ms 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+# Read by llm_backends at import: hedge after the primary's p95, even when that is well under 0.5 s
+os.environ.setdefault("LLM_HEDGE_MIN_DELAY", "0.1")
+
+import httpx  # noqa: E402
+
+import fake_upstreams  # noqa: E402
+from http_clients import shutdown_clients  # noqa: E402
+from llm_backends import CircuitBreaker, LLMRouter, Provider  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "hey you"}]
+
+
+def configure(fake, **config):
+    httpx.post(f"{fake.url}/_config", json=config).raise_for_status()
+
+
+def check(ok, what):
+    print(f"   {'ok  ' if ok else 'FAIL'} {what}")
+    if not ok:
+        raise SystemExit(1)
+
+
+async def run_calls(router, n):
+    """n sequential completions. Returns the seconds each took."""
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        await router.complete(MESSAGES)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+async def scenario(args, primary_fake, backup_fake):
+    primary = Provider("primary", "fake-model", base_url=f"{primary_fake.url}/api/v1", timeout=10)
+    backup = Provider("backup", "fake-model", base_url=f"{backup_fake.url}/api/v1", timeout=10)
+    primary.breaker = CircuitBreaker(failure_threshold=args.failures, reset_timeout=args.reset)
+    router = LLMRouter([primary, backup], hedging=True)
+
+    def calls():
+        return primary_fake.calls, backup_fake.calls
+
+    print(f"1. healthy ({args.warmup} calls)")
+    times = await run_calls(router, args.warmup)
+    p, b = calls()
+    print(f"   primary {p} calls, backup {b}, p50 {sorted(times)[len(times) // 2] * 1000:.0f} ms, "
+          f"hedge delay now {primary.hedge_delay() * 1000:.0f} ms")
+    check(p == args.warmup and b == 0, "every completion came from the primary")
+
+    print(f"2. failing (primary error_rate=1, {args.failures * 3} calls)")
+    configure(primary_fake, error_rate=1)
+    p0, b0 = calls()
+    await run_calls(router, args.failures * 3)
+    p, b = calls()
+    print(f"   primary {p - p0} calls, backup {b - b0}, breaker {primary.breaker.state}")
+    check(b - b0 == args.failures * 3, "every completion failed over to the backup")
+    check(primary.breaker.state == "open", "the primary's breaker opened")
+    check(p - p0 == args.failures, f"the primary got no calls once {args.failures} had failed")
+
+    print(f"3. recovered (primary healthy, after {args.reset:.1f} s)")
+    configure(primary_fake, error_rate=0)
+    await run_calls(router, 3)
+    check(primary.breaker.state == "open", "still open before the reset timeout")
+    await asyncio.sleep(args.reset)
+    p0, b0 = calls()
+    await run_calls(router, 3)
+    p, b = calls()
+    print(f"   primary {p - p0} calls, backup {b - b0}, breaker {primary.breaker.state}")
+    check(primary.breaker.state == "closed", "the half-open trial succeeded and closed the breaker")
+    check(p - p0 == 3 and b - b0 == 0, "traffic went back to the primary")
+
+    print(f"4. slow (primary latency {args.slow_ms:.0f} ms)")
+    configure(primary_fake, latency_ms=args.slow_ms)
+    delay = primary.hedge_delay()
+    p0, b0 = calls()
+    times = await run_calls(router, 3)
+    p, b = calls()
+    print(f"   primary {p - p0} calls, backup {b - b0}, hedge after {delay * 1000:.0f} ms, "
+          f"slowest completion {max(times) * 1000:.0f} ms")
+    check(b - b0 == 3, "the backup was hedged in on every call")
+    check(max(times) < args.slow_ms / 1000, "hedged completions beat the slow primary")
+    check(primary.breaker.state == "closed", "abandoned primary calls did not count as failures")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    parser.add_argument("--slow-ms", type=float, default=2000)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--failures", type=int, default=3, help="breaker failure threshold")
+    parser.add_argument("--reset", type=float, default=1.0, help="breaker reset timeout, seconds")
+    args = parser.parse_args()
+
+    primary_fake = fake_upstreams.fake_openrouter(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 4).start()
+    backup_fake = fake_upstreams.fake_openrouter(latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 4).start()
+
+    async def run():
+        try:
+            await scenario(args, primary_fake, backup_fake)
+        finally:
+            await shutdown_clients()
+
+    try:
+        asyncio.run(run())
+        print("\nall phases behaved as expected")
+    finally:
+        primary_fake.stop()
+        backup_fake.stop()
+
+
+if __name__ == "__main__":
+    main()
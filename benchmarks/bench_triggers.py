@@ -0,0 +1,85 @@
+"""Trigger matching per chat turn: the old substring scans vs the compiled engine.
+
+Builds --prompts chat-style prompts, some with trigger words, some with
+look-alikes ("hardware", "photography", "wetsuit"). It then times what one
+turn used to cost (is_prompt_sexy twice plus the image check, each
+lowercasing the prompt and testing every word) against one
+trigger_engine.match(). It also counts the prompts where the two disagree, and
+prints a few of them.
+
+    python benchmarks/bench_triggers.py --prompts 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from triggers import DEFAULT_TRIGGERS, ANY_PERSONA, TriggerEngine  # noqa: E402
+
+AUDIO = DEFAULT_TRIGGERS[ANY_PERSONA]["audio"]
+IMAGE = DEFAULT_TRIGGERS[ANY_PERSONA]["image"]
+PERSONAS = ["Default", "Lily", "Raven", "Plaksha"]
+
+FILLER = ("hey babe what are you doing tonight i missed you so much tell me about your day the weather was "
+          "awful but work went fine and i kept thinking about you all afternoon can't wait to see you").split()
+TRIGGERS = ("kiss kissing moaning touch me lick horny naughty so wet harder turn me on fuck fucking "
+            "send a pic pics please show me a photo nudes picture of you").split()
+LOOKALIKES = "hardware photography wetsuit picnic kissinger touchy suckers imagery chard".split()
+
+
+def make_prompts(n, seed=7):
+    rnd = random.Random(seed)
+    prompts = []
+    for _ in range(n):
+        words = rnd.choices(FILLER, k=rnd.randint(4, 30))
+        for pool, share in ((TRIGGERS, 0.3), (LOOKALIKES, 0.1)):
+            if rnd.random() < share:
+                words.insert(rnd.randrange(len(words) + 1), rnd.choice(pool))
+        if rnd.random() < 0.3:
+            words[0] = words[0].capitalize()
+        prompts.append(" ".join(words))
+    return prompts
+
+
+def legacy(prompt):
+    sexy = any(word in prompt.lower() for word in AUDIO)  # enhance_immersive_reply
+    sexy = any(word in prompt.lower() for word in AUDIO)  # _finish_chat again
+    image = any(word in prompt.lower() for word in IMAGE)
+    return frozenset(c for c, hit in (("audio", sexy), ("image", image)) if hit)
+
+
+def timed(label, fn, prompts, personas, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for prompt, persona in zip(prompts, personas):
+            fn(prompt, persona)
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<8} {len(prompts) / best:12.0f} prompts/s   {best / len(prompts) * 1e6:6.2f} µs/prompt")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    prompts = make_prompts(args.prompts)
+    personas = [random.Random(i).choice(PERSONAS) for i in range(len(prompts))]
+    engine = TriggerEngine(path="")
+    print(f"{len(prompts)} prompts, {len(AUDIO) + len(IMAGE)} trigger phrases\n")
+
+    timed("legacy", lambda p, _: legacy(p), prompts, personas, args.rounds)
+    timed("engine", engine.match, prompts, personas, args.rounds)
+
+    differ = [(p, sorted(legacy(p)), sorted(engine.match(p))) for p in prompts if legacy(p) != engine.match(p)]
+    print(f"\n{len(differ)} prompts matched differently ({len(differ) / len(prompts):.1%}), e.g.:")
+    for prompt, old, new in sorted(differ, key=lambda d: len(d[0]))[:5]:
+        print(f"  old {old!s:<20} new {new!s:<20} {prompt[:70]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Local stand-ins for OpenRouter, NowPayments, Resend and Supabase storage.
+
+Each fake is its own small FastAPI app on its own port, with configurable
+latency, jitter and error rate. Settings can be changed while running with
+`POST /_config` (e.g. `{"latency_ms": 2000}` or `{"error_rate": 1}`) to make
+an upstream slow or failing mid-run.
+
+    python benchmarks/fake_upstreams.py --openrouter-latency-ms 800
+
+prints the env vars that point the app at the fakes and serves until Ctrl-C.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY = ("Mmm, I was hoping you'd say that. Come closer and tell me exactly what you want tonight, "
+         "I'm all yours and I want to hear every detail.")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeUpstream:
+    def __init__(self, name, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, **extra):
+        self.name = name
+        self.config = {"latency_ms": latency_ms, "jitter_ms": jitter_ms, "error_rate": error_rate, **extra}
+        self.calls = 0
+        self.app = FastAPI()
+        self.port = None
+        self.server = None
+
+        @self.app.post("/_config")
+        async def update_config(req: Request):
+            self.config.update(await req.json())
+            return self.config
+
+        @self.app.get("/_stats")
+        async def stats():
+            return {"calls": self.calls, "config": self.config}
+
+    async def delay(self):
+        """Simulated upstream latency. Returns an error response to send, or None."""
+        self.calls += 1
+        ms = self.config["latency_ms"] + random.uniform(-1, 1) * self.config["jitter_ms"]
+        if ms > 0:
+            await asyncio.sleep(ms / 1000)
+        if random.random() < self.config["error_rate"]:
+            return JSONResponse({"error": f"fake {self.name} failure"}, status_code=503)
+        return None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self.port = _free_port()
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.02)
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.should_exit = True
+
+
+def fake_openrouter(latency_ms=600.0, jitter_ms=200.0, error_rate=0.0, token_ms=15.0):
+    fake = FakeUpstream("openrouter", latency_ms, jitter_ms, error_rate, token_ms=token_ms)
+    seen_prefixes = set()
+
+    def prompt_usage(messages):
+        # Like a provider prompt cache: the leading messages already seen, byte for byte, count as cached
+        prefix, prompt_tokens, cached_tokens, cached = hashlib.sha256(), 0, 0, True
+        for message in messages:
+            prefix.update(json.dumps(message, sort_keys=True).encode())
+            tokens = len(message.get("content", "")) // 4
+            prompt_tokens += tokens
+            digest = prefix.hexdigest()
+            cached = cached and digest in seen_prefixes
+            cached_tokens += tokens if cached else 0
+            seen_prefixes.add(digest)
+        return prompt_tokens, cached_tokens
+
+    @fake.app.post("/api/v1/chat/completions")
+    async def completions(req: Request):
+        body = await req.json()
+        error = await fake.delay()
+        if error:
+            return error
+        prompt_tokens, cached_tokens = prompt_usage(body.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(REPLY) // 4,
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        if not body.get("stream"):
+            return {"model": body.get("model"), "choices": [{"message": {"role": "assistant", "content": REPLY}}],
+                    "usage": usage}
+
+        async def tokens():
+            yield ": OPENROUTER PROCESSING\n\n"
+            for word in REPLY.split(" "):
+                await asyncio.sleep(fake.config["token_ms"] / 1000)
+                yield "data: " + json.dumps({"choices": [{"delta": {"content": word + " "}}]}) + "\n\n"
+            yield "data: " + json.dumps({"choices": [], "usage": usage}) + "\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(tokens(), media_type="text/event-stream")
+
+    return fake
+
+
+def fake_nowpayments(latency_ms=150.0, jitter_ms=50.0, error_rate=0.0, payment_status="finished"):
+    fake = FakeUpstream("nowpayments", latency_ms, jitter_ms, error_rate, payment_status=payment_status)
+
+    @fake.app.get("/v1/payment/{payment_id}")
+    async def payment(payment_id: str):
+        error = await fake.delay()
+        if error:
+            return error
+        return {"payment_id": payment_id, "payment_status": fake.config["payment_status"]}
+
+    return fake
+
+
+def fake_resend(latency_ms=120.0, jitter_ms=40.0, error_rate=0.0):
+    fake = FakeUpstream("resend", latency_ms, jitter_ms, error_rate)
+    fake.sent = {}  # recipient -> last email, so load tests can read verification codes
+
+    def record(email):
+        for to in email.get("to", []):
+            fake.sent[to] = email
+
+    @fake.app.post("/emails")
+    async def send(req: Request):
+        email = await req.json()
+        error = await fake.delay()
+        if error:
+            return error
+        record(email)
+        return {"id": f"email_{fake.calls}"}
+
+    @fake.app.post("/emails/batch")
+    async def send_batch(req: Request):
+        emails = await req.json()
+        error = await fake.delay()
+        if error:
+            return error
+        for email in emails:
+            record(email)
+        return {"data": [{"id": f"email_{fake.calls}_{i}"} for i in range(len(emails))]}
+
+    @fake.app.get("/_sent/{recipient}")
+    async def last_sent(recipient: str):
+        return fake.sent.get(recipient) or JSONResponse({"error": "nothing sent"}, status_code=404)
+
+    return fake
+
+
+def fake_supabase(latency_ms=30.0, jitter_ms=10.0, error_rate=0.0, pics=44, voices=6):
+    fake = FakeUpstream("supabase", latency_ms, jitter_ms, error_rate)
+
+    @fake.app.post("/storage/v1/object/list/{bucket}")
+    async def list_objects(bucket: str, req: Request):
+        body = await req.json()
+        error = await fake.delay()
+        if error:
+            return error
+        prefix = body.get("prefix", "").strip("/")
+        if prefix == "pics":
+            names = [f"pic{i}.png" for i in range(1, pics + 1)]
+        elif prefix == "voices":
+            names = [f"moan{i}.mp3" for i in range(1, voices + 1)]
+        else:
+            names = []
+        offset = body.get("offset", 0)
+        names = names[offset:offset + body.get("limit", 100)]
+        return [{"name": n, "id": n, "metadata": {"size": 1024}} for n in names]
+
+    @fake.app.post("/storage/v1/object/sign/{bucket}")
+    async def sign_objects(bucket: str, req: Request):
+        body = await req.json()
+        error = await fake.delay()
+        if error:
+            return error
+        return [{"path": p, "signedURL": f"/object/sign/{bucket}/{p}?token={random.getrandbits(64):016x}", "error": None}
+                for p in body["paths"]]
+
+    return fake
+
+
+def start_all(**overrides):
+    """Start every fake. Returns ({name: FakeUpstream}, env vars for the app)."""
+    fakes = {
+        "openrouter": fake_openrouter(**overrides.get("openrouter", {})).start(),
+        "nowpayments": fake_nowpayments(**overrides.get("nowpayments", {})).start(),
+        "resend": fake_resend(**overrides.get("resend", {})).start(),
+        "supabase": fake_supabase(**overrides.get("supabase", {})).start(),
+    }
+    env = {
+        "OPENROUTER_BASE_URL": f"{fakes['openrouter'].url}/api/v1",
+        "OPENROUTER_API_KEY": "fake-openrouter-key",
+        "NOWPAYMENTS_BASE_URL": f"{fakes['nowpayments'].url}/v1",
+        "NOWPAYMENTS_API_KEY": "fake-nowpayments-key",
+        "RESEND_BASE_URL": fakes["resend"].url,
+        "RESEND_API_KEY": "fake-resend-key",
+        "SUPABASE_URL": fakes["supabase"].url,
+        "SUPABASE_KEY": "fake-supabase-key",
+    }
+    return fakes, env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for name in ("openrouter", "nowpayments", "resend", "supabase"):
+        parser.add_argument(f"--{name}-latency-ms", type=float)
+        parser.add_argument(f"--{name}-error-rate", type=float)
+    args = parser.parse_args()
+
+    overrides = {}
+    for name in ("openrouter", "nowpayments", "resend", "supabase"):
+        latency = getattr(args, f"{name}_latency_ms")
+        error_rate = getattr(args, f"{name}_error_rate")
+        overrides[name] = {k: v for k, v in (("latency_ms", latency), ("error_rate", error_rate)) if v is not None}
+
+    fakes, env = start_all(**overrides)
+    for key, value in env.items():
+        print(f"export {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for fake in fakes.values():
+            fake.stop()
+
+
+if __name__ == "__main__":
+    main()
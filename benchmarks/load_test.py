@@ -0,0 +1,290 @@
+"""Repeatable load test for the API against local fake upstreams.
+
+Starts the fakes from fake_upstreams.py, runs `api.main:app` under uvicorn in
+a subprocess (SQLite by default, or any DATABASE_URL such as a local
+Postgres), then has virtual users sign up, verify, log in and loop over a
+weighted mix of /chat, /payment-status, /webhook and /login calls.
+
+Reports throughput and p50/p95/p99 per endpoint, plus per-stage timings the
+app reports in its Server-Timing header, and can write them as JSON:
+
+    python benchmarks/load_test.py --users 20 --duration 30 --out bench.json
+    python benchmarks/load_test.py --baseline bench.json   # diff against an earlier run
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import fake_upstreams  # noqa: E402
+
+DEFAULT_MIX = "chat=6,payment-status=2,webhook=1,login=1"
+JWT_SECRET = "bench-jwt-secret-" + "x" * 32
+IPN_SECRET = "bench-ipn-secret"
+PROMPTS = [
+    "hey, how was your day?",
+    "tell me something naughty",
+    "send me a pic of you",
+    "I want to kiss you so bad",
+    "what are you wearing right now?",
+    "I missed you today",
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.stages = defaultdict(list)
+
+    def record(self, endpoint, seconds, status, server_timing=None):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+        for part in (server_timing or "").split(","):
+            match = re.match(r"\s*([\w.-]+);dur=([\d.]+)", part)
+            if match:
+                self.stages[f"{endpoint}.{match.group(1)}"].append(float(match.group(2)) / 1000)
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct))]  # noqa: E731
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+    }
+
+
+class VirtualUser:
+    def __init__(self, client, recorder, fakes, mix):
+        self.client = client
+        self.recorder = recorder
+        self.fakes = fakes
+        self.mix = mix
+        self.email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+        self.password = uuid.uuid4().hex
+        self.user_id = None
+        self.headers = {}
+
+    async def call(self, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(endpoint, time.perf_counter() - start, "error")
+            return None
+        self.recorder.record(endpoint, time.perf_counter() - start, response.status_code,
+                             response.headers.get("server-timing"))
+        return response
+
+    async def onboard(self):
+        await self.call("signup", "POST", "/signup", json={"email": self.email, "password": self.password})
+        # The app may send the email in the background; poll the fake Resend for it
+        code = None
+        for _ in range(50):
+            sent = await self.fakes["resend"].client.get(f"/_sent/{self.email}")
+            if sent.status_code == 200:
+                code = re.search(r"<strong>(\d+)</strong>", sent.json()["html"]).group(1)
+                break
+            await asyncio.sleep(0.1)
+        if code is None:
+            return False
+        await self.call("verify", "POST", "/verify", json={"email": self.email, "code": code})
+        return await self.login()
+
+    async def login(self):
+        response = await self.call("login", "POST", "/login", json={"email": self.email, "password": self.password})
+        if response is None or response.status_code != 200:
+            return False
+        data = response.json()
+        self.user_id = data["user_id"]
+        self.headers = {"Authorization": f"Bearer {data['access_token']}"}
+        return True
+
+    async def chat(self):
+        await self.call("chat", "POST", "/chat", headers=self.headers,
+                        json={"message": random.choice(PROMPTS), "bot_name": random.choice(["Default", "Lily", "Raven"])})
+
+    async def payment_status(self):
+        await self.call("payment-status", "GET", "/payment-status", headers=self.headers)
+
+    async def webhook(self):
+        body = json.dumps({
+            "payment_id": str(random.randint(10**8, 10**9)),
+            "payment_status": random.choice(["confirmed", "finished"]),
+            "order_id": f"{self.user_id}:{random.choice(['tier1', 'tier2', 'tier3'])}",
+        }, separators=(",", ":")).encode()
+        signature = hmac.new(IPN_SECRET.encode(), body, hashlib.sha512).hexdigest()
+        await self.call("webhook", "POST", "/webhook", content=body,
+                        headers={"x-nowpayments-sig": signature, "Content-Type": "application/json"})
+
+    async def run(self, deadline):
+        if not await self.onboard():
+            return
+        actions = {"chat": self.chat, "payment-status": self.payment_status, "webhook": self.webhook, "login": self.login}
+        names = list(self.mix)
+        weights = [self.mix[n] for n in names]
+        while time.monotonic() < deadline:
+            await actions[random.choices(names, weights)[0]]()
+
+
+def start_app(port, env, workers):
+    cmd = [sys.executable, "-m", "uvicorn", "api.main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, start_new_session=True)
+
+
+async def wait_healthy(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("app did not become healthy")
+
+
+async def drive(base_url, fakes, users, duration, mix):
+    recorder = Recorder()
+    for fake in fakes.values():
+        fake.client = httpx.AsyncClient(base_url=fake.url)
+    limits = httpx.Limits(max_connections=users * 2, max_keepalive_connections=users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        started = time.monotonic()
+        deadline = started + duration
+        await asyncio.gather(*(VirtualUser(client, recorder, fakes, mix).run(deadline) for _ in range(users)))
+        elapsed = time.monotonic() - started
+    for fake in fakes.values():
+        await fake.client.aclose()
+    return recorder, elapsed
+
+
+def build_report(recorder, elapsed, args):
+    endpoints = {}
+    for endpoint, samples in sorted(recorder.latencies.items()):
+        statuses = recorder.statuses[endpoint]
+        endpoints[endpoint] = {
+            **_percentiles(samples),
+            "rps": round(len(samples) / elapsed, 2),
+            "statuses": {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+            "errors": sum(v for k, v in statuses.items() if k == "error" or (isinstance(k, int) and k >= 500)),
+        }
+    return {
+        "config": {"users": args.users, "duration_s": args.duration, "workers": args.workers, "mix": args.mix,
+                   "database": "sqlite" if not args.database_url else args.database_url.split(":")[0],
+                   "openrouter_latency_ms": args.openrouter_latency_ms},
+        "elapsed_s": round(elapsed, 2),
+        "total_rps": round(sum(len(s) for s in recorder.latencies.values()) / elapsed, 2),
+        "endpoints": endpoints,
+        "stages": {name: _percentiles(samples) for name, samples in sorted(recorder.stages.items())},
+    }
+
+
+def print_report(report, baseline=None):
+    def delta(section, name, key):
+        if not baseline or name not in baseline.get(section, {}):
+            return ""
+        old = baseline[section][name].get(key)
+        new = report[section][name][key]
+        if not old:
+            return ""
+        return f" ({(new - old) / old * 100:+.0f}%)"
+
+    print(f"\nTotal throughput: {report['total_rps']} req/s over {report['elapsed_s']}s\n")
+    print(f"{'endpoint':<18}{'count':>7}{'rps':>9}{'p50 ms':>16}{'p95 ms':>16}{'p99 ms':>16}  statuses")
+    for name, row in report["endpoints"].items():
+        print(f"{name:<18}{row['count']:>7}{row['rps']:>9}"
+              f"{str(row['p50_ms']) + delta('endpoints', name, 'p50_ms'):>16}"
+              f"{str(row['p95_ms']) + delta('endpoints', name, 'p95_ms'):>16}"
+              f"{str(row['p99_ms']) + delta('endpoints', name, 'p99_ms'):>16}  {row['statuses']}")
+    if report["stages"]:
+        print(f"\n{'stage':<28}{'count':>7}{'p50 ms':>16}{'p95 ms':>16}{'p99 ms':>16}")
+        for name, row in report["stages"].items():
+            print(f"{name:<28}{row['count']:>7}"
+                  f"{str(row['p50_ms']) + delta('stages', name, 'p50_ms'):>16}"
+                  f"{str(row['p95_ms']) + delta('stages', name, 'p95_ms'):>16}"
+                  f"{str(row['p99_ms']) + delta('stages', name, 'p99_ms'):>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of steady load after onboarding starts")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted endpoint mix (default {DEFAULT_MIX})")
+    parser.add_argument("--database-url", help="e.g. postgresql://localhost/voxella_bench (default: fresh SQLite file)")
+    parser.add_argument("--openrouter-latency-ms", type=float, default=600)
+    parser.add_argument("--nowpayments-latency-ms", type=float, default=150)
+    parser.add_argument("--resend-latency-ms", type=float, default=120)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier JSON report to diff against")
+    args = parser.parse_args()
+
+    mix = {k: float(v) for k, v in (item.split("=") for item in args.mix.split(","))}
+    fakes, fake_env = fake_upstreams.start_all(
+        openrouter={"latency_ms": args.openrouter_latency_ms},
+        nowpayments={"latency_ms": args.nowpayments_latency_ms},
+        resend={"latency_ms": args.resend_latency_ms},
+    )
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/voxella_bench.db"
+    port = args.port or fake_upstreams._free_port()
+    env = {
+        **os.environ,
+        **fake_env,
+        "DATABASE_URL": database_url,
+        "JWT_SECRET": JWT_SECRET,
+        "NOWPAYMENTS_IPN_SECRET": IPN_SECRET,
+        "SERVER_TIMING": "1",
+        "PYTHONPATH": ROOT,
+    }
+    app = start_app(port, env, args.workers)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_healthy(base_url))
+        print(f"App up at {base_url} ({args.users} users, {args.duration}s, db={database_url.split(':')[0]})")
+        recorder, elapsed = asyncio.run(drive(base_url, fakes, args.users, args.duration, mix))
+    finally:
+        os.killpg(app.pid, signal.SIGTERM)
+        app.wait(timeout=10)
+        for fake in fakes.values():
+            fake.stop()
+
+    report = build_report(recorder, elapsed, args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
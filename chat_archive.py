@@ -0,0 +1,302 @@
+"""Monthly partitions, retention and cold archive for chat_history.
+
+On Postgres, chat_history becomes a table range-partitioned by month on
+`timestamp` (chat_history_pYYYY_MM, plus chat_history_default for anything
+outside them). Retention copies each month older than the cutoff into a
+gzipped JSONL file and drops its partition, so the live table and its indexes
+only cover recent months. Elsewhere (SQLite), the same job archives and
+deletes old rows month by month.
+
+    python chat_archive.py partition        # one-off: convert chat_history (Postgres)
+    python chat_archive.py maintain         # create partitions for the coming months
+    python chat_archive.py archive          # archive months older than CHAT_RETENTION_MONTHS
+    python chat_archive.py rehydrate --from 2025-01 --to 2025-03
+
+Run `maintain` and `archive` from a daily cron. Rows written before their
+month's partition exists land in the default partition. They are moved
+into the month's partition when it gets created.
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+from sqlalchemy import text, insert, select, delete, func, table, column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import engine
+from models import ChatMessage
+
+CHAT_ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "archive/chat_history")
+CHAT_RETENTION_MONTHS = int(os.getenv("CHAT_RETENTION_MONTHS", "6"))
+CHAT_PARTITIONS_AHEAD = int(os.getenv("CHAT_PARTITIONS_AHEAD", "2"))
+
+TABLE = ChatMessage.__tablename__
+DEFAULT_PARTITION = f"{TABLE}_default"
+COLUMNS = ["id", "user_id", "user_message", "bot_reply", "timestamp"]
+PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+BATCH = 5000
+
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def _add_months(month: datetime, n: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + n
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month: datetime) -> str:
+    return f"{TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def _table(name: str):
+    """chat_history's columns (and types) under another name, e.g. a partition."""
+    return table(name, *(column(c.name, c.type) for c in ChatMessage.__table__.columns))
+
+
+def _is_postgres(conn) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def is_partitioned(conn) -> bool:
+    if not _is_postgres(conn):
+        return False
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :table)"
+    ), {"table": TABLE}).scalar()
+
+
+def list_partitions(conn):
+    """Monthly partitions currently attached, as [(month, name)], oldest first."""
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"
+    ), {"table": TABLE}).scalars()
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append((datetime(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(months)
+
+
+def create_partition(conn, month: datetime):
+    """Attach the partition for `month`, moving any of its rows out of the default partition first."""
+    name = _partition_name(month)
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+        return
+    lo, hi = month, _add_months(month, 1)
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    # A new partition can't be attached while the default partition holds rows in its range
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :lo AND timestamp < :hi RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {"lo": lo, "hi": hi})
+    conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{lo:%Y-%m-%d}') TO ('{hi:%Y-%m-%d}')"))
+    print(f"🗂️ Created partition {name}")
+
+
+def maintain(ahead: int = CHAT_PARTITIONS_AHEAD):
+    """Make sure partitions exist from this month through `ahead` months out."""
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            print(f"{TABLE} is not partitioned; nothing to do")
+            return
+        this_month = _month_start(datetime.utcnow())
+        for n in range(ahead + 1):
+            create_partition(conn, _add_months(this_month, n))
+
+
+def partition_table(ahead: int = CHAT_PARTITIONS_AHEAD):
+    """One-off conversion of a plain chat_history table into a monthly-partitioned one (Postgres).
+
+    Runs in one transaction and holds an exclusive lock on chat_history while
+    rows are copied, so run it during a quiet period. Rows without a
+    timestamp are kept with 1970-01-01, which puts them in the default partition.
+    """
+    with engine.begin() as conn:
+        if not _is_postgres(conn):
+            raise SystemExit("Partitioning needs Postgres; on other databases `archive` deletes old rows instead")
+        if is_partitioned(conn):
+            print(f"{TABLE} is already partitioned")
+            return
+        legacy = f"{TABLE}_legacy"
+        conn.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": TABLE}).scalar()
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {legacy}"))
+        # Index names are schema-wide, so move the old ones out of the way
+        conn.execute(text(f"ALTER INDEX IF EXISTS {TABLE}_pkey RENAME TO {legacy}_pkey"))
+        for index in ChatMessage.__table__.indexes:
+            conn.execute(text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_legacy"))
+
+        conn.execute(text(f"""
+            CREATE TABLE {TABLE} (
+                id INTEGER NOT NULL DEFAULT nextval('{sequence}'::regclass),
+                user_id VARCHAR NOT NULL REFERENCES users (id),
+                user_message VARCHAR NOT NULL,
+                bot_reply VARCHAR NOT NULL,
+                timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        """))
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id"))
+        for index in ChatMessage.__table__.indexes:
+            index.create(bind=conn)
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+
+        oldest = conn.execute(text(f"SELECT MIN(timestamp) FROM {legacy}")).scalar()
+        this_month = _month_start(datetime.utcnow())
+        month = _month_start(oldest) if oldest else this_month
+        while month <= _add_months(this_month, ahead):
+            create_partition(conn, month)
+            month = _add_months(month, 1)
+
+        copied = conn.execute(text(
+            f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) "
+            f"SELECT id, user_id, user_message, bot_reply, COALESCE(timestamp, TIMESTAMP '1970-01-01') FROM {legacy}"
+        )).rowcount
+        conn.execute(text(f"DROP TABLE {legacy}"))
+        print(f"✅ Partitioned {TABLE}: {copied} rows copied")
+
+
+def _archive_paths(month: datetime):
+    return sorted(glob.glob(os.path.join(CHAT_ARCHIVE_DIR, f"{TABLE}_{month:%Y_%m}*.jsonl.gz")))
+
+
+def _archived_ids(month: datetime) -> set:
+    ids = set()
+    for path in _archive_paths(month):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            ids.update(json.loads(line)["id"] for line in f)
+    return ids
+
+
+def _write_archive(conn, source, month: datetime, *criteria) -> int:
+    """Append `source`'s rows for `month` to the archive. Returns how many were written.
+
+    Rows already in an earlier archive file for the month (e.g. rehydrated
+    ones) are skipped. Each run writes a new file; it only becomes visible
+    under its final name once it is complete and fsynced.
+    """
+    os.makedirs(CHAT_ARCHIVE_DIR, exist_ok=True)
+    seen = _archived_ids(month)
+    existing = len(_archive_paths(month))
+    path = os.path.join(CHAT_ARCHIVE_DIR, f"{TABLE}_{month:%Y_%m}" + (f".{existing}" if existing else "") + ".jsonl.gz")
+    result = conn.execution_options(stream_results=True, yield_per=BATCH).execute(
+        select(*(source.c[c] for c in COLUMNS)).where(*criteria).order_by(source.c.timestamp, source.c.id)
+    )
+    written = 0
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        for row in result:
+            if row.id in seen:
+                continue
+            record = dict(row._mapping)
+            record["timestamp"] = record["timestamp"].isoformat() if record["timestamp"] else None
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            written += 1
+        f.flush()
+        os.fsync(f.fileno())
+    if written:
+        os.replace(path + ".tmp", path)
+    else:
+        os.remove(path + ".tmp")
+    return written
+
+
+def archive(retention_months: int = CHAT_RETENTION_MONTHS):
+    """Move every month older than `retention_months` out of the database into the archive."""
+    cutoff = _add_months(_month_start(datetime.utcnow()), -retention_months)
+    with engine.connect() as conn:
+        partitioned = is_partitioned(conn)
+        old_partitions = [(m, name) for m, name in list_partitions(conn) if _add_months(m, 1) <= cutoff] if partitioned else []
+        loose = _table(DEFAULT_PARTITION if partitioned else TABLE)
+        oldest = conn.execute(select(func.min(loose.c.timestamp)).where(loose.c.timestamp < cutoff)).scalar()
+
+    for month, name in old_partitions:
+        with engine.begin() as conn:
+            written = _write_archive(conn, _table(name), month)
+            conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        print(f"📦 Archived {name}: {written} rows")
+
+    # Rows outside any monthly partition (or all rows, without partitioning)
+    month = _month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        in_month = (loose.c.timestamp >= month, loose.c.timestamp < _add_months(month, 1))
+        with engine.begin() as conn:
+            written = _write_archive(conn, loose, month, *in_month)
+            deleted = conn.execute(delete(loose).where(*in_month)).rowcount
+        if deleted:
+            print(f"📦 Archived {deleted} rows from {loose.name} for {month:%Y-%m} ({written} new)")
+        month = _add_months(month, 1)
+
+
+def rehydrate(first: datetime, last: datetime):
+    """Load archived months `first`..`last` back into chat_history. Rows already present are skipped."""
+    table = ChatMessage.__table__
+    month = _month_start(first)
+    while month <= _month_start(last):
+        paths = _archive_paths(month)
+        with engine.begin() as conn:
+            if paths and is_partitioned(conn):
+                create_partition(conn, month)
+            if conn.dialect.name == "postgresql":
+                statement = pg_insert(table).on_conflict_do_nothing()
+            elif conn.dialect.name == "sqlite":
+                statement = sqlite_insert(table).on_conflict_do_nothing()
+            else:
+                statement = insert(table)
+            loaded = 0
+            for path in paths:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    batch = []
+                    for line in f:
+                        record = json.loads(line)
+                        record["timestamp"] = datetime.fromisoformat(record["timestamp"]) if record["timestamp"] else None
+                        batch.append(record)
+                        if len(batch) >= BATCH:
+                            conn.execute(statement, batch)
+                            loaded += len(batch)
+                            batch = []
+                    if batch:
+                        conn.execute(statement, batch)
+                        loaded += len(batch)
+        if paths:
+            print(f"♻️ Rehydrated {month:%Y-%m}: {loaded} rows from {len(paths)} file(s)")
+        month = _add_months(month, 1)
+
+
+def _month_arg(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("partition", "maintain"):
+        cmd = commands.add_parser(name)
+        cmd.add_argument("--ahead", type=int, default=CHAT_PARTITIONS_AHEAD, help="months of partitions to create ahead")
+    cmd = commands.add_parser("archive")
+    cmd.add_argument("--retention-months", type=int, default=CHAT_RETENTION_MONTHS)
+    cmd = commands.add_parser("rehydrate")
+    cmd.add_argument("--from", dest="first", type=_month_arg, required=True, help="first month, YYYY-MM")
+    cmd.add_argument("--to", dest="last", type=_month_arg, help="last month, YYYY-MM (default: same as --from)")
+    args = parser.parse_args()
+
+    if args.command == "partition":
+        partition_table(args.ahead)
+    elif args.command == "maintain":
+        maintain(args.ahead)
+    elif args.command == "archive":
+        archive(args.retention_months)
+    elif args.command == "rehydrate":
+        rehydrate(args.first, args.last or args.first)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import json
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import ChatMessage, ConversationSummary
+from memory import aget_recent_messages, to_turns
+from run_mythomax import arun_mythomax, TROUBLE_REPLY, EXPLODED_REPLY
+from vector_memory import recall
+from tokens import estimate_tokens
+
+# Prompt token budget for history (summary + recent turns), per persona
+DEFAULT_HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# e.g. HISTORY_TOKEN_BUDGETS='{"Lily": 1000, "Raven": 2500}'
+HISTORY_TOKEN_BUDGETS = {
+    "Default": DEFAULT_HISTORY_TOKEN_BUDGET,
+    **json.loads(os.getenv("HISTORY_TOKEN_BUDGETS") or "{}"),
+}
+
+# How many recent rows to look at when filling the budget
+HISTORY_FETCH_LIMIT = int(os.getenv("HISTORY_FETCH_LIMIT", "40"))
+# Evicted turns are only folded into the summary once this many have piled up,
+# so we don't pay for a summarization call on every single message
+SUMMARY_FOLD_BATCH = int(os.getenv("SUMMARY_FOLD_BATCH", "4"))
+SUMMARY_MAX_CHARS = 1200
+# Most turns folded into the summary by one summarization call
+SUMMARY_FOLD_MAX_TURNS = int(os.getenv("SUMMARY_FOLD_MAX_TURNS", "40"))
+# Separate budget for older turns recalled by similarity (vector_memory.py)
+RECALL_TOKEN_BUDGET = int(os.getenv("RECALL_TOKEN_BUDGET", "300"))
+
+SUMMARIZER_PERSONA = (
+    "You maintain a running summary of a roleplay chat between a user and a companion character. "
+    "Merge the new exchanges into the existing summary. Keep names, preferences, facts the user shared, "
+    "promises and the current mood. Write in third person, plain prose, under 150 words. "
+    "Reply with the updated summary only."
+)
+
+_folding = set()  # user_ids with a summary update in flight (per process)
+
+
+def _turn_tokens(message) -> int:
+    # +8 for the role/formatting overhead of the two turns
+    return estimate_tokens(message.user_message) + estimate_tokens(message.bot_reply) + 8
+
+
+def history_budget(bot_name: str) -> int:
+    return HISTORY_TOKEN_BUDGETS.get(bot_name, DEFAULT_HISTORY_TOKEN_BUDGET)
+
+
+def _recalled_message(memories, kept):
+    in_prompt = {(m.user_message, m.bot_reply) for m in kept}
+    lines, used = [], 0
+    for memory in memories:
+        if (memory["user_message"], memory["bot_reply"]) in in_prompt:
+            continue
+        line = f"- User: {memory['user_message']} / You: {memory['bot_reply']}"
+        cost = estimate_tokens(line)
+        if used + cost > RECALL_TOKEN_BUDGET:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return None
+    return {"role": "system", "content": "Things you remember from earlier conversations:\n" + "\n".join(lines)}
+
+
+async def build_history(db: AsyncSession, user_id: str, bot_name: str = "Default", query: str = None):
+    """Build the history messages for a prompt, fitted into the persona's token budget.
+
+    Returns (messages, overflow). `messages` is the cached summary (if any) as a
+    system turn, then the newest user/assistant turns that fit, then older
+    turns similar to `query` recalled from vector memory. The recall changes
+    every turn, so it goes last: what comes before it repeats from one request
+    to the next and stays in the provider's prompt cache. `overflow` lists
+    the older turns that no longer fit and aren't in the summary yet, oldest
+    first, as plain dicts for `refresh_summary`.
+    """
+    # Embedding + search runs while the database is queried
+    recalled = asyncio.ensure_future(recall(user_id, query))
+    try:
+        budget = history_budget(bot_name)
+        summary = await db.get(ConversationSummary, user_id)
+        covered_until = summary.covered_until_id if summary else 0
+
+        used = estimate_tokens(summary.summary) if summary and summary.summary else 0
+        rows = await aget_recent_messages(db, user_id, limit=HISTORY_FETCH_LIMIT, after_id=covered_until)
+
+        kept = []
+        for row in rows:
+            cost = _turn_tokens(row)
+            if kept and used + cost > budget:
+                break
+            kept.append(row)
+            used += cost
+
+        # Turns still in the write-behind buffer have no id yet; they get folded on a later request
+        overflow = [
+            {"id": m.id, "user_message": m.user_message, "bot_reply": m.bot_reply}
+            for m in reversed(rows[len(kept):])
+            if m.id is not None
+        ]
+
+        messages = []
+        if summary and summary.summary:
+            messages.append({"role": "system", "content": f"Summary of your earlier conversation: {summary.summary}"})
+        messages += to_turns(reversed(kept))
+        memories = _recalled_message(await recalled, kept)
+        if memories:
+            messages.append(memories)
+    finally:
+        recalled.cancel()  # no-op once awaited; stops the search if a query above raised
+    return messages, overflow
+
+
+async def refresh_summary(user_id: str, overflow):
+    """Fold evicted turns into the user's cached summary (meant for a background task).
+
+    `overflow` (from build_history) only says that turns up to its last id no
+    longer fit. The turns themselves are read from chat_history, oldest
+    first from the end of the summary, so turns older than build_history's
+    window are folded too. One call folds at most SUMMARY_FOLD_MAX_TURNS, and
+    the summary only ever covers up to the last turn folded in; a longer
+    backlog is caught up by the next requests.
+    """
+    if len(overflow) < SUMMARY_FOLD_BATCH or user_id in _folding:
+        return
+    _folding.add(user_id)
+    db = AsyncSessionLocal()
+    try:
+        summary = await db.get(ConversationSummary, user_id)
+        previous = summary.summary if summary else ""
+        covered_until = summary.covered_until_id if summary else 0
+        newest_id = overflow[-1]["id"]
+        if covered_until >= newest_id:
+            return
+        turns = (await db.scalars(
+            select(ChatMessage)
+            .where(ChatMessage.user_id == user_id, ChatMessage.id > covered_until, ChatMessage.id <= newest_id)
+            .order_by(ChatMessage.id)
+            .limit(SUMMARY_FOLD_MAX_TURNS)
+        )).all()
+        if not turns:
+            return
+
+        transcript = "\n".join(f"User: {t.user_message}\nCompanion: {t.bot_reply}" for t in turns)
+        prompt = f"Existing summary:\n{previous or '(none yet)'}\n\nNew exchanges:\n{transcript}"
+        updated = await arun_mythomax(prompt, None, SUMMARIZER_PERSONA)
+        if not updated or updated in (TROUBLE_REPLY, EXPLODED_REPLY):
+            return
+
+        if summary is None:
+            summary = ConversationSummary(user_id=user_id)
+            db.add(summary)
+        summary.summary = updated[:SUMMARY_MAX_CHARS]
+        summary.covered_until_id = turns[-1].id
+        summary.updated_at = datetime.utcnow()
+        await db.commit()
+    except Exception as e:
+        print("Summary refresh error:", e)
+        await db.rollback()
+    finally:
+        await db.close()
+        _folding.discard(user_id)
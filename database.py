@@ -1,10 +1,47 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+
+# Pool settings. Requests only use the async engine, which gets DB_POOL_SIZE + DB_MAX_OVERFLOW
+# connections. The sync engine serves startup migrations, the CLIs and /debug-schema, so it
+# keeps a small pool of its own: budget DB_POOL_SIZE + DB_MAX_OVERFLOW + DB_SYNC_POOL_SIZE +
+# DB_SYNC_MAX_OVERFLOW connections per worker against the server's limit.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_SYNC_POOL_SIZE = int(os.getenv("DB_SYNC_POOL_SIZE", "1"))
+DB_SYNC_MAX_OVERFLOW = int(os.getenv("DB_SYNC_MAX_OVERFLOW", "2"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; below most server idle timeouts
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Serverless deploys (one request per instance, or behind pgbouncer) are better off without a pool
+DB_USE_NULLPOOL = os.getenv("DB_USE_NULLPOOL", "0") == "1"
+
+
+def _is_sqlite(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _pool_kwargs(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    if DB_USE_NULLPOOL:
+        return {"poolclass": NullPool}
+    kwargs = {"pool_pre_ping": True, "pool_recycle": DB_POOL_RECYCLE}
+    if not _is_sqlite(url):
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=DB_POOL_TIMEOUT)
+    return kwargs
+
+
+def _sync_connect_args(url):
+    # Used from threads other than the one that opened the connection (CLIs, threadpool)
+    return {"check_same_thread": False} if _is_sqlite(url) else {}
+
+
+# Sync engine: migrations, CLIs and debug endpoints only. Request handlers use get_async_db.
+engine = create_engine(DATABASE_URL, connect_args=_sync_connect_args(DATABASE_URL),
+                       **_pool_kwargs(DATABASE_URL, DB_SYNC_POOL_SIZE, DB_SYNC_MAX_OVERFLOW))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -17,3 +54,52 @@ def get_db():
         db.close()
 
 
+def async_database_url(url):
+    """Map the configured URL to its async driver (asyncpg / aiosqlite), plus driver connect args."""
+    url = make_url(url)
+    connect_args = {}
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None)
+        if sslmode:
+            connect_args["ssl"] = sslmode  # asyncpg takes libpq-style sslmode names
+        # Transaction-mode poolers (pgbouncer, Supabase :6543) can't hold prepared statements
+        if os.getenv("DB_ASYNC_STATEMENT_CACHE", "1") == "0":
+            connect_args["statement_cache_size"] = 0
+        url = url.set(drivername="postgresql+asyncpg", query=query)
+    elif backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url, connect_args
+
+
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_engine():
+    """The app-wide AsyncEngine, created on first use so sync-only scripts don't need asyncpg."""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        url, connect_args = async_database_url(DATABASE_URL)
+        _async_engine = create_async_engine(url, connect_args=connect_args, **_pool_kwargs(DATABASE_URL))
+        _async_sessionmaker = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _async_sessionmaker()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def dispose_engines():
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    engine.dispose()
@@ -0,0 +1,212 @@
+"""Transactional outbox for emails (verification codes).
+
+Handlers don't call Resend. They add a row to email_outbox in the same
+transaction as the change that needs the email, so a commit always has its
+email and a request never waits on (or fails because of) Resend.
+EmailDispatcher then delivers due rows in batches through Resend's batch
+endpoint. Failed batches are retried with exponential backoff. Rows are
+abandoned (status "failed") after EMAIL_MAX_ATTEMPTS, or at once when Resend
+rejects them as invalid.
+
+Rows are claimed with a short lease (next_attempt_at pushed forward,
+FOR UPDATE SKIP LOCKED on Postgres), so several app workers can run
+dispatchers side by side. Delivery is at-least-once. A batch whose sender
+dies after Resend accepted it is sent again when the lease runs out. The
+per-batch Idempotency-Key lets Resend drop an exact repeat.
+
+Serverless deploys should set EMAIL_DISPATCHER=0 and drain from a cron job:
+
+    python email_outbox.py
+"""
+import asyncio
+import hashlib
+import os
+import random
+import time
+from datetime import datetime, timedelta
+import httpx
+from sqlalchemy import bindparam, delete, select, update
+from database import dispose_engines, get_async_engine
+from http_clients import shutdown_clients
+from models import EmailOutbox
+from resend import send_email_batch
+
+EMAIL_DISPATCHER = os.getenv("EMAIL_DISPATCHER", "1") == "1"
+EMAIL_BATCH_SIZE = min(int(os.getenv("EMAIL_BATCH_SIZE", "50")), 100)  # Resend takes at most 100 per batch
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", "5"))  # seconds; enqueue also wakes it
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "8"))
+EMAIL_RETRY_BASE = float(os.getenv("EMAIL_RETRY_BASE", "5"))  # seconds, doubled per attempt
+EMAIL_RETRY_MAX = float(os.getenv("EMAIL_RETRY_MAX", "900"))
+EMAIL_LEASE_SECONDS = int(os.getenv("EMAIL_LEASE_SECONDS", "60"))
+EMAIL_KEEP_SENT_DAYS = int(os.getenv("EMAIL_KEEP_SENT_DAYS", "7"))
+
+outbox = EmailOutbox.__table__
+
+
+def enqueue_email(db, to: str, subject: str, html: str):
+    """Queue an email in `db`'s transaction; it goes out once that commits (call email_dispatcher.wake())."""
+    db.add(EmailOutbox(to_email=to, subject=subject, html=html))
+
+
+def _permanent(error) -> bool:
+    # Rejected as invalid: sending the same payload again won't help
+    if not isinstance(error, httpx.HTTPStatusError):
+        return False
+    status = error.response.status_code
+    return 400 <= status < 500 and status not in (408, 409, 429)
+
+
+class EmailDispatcher:
+    """Background loop delivering the email outbox; see the module docstring."""
+
+    def __init__(self, batch_size=EMAIL_BATCH_SIZE, poll_interval=EMAIL_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._loop = None
+        self._wake = None
+        self._task = None
+        self._stopping = False
+        self._last_cleanup = 0.0
+        self.stats = {"sent": 0, "batches": 0, "retries": 0, "failed": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.running:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Let a batch in flight record its result
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+
+    def wake(self):
+        """Send now instead of at the next poll. Safe to call from threadpool handlers."""
+        if self.running:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.dispatch()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print("Email outbox error:", e)
+
+    async def dispatch(self) -> int:
+        """Send what's due, a batch at a time, until nothing is due or a batch fails. Returns emails sent."""
+        sent = 0
+        while True:
+            batch = await self._claim()
+            if not batch:
+                break
+            delivered = await self._send(batch)
+            sent += delivered
+            if delivered < len(batch) or len(batch) < self.batch_size:
+                break
+        await self._cleanup()
+        return sent
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        due = (
+            select(outbox.c.id)
+            .where(outbox.c.status == "pending", outbox.c.next_attempt_at <= now)
+            .order_by(outbox.c.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)  # no-op on SQLite, which has a single writer anyway
+        )
+        claim = (
+            update(outbox)
+            .where(outbox.c.id.in_(due.scalar_subquery()))
+            .values(attempts=outbox.c.attempts + 1, next_attempt_at=now + timedelta(seconds=EMAIL_LEASE_SECONDS))
+            .returning(outbox.c.id, outbox.c.to_email, outbox.c.subject, outbox.c.html, outbox.c.attempts)
+        )
+        async with get_async_engine().begin() as conn:
+            return sorted((await conn.execute(claim)).all(), key=lambda row: row.id)
+
+    async def _send(self, batch) -> int:
+        key = hashlib.sha256(",".join(str(row.id) for row in batch).encode()).hexdigest()
+        try:
+            ids = await send_email_batch(
+                [{"to": row.to_email, "subject": row.subject, "html": row.html} for row in batch],
+                idempotency_key=f"outbox-{key}",
+            )
+        except Exception as e:
+            if _permanent(e) and len(batch) > 1:
+                # Resend rejects the whole batch for one bad email; send them singly to find it
+                return sum([await self._send([row]) for row in batch])
+            await self._failed(batch, e)
+            return 0
+        ids += [None] * (len(batch) - len(ids))
+        mark_sent = (
+            update(outbox)
+            .where(outbox.c.id == bindparam("row_id"))
+            .values(status="sent", sent_at=datetime.utcnow(), provider_id=bindparam("email_id"), last_error=None)
+        )
+        async with get_async_engine().begin() as conn:
+            await conn.execute(mark_sent, [{"row_id": row.id, "email_id": email_id} for row, email_id in zip(batch, ids)])
+        self.stats["batches"] += 1
+        self.stats["sent"] += len(batch)
+        return len(batch)
+
+    async def _failed(self, batch, error):
+        permanent = _permanent(error)
+        now = datetime.utcnow()
+        jitter = random.uniform(0.5, 1.0)  # one draw per batch so its rows stay together on retry
+        params = []
+        for row in batch:
+            give_up = permanent or row.attempts >= EMAIL_MAX_ATTEMPTS
+            delay = min(EMAIL_RETRY_MAX, EMAIL_RETRY_BASE * 2 ** (row.attempts - 1)) * jitter
+            params.append({"row_id": row.id, "new_status": "failed" if give_up else "pending",
+                           "retry_at": now + timedelta(seconds=delay)})
+            if give_up:
+                self.stats["failed"] += 1
+                print(f"⚠️ Giving up on email {row.id} to {row.to_email} after {row.attempts} attempts: {error}")
+            else:
+                self.stats["retries"] += 1
+        mark_failed = (
+            update(outbox)
+            .where(outbox.c.id == bindparam("row_id"))
+            .values(status=bindparam("new_status"), next_attempt_at=bindparam("retry_at"), last_error=str(error)[:500])
+        )
+        async with get_async_engine().begin() as conn:
+            await conn.execute(mark_failed, params)
+
+    async def _cleanup(self):
+        # Sent rows are only kept for debugging; trim them about once an hour
+        if time.monotonic() - self._last_cleanup < 3600:
+            return
+        self._last_cleanup = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(days=EMAIL_KEEP_SENT_DAYS)
+        async with get_async_engine().begin() as conn:
+            await conn.execute(delete(outbox).where(outbox.c.status == "sent", outbox.c.sent_at < cutoff))
+
+
+email_dispatcher = EmailDispatcher()
+
+
+async def _drain():
+    try:
+        sent = await EmailDispatcher().dispatch()
+        print(f"📧 Sent {sent} queued emails")
+    finally:
+        await shutdown_clients()
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(_drain())
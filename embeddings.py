@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Small CPU-friendly sentence embedding model (384 dims)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "20000"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")  # e.g. embedding_cache.db; empty = memory only
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))  # torch intra-op threads; 0 = torch default
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def _load_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            # Heavy import (torch); only paid by processes that actually embed
+            from sentence_transformers import SentenceTransformer
+            if EMBED_THREADS:
+                import torch
+                torch.set_num_threads(EMBED_THREADS)
+            _model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    return _model
+
+
+def warm_model():
+    """Load the model now (blocking), so no request waits for it."""
+    _load_model()
+
+
+def model_loaded() -> bool:
+    return _model is not None
+
+
+def model_slug() -> str:
+    """Filesystem-safe name of the embedding model, so stores for different models don't mix."""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", EMBEDDING_MODEL)
+
+
+def embed(texts) -> np.ndarray:
+    """Unit-length float32 embeddings, one row per text (so cosine similarity is a dot product).
+
+    Encodes directly, with no batching across callers or caching; async code should use `aembed`.
+    """
+    vectors = _load_model().encode(list(texts), batch_size=max(EMBED_MAX_BATCH, 1),
+                                   normalize_embeddings=True, convert_to_numpy=True)
+    return vectors.astype(np.float32, copy=False)
+
+
+class _DiskCache:
+    """content hash -> vector, in a SQLite-WAL file shared by all workers."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        found = {}
+        conn = self._conn()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        self._conn().executemany("INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)",
+                                 [(key, vector.tobytes()) for key, vector in items])
+
+
+class EmbeddingService:
+    """Micro-batching front end for the embedding model.
+
+    Concurrent `encode` calls are queued and run together: a batch goes to the
+    model as soon as `max_batch` texts are waiting, or `max_wait_ms` after the
+    first one arrived. Encoding happens on one dedicated worker thread, so the
+    event loop stays free and torch gets the cores to itself. Texts are keyed
+    by a hash of model + content. Repeats are served from an in-memory LRU
+    (and the optional SQLite disk cache), and identical texts already queued
+    share a single encode.
+    """
+
+    def __init__(self, max_batch=EMBED_MAX_BATCH, max_wait_ms=EMBED_MAX_WAIT_MS,
+                 cache_size=EMBED_CACHE_SIZE, cache_path=EMBED_CACHE_PATH, encode=None):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self._encode = encode  # defaults to the module's embed()
+        self._cache = OrderedDict()  # content hash -> vector
+        self._disk = _DiskCache(cache_path) if cache_path else None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self._pending = {}  # content hash -> future, for texts queued or being encoded
+        self._queue = None
+        self._task = None
+        self._loop = None
+        self.stats_counters = {"requests": 0, "texts": 0, "cache_hits": 0, "coalesced": 0,
+                               "batches": 0, "encoded": 0, "max_batch_seen": 0, "errors": 0}
+        self._waits = deque(maxlen=1000)         # seconds from enqueue to batch start
+        self._batch_sizes = deque(maxlen=1000)
+        self._encode_times = deque(maxlen=1000)  # seconds per batch
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{EMBEDDING_MODEL}\0{text}".encode()).digest()
+
+    def _remember(self, key, vector):
+        self._cache[key] = vector
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._pending.clear()
+            self._task = loop.create_task(self._run())
+
+    async def encode(self, texts) -> np.ndarray:
+        texts = list(texts)
+        self.stats_counters["requests"] += 1
+        self.stats_counters["texts"] += len(texts)
+        keys = [self._key(t) for t in texts]
+        vectors = {}
+
+        for key in keys:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                vectors[key] = self._cache[key]
+        missing = [k for k in dict.fromkeys(keys) if k not in vectors]
+        if missing and self._disk is not None:
+            for key, vector in (await asyncio.to_thread(self._disk.get_many, missing)).items():
+                vectors[key] = vector
+                self._remember(key, vector)
+        self.stats_counters["cache_hits"] += sum(1 for k in keys if k in vectors)
+
+        waits = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in waits:
+                continue
+            future = self._pending.get(key)
+            if future is not None:
+                self.stats_counters["coalesced"] += 1
+            else:
+                self._ensure_worker()
+                future = self._loop.create_future()
+                self._pending[key] = future
+                self._queue.put_nowait((key, text, future, time.perf_counter()))
+            waits[key] = future
+        for key, future in waits.items():
+            # shield: a caller giving up must not cancel a vector other callers share
+            vectors[key] = await asyncio.shield(future)
+
+        return np.stack([vectors[k] for k in keys]) if keys else np.zeros((0, 0), np.float32)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch):
+        started = time.perf_counter()
+        for _, _, _, enqueued in batch:
+            self._waits.append(started - enqueued)
+        try:
+            vectors = await self._loop.run_in_executor(self._executor, self._encode or embed, [text for _, text, _, _ in batch])
+        except Exception as e:
+            self.stats_counters["errors"] += 1
+            for key, _, future, _ in batch:
+                self._pending.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self._encode_times.append(time.perf_counter() - started)
+        self._batch_sizes.append(len(batch))
+        self.stats_counters["batches"] += 1
+        self.stats_counters["encoded"] += len(batch)
+        self.stats_counters["max_batch_seen"] = max(self.stats_counters["max_batch_seen"], len(batch))
+
+        for (key, _, future, _), vector in zip(batch, vectors):
+            self._remember(key, vector)
+            self._pending.pop(key, None)
+            if not future.done():
+                future.set_result(vector)
+        if self._disk is not None:
+            items = [(key, vector) for (key, _, _, _), vector in zip(batch, vectors)]
+            self._loop.run_in_executor(None, self._disk.put_many, items)
+
+    async def close(self):
+        """Stop the batching task; texts still queued fail with CancelledError."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._task = None
+
+    def stats(self) -> dict:
+        def pct(samples, p):
+            ordered = sorted(samples)
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 2) if ordered else None
+
+        return {
+            **self.stats_counters,
+            "cache_size": len(self._cache),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "mean_batch_size": round(sum(self._batch_sizes) / len(self._batch_sizes), 2) if self._batch_sizes else None,
+            "queue_wait_ms": {"p50": pct(self._waits, 0.5), "p95": pct(self._waits, 0.95)},
+            "encode_ms": {"p50": pct(self._encode_times, 0.5), "p95": pct(self._encode_times, 0.95)},
+        }
+
+
+embedding_service = EmbeddingService()
+
+
+async def aembed(texts) -> np.ndarray:
+    return await embedding_service.encode(texts)
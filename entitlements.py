@@ -0,0 +1,150 @@
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import select, text
+from database import get_async_engine
+from models import AccessControl
+
+ENTITLEMENT_CACHE_SIZE = int(os.getenv("ENTITLEMENT_CACHE_SIZE", "10000"))
+# Upper bound on staleness for writes made outside this app (manual SQL, other services)
+ENTITLEMENT_CACHE_TTL = float(os.getenv("ENTITLEMENT_CACHE_TTL", "300"))
+# Postgres LISTEN/NOTIFY so a grant on one worker evicts the entry on the others
+ENTITLEMENT_NOTIFY = os.getenv("ENTITLEMENT_NOTIFY", "0") == "1"
+NOTIFY_CHANNEL = "entitlements"
+
+
+class Entitlement:
+    __slots__ = ("tier", "expires_at")
+
+    def __init__(self, tier, expires_at):
+        self.tier = tier
+        self.expires_at = expires_at
+
+    @property
+    def active(self) -> bool:
+        return self.tier is not None and (self.expires_at is None or self.expires_at > datetime.utcnow())
+
+
+class EntitlementCache:
+    """Bounded TTL/LRU cache of each user's AccessControl row (tier, expires_at).
+
+    Users without access are cached too. Entries go stale after `ttl` seconds
+    or once `expires_at` passes, whichever comes first. The webhook and
+    /activate-access put the new grant straight in; with ENTITLEMENT_NOTIFY=1
+    on Postgres they also NOTIFY so other workers drop their copy.
+    """
+
+    def __init__(self, max_entries: int = ENTITLEMENT_CACHE_SIZE, ttl: float = ENTITLEMENT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (stale_at, Entitlement)
+        self._origin = uuid.uuid4().hex  # to skip our own notifications
+        self._listener = None
+        self.stats_counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, user_id: str):
+        """The cached Entitlement, or None on a miss."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            stale_at, entitlement = entry
+            if stale_at > time.monotonic() and (entitlement.tier is None or entitlement.active):
+                self._entries.move_to_end(user_id)
+                self.stats_counters["hits"] += 1
+                return entitlement
+            del self._entries[user_id]
+        self.stats_counters["misses"] += 1
+        return None
+
+    def put(self, user_id: str, tier, expires_at):
+        if expires_at is not None and expires_at <= datetime.utcnow():
+            tier, expires_at = None, None  # lapsed grant: cache as "no access"
+        entitlement = Entitlement(tier, expires_at)
+        self._entries[user_id] = (time.monotonic() + self.ttl, entitlement)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entitlement
+
+    def invalidate(self, user_id: str):
+        if self._entries.pop(user_id, None) is not None:
+            self.stats_counters["invalidations"] += 1
+
+    def stats(self) -> dict:
+        lookups = self.stats_counters["hits"] + self.stats_counters["misses"]
+        return {
+            **self.stats_counters,
+            "size": len(self._entries),
+            "hit_rate": round(self.stats_counters["hits"] / lookups, 3) if lookups else None,
+            "notify": self._listener is not None,
+        }
+
+    def _query(self, user_id: str):
+        return (select(AccessControl).where(AccessControl.user_id == user_id)
+                .order_by(AccessControl.expires_at.desc()).limit(1))
+
+    def lookup_sync(self, db, user_id: str) -> Entitlement:
+        entitlement = self.get(user_id)
+        if entitlement is None:
+            access = db.scalars(self._query(user_id)).first()
+            entitlement = self.put(user_id, access and access.tier, access and access.expires_at)
+        return entitlement
+
+    async def lookup(self, db, user_id: str) -> Entitlement:
+        entitlement = self.get(user_id)
+        if entitlement is None:
+            access = (await db.scalars(self._query(user_id))).first()
+            entitlement = self.put(user_id, access and access.tier, access and access.expires_at)
+        return entitlement
+
+    # Cross-worker invalidation. Call notify before committing the grant:
+    # Postgres delivers NOTIFY on commit, and drops it on rollback.
+
+    def _notify_args(self, db, user_id):
+        if not ENTITLEMENT_NOTIFY or db.bind.dialect.name != "postgresql":
+            return None
+        return text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": f"{self._origin}:{user_id}"}
+
+    def notify_sync(self, db, user_id: str):
+        args = self._notify_args(db, user_id)
+        if args:
+            db.execute(*args)
+
+    async def notify(self, db, user_id: str):
+        args = self._notify_args(db, user_id)
+        if args:
+            await db.execute(*args)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        origin, _, user_id = payload.partition(":")
+        if origin != self._origin:
+            self.invalidate(user_id)
+
+    async def start_listener(self):
+        """LISTEN on a dedicated connection from the async engine (asyncpg only)."""
+        if not ENTITLEMENT_NOTIFY or self._listener is not None:
+            return
+        engine = get_async_engine()
+        if engine.dialect.name != "postgresql":
+            return
+        try:
+            conn = await engine.connect()
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.add_listener(NOTIFY_CHANNEL, self._on_notification)
+            self._listener = conn
+            print("📡 Listening for entitlement changes")
+        except Exception as e:
+            print("Entitlement listener error:", e)
+
+    async def stop_listener(self):
+        if self._listener is not None:
+            conn, self._listener = self._listener, None
+            try:
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.remove_listener(NOTIFY_CHANNEL, self._on_notification)
+            finally:
+                await conn.close()
+
+
+entitlement_cache = EntitlementCache()
@@ -0,0 +1,127 @@
+import os
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# HTTP/2 needs the optional `h2` package (installed via httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_extra_upstreams = {}
+
+
+def supabase_url() -> str:
+    return os.getenv("SUPABASE_URL") or ""
+
+
+def register_upstream(name: str, base_url: str, headers=None, timeout: float = 20, http2: bool = True):
+    """Add another pooled upstream (e.g. an extra LLM provider) under `name`."""
+    _extra_upstreams[name] = {
+        "base_url": base_url,
+        "headers": {"Content-Type": "application/json", **(headers or {})},
+        "timeout": httpx.Timeout(timeout, connect=5.0, read=60.0),
+        "limits": httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+        "http2": http2,
+    }
+
+
+def _upstreams():
+    """Per-upstream client settings, read from the environment on every call.
+
+    Clients are built on first use, so env vars set before that (e.g. the
+    fake upstreams in benchmarks/) apply even after this module is imported.
+    """
+    return {
+        **_extra_upstreams,
+        "openrouter": {
+            "base_url": os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+            "headers": {
+                "Authorization": f"Bearer {(os.getenv('OPENROUTER_API_KEY') or '').strip()}",
+                "Content-Type": "application/json",
+            },
+            # Generations are slow; streams can sit idle between tokens
+            "timeout": httpx.Timeout(float(os.getenv("OPENROUTER_TIMEOUT", "20")), connect=5.0, read=60.0),
+            "limits": httpx.Limits(
+                max_connections=int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=60.0,
+            ),
+            "http2": True,
+        },
+        "nowpayments": {
+            "base_url": os.getenv("NOWPAYMENTS_BASE_URL", "https://api.nowpayments.io/v1"),
+            "headers": {"x-api-key": os.getenv("NOWPAYMENTS_API_KEY") or ""},
+            "timeout": httpx.Timeout(float(os.getenv("NOWPAYMENTS_TIMEOUT", "10")), connect=5.0),
+            "limits": httpx.Limits(max_connections=20, max_keepalive_connections=5, keepalive_expiry=30.0),
+            "http2": True,
+        },
+        "resend": {
+            "base_url": os.getenv("RESEND_BASE_URL", "https://api.resend.com"),
+            "headers": {
+                "Authorization": f"Bearer {os.getenv('RESEND_API_KEY') or ''}",
+                "Content-Type": "application/json",
+            },
+            "timeout": httpx.Timeout(float(os.getenv("RESEND_TIMEOUT", "10")), connect=5.0),
+            "limits": httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=30.0),
+            "http2": True,
+        },
+        # Storage API (media listing and URL signing)
+        "supabase": {
+            "base_url": f"{supabase_url()}/storage/v1",
+            "headers": {
+                "apikey": os.getenv("SUPABASE_KEY") or "",
+                "Authorization": f"Bearer {os.getenv('SUPABASE_KEY') or ''}",
+                "Content-Type": "application/json",
+            },
+            "timeout": httpx.Timeout(float(os.getenv("SUPABASE_TIMEOUT", "10")), connect=5.0),
+            "limits": httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=30.0),
+            "http2": True,
+        },
+    }
+
+
+_async_clients = {}
+_sync_clients = {}
+
+
+def _client_kwargs(name):
+    conf = dict(_upstreams()[name])
+    conf["http2"] = conf["http2"] and HTTP2_AVAILABLE
+    return conf
+
+
+def get_async_client(name: str) -> httpx.AsyncClient:
+    """Shared keep-alive AsyncClient for an upstream ("openrouter", "nowpayments", "resend", "supabase")."""
+    client = _async_clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(**_client_kwargs(name))
+        _async_clients[name] = client
+    return client
+
+
+def get_sync_client(name: str) -> httpx.Client:
+    """Shared keep-alive Client for sync code paths (threadpool handlers, scripts)."""
+    client = _sync_clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.Client(**_client_kwargs(name))
+        _sync_clients[name] = client
+    return client
+
+
+async def startup_clients():
+    for name in _upstreams():
+        get_async_client(name)
+    print(f"🌐 HTTP clients ready (http2={'on' if HTTP2_AVAILABLE else 'off'})")
+
+
+async def shutdown_clients():
+    for client in list(_async_clients.values()):
+        await client.aclose()
+    for client in list(_sync_clients.values()):
+        client.close()
+    _async_clients.clear()
+    _sync_clients.clear()
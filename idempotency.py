@@ -0,0 +1,85 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different fingerprint."""
+
+
+class IdempotencyCache:
+    """Coalesce concurrent calls that share a key and replay finished results.
+
+    - While a call for a key is running, later callers with the same key await
+      the same task instead of starting their own.
+    - Once it finishes, the result is kept for `ttl` seconds (bounded to
+      `max_entries`, oldest evicted first) and handed back to retries.
+    - Exceptions are not cached, and neither are results `cacheable` rejects,
+      so a genuine failure can be retried.
+    - A call may pass a `fingerprint` of its request (e.g. a body hash); reusing
+      the key with a different one raises IdempotencyKeyReused instead of
+      handing back another request's result.
+
+    Per-process only: with several workers a retry can land elsewhere, which
+    is still no worse than before.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 600, cacheable=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cacheable = cacheable or (lambda result: True)
+        self._in_flight = {}  # key -> (task, fingerprint)
+        self._done = OrderedDict()  # key -> (expires_at, fingerprint, result)
+
+    def _get_done(self, key):
+        entry = self._done.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._done[key]
+            return None
+        return entry
+
+    def _store(self, key, fingerprint, result):
+        self._done[key] = (time.monotonic() + self.ttl, fingerprint, result)
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    @staticmethod
+    def _check(key, fingerprint, seen):
+        if fingerprint != seen:
+            raise IdempotencyKeyReused(key)
+
+    async def run(self, key: str, factory, fingerprint=None):
+        """Return (result, replayed) for `key`, calling `factory()` at most once."""
+        entry = self._get_done(key)
+        if entry is not None:
+            self._check(key, fingerprint, entry[1])
+            return entry[2], True
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            task, seen = in_flight
+            self._check(key, fingerprint, seen)
+            # shield: a duplicate giving up must not cancel the shared call
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(factory())
+        self._in_flight[key] = (task, fingerprint)
+        task.add_done_callback(lambda t: self._finish(key, fingerprint, t))
+        return await asyncio.shield(task), False
+
+    def _finish(self, key, fingerprint, task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None and self.cacheable(task.result()):
+            self._store(key, fingerprint, task.result())
+
+
+# /chat responses keyed by "<user_id>:<Idempotency-Key>"; 5xx responses aren't replayed
+chat_idempotency = IdempotencyCache(
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600")),
+    cacheable=lambda result: result[1] < 500,
+)
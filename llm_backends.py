@@ -0,0 +1,286 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from http_clients import get_async_client, register_upstream
+
+COMPLETIONS_PATH = "/chat/completions"
+
+# Ordered provider list; the first healthy one is the primary. Every entry is an
+# OpenAI-compatible chat completions endpoint. Without `base_url` a provider
+# goes through the shared OpenRouter client, so extra OpenRouter models only
+# need a name and model. Example:
+#   LLM_PROVIDERS='[{"name": "mythomax", "model": "gryphe/mythomax-l2-13b"},
+#                   {"name": "local", "base_url": "http://127.0.0.1:8000/v1",
+#                    "api_key_env": "LOCAL_LLM_KEY", "model": "mythomax"}]'
+DEFAULT_PROVIDERS = [{"name": "openrouter", "model": "gryphe/mythomax-l2-13b"}]
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Hedging: if the primary hasn't answered within its recent p95 latency, fire
+# the next provider too and take whichever answers first
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "0") == "1"
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8"))
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MAX_PARALLEL = 2
+
+
+class LLMUnavailable(Exception):
+    """Every provider failed or is open-circuited."""
+
+
+class ProviderError(Exception):
+    pass
+
+
+class StreamInterrupted(Exception):
+    """The provider failed after part of the reply was already sent; the reply is incomplete."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (one trial) -> closed."""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. Claims the half-open trial slot if it does."""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+        if self.trial_in_flight:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """A claimed call was abandoned (e.g. a cancelled hedge); it proves nothing either way."""
+        self.trial_in_flight = False
+
+
+class LatencyTracker:
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class Provider:
+    def __init__(self, name, model, base_url=None, api_key_env=None, timeout=20, extra_body=None):
+        self.name = name
+        self.model = model
+        self.extra_body = extra_body or {}
+        if base_url:
+            api_key = os.getenv(api_key_env) if api_key_env else None
+            headers = {"Authorization": f"Bearer {api_key.strip()}"} if api_key else {}
+            register_upstream(name, base_url, headers=headers, timeout=timeout)
+            self.upstream = name
+        else:
+            self.upstream = "openrouter"
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.errors = 0
+
+    def body(self, messages, stream=False):
+        body = {"model": self.model, "messages": messages, **self.extra_body}
+        if stream:
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}  # usage (incl. cached tokens) in the last chunk
+        return body
+
+    def hedge_delay(self) -> float:
+        if len(self.latency.samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, self.latency.percentile(0.95))
+
+    def stats(self) -> dict:
+        p50 = self.latency.percentile(0.5)
+        p95 = self.latency.percentile(0.95)
+        return {
+            "model": self.model,
+            "breaker": self.breaker.state,
+            "calls": self.calls,
+            "errors": self.errors,
+            "p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+        }
+
+
+def _parse_stream_line(line: str):
+    """Return (content delta, usage or None) for one SSE line, or None at [DONE]."""
+    # OpenRouter sends ": OPENROUTER PROCESSING" keep-alive comments
+    if not line.startswith("data:"):
+        return "", None
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return None
+    try:
+        chunk = json.loads(payload)
+    except ValueError:
+        return "", None
+    choices = chunk.get("choices") or []
+    delta = ((choices[0].get("delta") or {}).get("content") or "") if choices else ""
+    return delta, chunk.get("usage")
+
+
+class LLMRouter:
+    """Ordered providers with per-provider circuit breakers and optional hedging."""
+
+    def __init__(self, providers, hedging=HEDGING_ENABLED):
+        self.providers = providers
+        self.hedging = hedging
+
+    async def _call(self, provider: Provider, messages):
+        """(content, usage) from one provider."""
+        provider.calls += 1
+        start = time.perf_counter()
+        try:
+            response = await get_async_client(provider.upstream).post(COMPLETIONS_PATH, json=provider.body(messages))
+            if response.status_code != 200:
+                raise ProviderError(f"{provider.name}: HTTP {response.status_code} {response.text[:200]}")
+            data = response.json()
+            content = data["choices"][0]["message"]["content"].strip()
+            if not content:
+                raise ProviderError(f"{provider.name}: empty completion")
+        except asyncio.CancelledError:
+            provider.breaker.release()
+            raise
+        except Exception as e:
+            provider.errors += 1
+            provider.breaker.record_failure()
+            raise e if isinstance(e, ProviderError) else ProviderError(f"{provider.name}: {e!r}")
+        provider.latency.record(time.perf_counter() - start)
+        provider.breaker.record_success()
+        return content, data.get("usage")
+
+    async def complete(self, messages, on_usage=None) -> str:
+        """Return the first successful completion, failing over (and hedging) down the list.
+
+        `on_usage`, if given, is called with the winning completion's `usage` block.
+        """
+        queue = list(self.providers)
+        running = {}  # task -> provider
+        errors = []
+
+        def launch_next():
+            while queue:
+                provider = queue.pop(0)
+                if provider.breaker.allow():
+                    running[asyncio.ensure_future(self._call(provider, messages))] = provider
+                    return provider
+            return None
+
+        last = launch_next()
+        try:
+            while running:
+                timeout = None
+                if self.hedging and queue and len(running) < HEDGE_MAX_PARALLEL:
+                    timeout = last.hedge_delay()
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    print(f"⏱️ Hedging: {last.name} slower than {timeout:.2f}s")
+                    last = launch_next() or last
+                    continue
+                for task in done:
+                    running.pop(task)
+                    if task.exception() is None:
+                        content, usage = task.result()
+                        if usage and on_usage:
+                            on_usage(usage)
+                        return content
+                    errors.append(str(task.exception()))
+                    print("LLM provider failed:", task.exception())
+                if not running:
+                    last = launch_next() or last
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise LLMUnavailable("; ".join(errors) or "all providers are open-circuited")
+
+    async def stream(self, messages, on_usage=None):
+        """Yield content deltas from the first provider that starts streaming.
+
+        Fails over to the next provider only until the first token has been sent;
+        a failure after that raises StreamInterrupted.
+        `on_usage` is called with the `usage` block if the provider sends one.
+        """
+        errors = []
+        for provider in self.providers:
+            if not provider.breaker.allow():
+                continue
+            provider.calls += 1
+            sent_any = False
+            try:
+                client = get_async_client(provider.upstream)
+                async with client.stream("POST", COMPLETIONS_PATH, json=provider.body(messages, stream=True)) as response:
+                    if response.status_code != 200:
+                        text = (await response.aread()).decode(errors="replace")
+                        raise ProviderError(f"{provider.name}: HTTP {response.status_code} {text[:200]}")
+                    async for line in response.aiter_lines():
+                        parsed = _parse_stream_line(line)
+                        if parsed is None:
+                            break
+                        delta, usage = parsed
+                        if usage and on_usage:
+                            on_usage(usage)
+                        if delta:
+                            sent_any = True
+                            yield delta
+            except (asyncio.CancelledError, GeneratorExit):
+                provider.breaker.release()
+                raise
+            except Exception as e:
+                provider.errors += 1
+                provider.breaker.record_failure()
+                print("LLM provider stream failed:", e)
+                if sent_any:
+                    raise StreamInterrupted(f"{provider.name}: {e}") from e
+                errors.append(str(e))
+                continue
+            provider.breaker.record_success()
+            return
+
+        raise LLMUnavailable("; ".join(errors) or "all providers are open-circuited")
+
+    def stats(self) -> dict:
+        return {"hedging": self.hedging, "providers": {p.name: p.stats() for p in self.providers}}
+
+
+def load_providers():
+    specs = json.loads(os.getenv("LLM_PROVIDERS") or "null") or DEFAULT_PROVIDERS
+    return [Provider(**spec) for spec in specs]
+
+
+router = LLMRouter(load_providers())
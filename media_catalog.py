@@ -0,0 +1,244 @@
+"""Media catalog: which images/voice clips exist, and which one a user gets next.
+
+The catalog comes from a local manifest (MEDIA_MANIFEST, a JSON list of
+{"path", "type", "persona"}) or from listing the Supabase bucket:
+- `pics/` holds images and `voices/` holds audio.
+- A file directly in those folders is for every persona. A file in a
+  subfolder (`pics/Lily/...`) is only for that persona.
+
+It is kept in memory and refreshed in the background every
+MEDIA_CATALOG_REFRESH seconds. A failed refresh keeps the last good
+catalog. Until the first refresh succeeds, the catalog serves the files
+that used to be hardcoded.
+
+Each user gets a shuffled, non-repeating order per (type, persona):
+- The order is a small Feistel permutation of range(n) with random round
+  keys, so it looks like a shuffle: consecutive picks aren't a fixed step
+  apart the way an affine (a * i + b) % n order would be.
+- The per-user cursor is just (keys, i), so a pick is O(1) and no shuffled
+  list is stored per user. A new cycle starts with fresh keys once all n
+  have been seen.
+- Cursors live in this process only; another worker keeps its own.
+
+With MEDIA_SIGNED_URLS=1 (private bucket) URLs are signed in one batch
+call per refresh. Each signed URL is reused until it nears expiry, so
+clients and CDNs can cache it. Public buckets get the plain public URL,
+which is stable.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+from http_clients import get_async_client, supabase_url
+
+MEDIA_BUCKET = os.getenv("MEDIA_BUCKET", "assets")
+MEDIA_MANIFEST = os.getenv("MEDIA_MANIFEST", "")  # JSON file; empty = list the bucket
+MEDIA_CATALOG_REFRESH = float(os.getenv("MEDIA_CATALOG_REFRESH", "600"))  # seconds
+MEDIA_SIGNED_URLS = os.getenv("MEDIA_SIGNED_URLS", "0") == "1"
+MEDIA_SIGNED_URL_TTL = int(os.getenv("MEDIA_SIGNED_URL_TTL", "86400"))  # seconds
+MEDIA_CURSOR_USERS = int(os.getenv("MEDIA_CURSOR_USERS", "100000"))  # cursors kept, least recently used dropped
+
+MEDIA_FOLDERS = {"pics": "image", "voices": "audio"}
+ANY_PERSONA = "*"
+_LIST_PAGE = 1000
+
+# What get_random_file_url used to hardcode; served until the first refresh succeeds
+BUILTIN_ITEMS = [{"path": f"pics/pic{i}.png", "type": "image", "persona": ANY_PERSONA} for i in range(1, 45)] + \
+                [{"path": f"voices/moan{i}.mp3", "type": "audio", "persona": ANY_PERSONA} for i in range(1, 7)]
+
+
+def _public_url(path: str) -> str:
+    return f"{supabase_url()}/storage/v1/object/public/{MEDIA_BUCKET}/{path}"
+
+
+def _load_manifest(path: str):
+    with open(path) as f:
+        items = json.load(f)
+    for item in items:
+        folder = item["path"].split("/", 1)[0]
+        item.setdefault("type", MEDIA_FOLDERS.get(folder))
+        item.setdefault("persona", ANY_PERSONA)
+    return [item for item in items if item["type"]]
+
+
+_FEISTEL_ROUNDS = 4
+
+
+def _new_order():
+    """Round keys for a fresh random order (see _permuted)."""
+    return tuple(random.getrandbits(32) for _ in range(_FEISTEL_ROUNDS))
+
+
+def _mix(x: int) -> int:
+    x = (x * 0x45D9F3B) & 0xFFFFFFFF
+    return x ^ (x >> 16)
+
+
+def _permuted(keys, i: int, n: int) -> int:
+    """Position `i` of the order `keys` gives range(n).
+
+    A balanced Feistel network permutes the smallest even-bit domain >= n
+    (at most 4n); results outside range(n) are fed through again (cycle
+    walking), which keeps it a permutation of range(n).
+    """
+    half = max(1, ((n - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    x = i
+    while True:
+        left, right = x >> half, x & mask
+        for key in keys:
+            left, right = right, left ^ (_mix(right ^ key) & mask)
+        x = (left << half) | right
+        if x < n:
+            return x
+
+
+class MediaCatalog:
+    """In-memory catalog plus per-user cursors; see the module docstring."""
+
+    def __init__(self, refresh_interval=MEDIA_CATALOG_REFRESH, max_cursors=MEDIA_CURSOR_USERS):
+        self.refresh_interval = refresh_interval
+        self.max_cursors = max_cursors
+        self.version = 0
+        self._items = []
+        self._pools = {}  # (type, persona) -> tuple of paths
+        self._urls = {}  # path -> url
+        self._signed = {}  # path -> (signed url, expires at as time.monotonic())
+        self._cursors = OrderedDict()  # (user_id, type, persona) -> [round keys, i, catalog version]
+        self._refreshed_at = None
+        self._refresh_task = None
+        self._refresh_lock = asyncio.Lock()  # one listing/signing round at a time
+        self.stats_counters = {"picks": 0, "refreshes": 0, "refresh_errors": 0, "signed": 0}
+        self._set_items(BUILTIN_ITEMS, {item["path"]: _public_url(item["path"]) for item in BUILTIN_ITEMS})
+
+    def _set_items(self, items, urls):
+        items = sorted(items, key=lambda item: (item["type"], item["persona"], item["path"]))
+        if items != self._items:
+            pools = {}
+            for item in items:
+                pools.setdefault((item["type"], item["persona"]), []).append(item["path"])
+            # A persona's pool also holds the files meant for every persona
+            for (media_type, persona), paths in pools.items():
+                if persona != ANY_PERSONA:
+                    paths.extend(pools.get((media_type, ANY_PERSONA), ()))
+            self._pools = {key: tuple(paths) for key, paths in pools.items()}
+            self._items = items
+            self.version += 1  # cursors from the old catalog start over
+        self._urls = urls
+
+    def pick(self, user_id: str, media_type: str, persona: str = ANY_PERSONA):
+        """URL of the next file of `media_type` for this user and persona, or None if there are none."""
+        self.refresh_soon()
+        key = (media_type, persona) if (media_type, persona) in self._pools else (media_type, ANY_PERSONA)
+        pool = self._pools.get(key)
+        if not pool:
+            return None
+        n = len(pool)
+        cursor_key = (user_id, *key)
+        cursor = self._cursors.get(cursor_key)
+        if cursor is None or cursor[2] != self.version:
+            cursor = [_new_order(), 0, self.version]
+        elif cursor[1] >= n:
+            last = _permuted(cursor[0], n - 1, n)
+            keys = _new_order()
+            while n > 1 and _permuted(keys, 0, n) == last:
+                keys = _new_order()  # don't repeat across the cycle boundary
+            cursor[:2] = [keys, 0]
+        index = _permuted(cursor[0], cursor[1], n)
+        cursor[1] += 1
+
+        self._cursors[cursor_key] = cursor
+        self._cursors.move_to_end(cursor_key)
+        while len(self._cursors) > self.max_cursors:
+            self._cursors.popitem(last=False)
+        self.stats_counters["picks"] += 1
+        return self._urls.get(pool[index])
+
+    def refresh_soon(self):
+        """Start a background refresh if the catalog is stale and none is running."""
+        stale = self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_interval
+        if stale and (self._refresh_task is None or self._refresh_task.done()):
+            try:
+                self._refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+            except RuntimeError:
+                pass  # no event loop (sync caller); the next async pick refreshes
+
+    async def refresh(self):
+        async with self._refresh_lock:
+            await self._refresh()
+
+    async def _refresh(self):
+        # Counted as a refresh even on failure, so a Supabase outage is retried per interval, not per pick
+        self._refreshed_at = time.monotonic()
+        try:
+            items = await asyncio.to_thread(_load_manifest, MEDIA_MANIFEST) if MEDIA_MANIFEST else await self._list_bucket()
+            paths = [item["path"] for item in items]
+            urls = await self._signed_urls(paths) if MEDIA_SIGNED_URLS else {p: _public_url(p) for p in paths}
+        except Exception as e:
+            self.stats_counters["refresh_errors"] += 1
+            print("⚠️ Media catalog refresh failed, keeping the current one:", e)
+            return
+        self._set_items(items, urls)
+        self.stats_counters["refreshes"] += 1
+
+    async def _list(self, prefix: str):
+        entries, offset = [], 0
+        while True:
+            res = await get_async_client("supabase").post(
+                f"/object/list/{MEDIA_BUCKET}",
+                json={"prefix": prefix, "limit": _LIST_PAGE, "offset": offset, "sortBy": {"column": "name", "order": "asc"}},
+            )
+            res.raise_for_status()
+            page = res.json()
+            entries += page
+            if len(page) < _LIST_PAGE:
+                return entries
+            offset += _LIST_PAGE
+
+    async def _list_bucket(self):
+        items = []
+        for folder, media_type in MEDIA_FOLDERS.items():
+            for entry in await self._list(folder):
+                name = entry["name"]
+                if name.startswith("."):
+                    continue  # .emptyFolderPlaceholder
+                if entry.get("id") is not None:
+                    items.append({"path": f"{folder}/{name}", "type": media_type, "persona": ANY_PERSONA})
+                    continue
+                # A subfolder: files only for the persona it's named after
+                for child in await self._list(f"{folder}/{name}"):
+                    if child.get("id") is not None and not child["name"].startswith("."):
+                        items.append({"path": f"{folder}/{name}/{child['name']}", "type": media_type, "persona": name})
+        return items
+
+    async def _signed_urls(self, paths):
+        # Re-sign only what's new or would expire before the refresh after next
+        now = time.monotonic()
+        keep_until = now + 2 * self.refresh_interval
+        to_sign = [p for p in paths if p not in self._signed or self._signed[p][1] < keep_until]
+        if to_sign:
+            res = await get_async_client("supabase").post(
+                f"/object/sign/{MEDIA_BUCKET}", json={"expiresIn": MEDIA_SIGNED_URL_TTL, "paths": to_sign}
+            )
+            res.raise_for_status()
+            expires = now + MEDIA_SIGNED_URL_TTL
+            for entry in res.json():
+                if entry.get("signedURL") and not entry.get("error"):
+                    self._signed[entry["path"]] = (f"{supabase_url()}/storage/v1{entry['signedURL']}", expires)
+                    self.stats_counters["signed"] += 1
+        self._signed = {p: self._signed[p] for p in paths if p in self._signed}
+        return {p: url for p, (url, _) in self._signed.items()}
+
+    def stats(self) -> dict:
+        return {
+            **self.stats_counters,
+            "version": self.version,
+            "items": len(self._items),
+            "pools": {f"{t}/{p}": len(paths) for (t, p), paths in self._pools.items()},
+            "cursors": len(self._cursors),
+        }
+
+
+media_catalog = MediaCatalog()
@@ -1,5 +1,8 @@
 from models import ChatMessage
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from write_behind import chat_writes
 from datetime import datetime
 
 def store_message(db: Session, user_id: str, user_message: str, bot_reply: str):
@@ -12,14 +15,47 @@ def store_message(db: Session, user_id: str, user_message: str, bot_reply: str):
     db.add(message)
     db.commit()
 
+async def astore_message(db: AsyncSession, user_id: str, user_message: str, bot_reply: str):
+    """Store a turn from async code: via the write-behind buffer when it's running, else directly."""
+    if chat_writes.running:
+        await chat_writes.add(user_id, user_message, bot_reply)
+        return
+    db.add(ChatMessage(
+        user_id=user_id,
+        user_message=user_message,
+        bot_reply=bot_reply,
+        timestamp=datetime.utcnow()
+    ))
+    await db.commit()
+
+def _recent_messages_query(user_id: str, limit: int, after_id: int):
+    query = select(ChatMessage).where(ChatMessage.user_id == user_id)
+    if after_id:
+        query = query.where(ChatMessage.id > after_id)
+    return query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit)
+
+def get_recent_messages(db: Session, user_id: str, limit: int = 50, after_id: int = 0):
+    """Newest-first ChatMessage rows for a user, skipping ids <= after_id."""
+    return db.scalars(_recent_messages_query(user_id, limit, after_id)).all()
+
+async def aget_recent_messages(db: AsyncSession, user_id: str, limit: int = 50, after_id: int = 0):
+    """Like get_recent_messages, but also sees this user's turns still in the write-behind buffer."""
+    pending = chat_writes.pending_for(user_id)[::-1][:limit]
+    if len(pending) == limit:
+        return pending
+    stored = (await db.scalars(_recent_messages_query(user_id, limit - len(pending), after_id))).all()
+    return pending + list(stored)
+
+def to_turns(messages):
+    """Map ChatMessage rows (oldest first) to OpenAI-style user/assistant turns."""
+    turns = []
+    for m in messages:
+        turns.append({"role": "user", "content": m.user_message})
+        turns.append({"role": "assistant", "content": m.bot_reply})
+    return turns
+
 def get_chat_history(db: Session, user_id: str, k: int = 10):
-    messages = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.user_id == user_id)
-        .order_by(ChatMessage.timestamp.desc())
-        .limit(k)
-        .all()
-    )
+    messages = get_recent_messages(db, user_id, limit=k)
     # Oldest to newest
-    return [{"user": m.user_message, "bot": m.bot_reply} for m in reversed(messages)]
+    return to_turns(reversed(messages))
 
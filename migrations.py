@@ -0,0 +1,137 @@
+"""Versioned schema migrations.
+
+The schema_version table records the last migration applied. At startup the
+app only compares that number with the latest one here (one query), and
+applies what's missing if MIGRATE_ON_STARTUP is on (the default, handy for
+local runs and single-instance deploys). Serverless or multi-instance
+deploys should set MIGRATE_ON_STARTUP=0 and migrate once per deploy:
+
+    python migrations.py            # apply pending migrations
+    python migrations.py status     # show current / latest version
+
+The baseline creates tables from the current models, so every later
+migration must be a no-op on a schema that already has its change (check
+before adding a column, create tables/indexes with checkfirst).
+"""
+import argparse
+import os
+from datetime import datetime
+from sqlalchemy import inspect, text
+from database import Base, engine
+import models  # noqa: F401  (registers every table on Base.metadata)
+from models import ChatMessage, EmailOutbox, MessageCount, Payment, PaymentEvent
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+
+
+def _add_column(conn, table: str, name: str, ddl: str):
+    if name not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def _baseline(conn):
+    Base.metadata.create_all(bind=conn, checkfirst=True)
+
+
+def _users_verification(conn):
+    _add_column(conn, "users", "verification_code", "VARCHAR")
+    _add_column(conn, "users", "is_verified", "BOOLEAN DEFAULT FALSE")
+
+
+def _chat_history_indexes(conn):
+    # create_all skips indexes on tables that already exist
+    for index in ChatMessage.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+def _message_count_window(conn):
+    _add_column(conn, MessageCount.__tablename__, "window_start", "TIMESTAMP")
+
+
+def _email_outbox(conn):
+    EmailOutbox.__table__.create(bind=conn, checkfirst=True)
+    for index in EmailOutbox.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+def _payment_events(conn):
+    PaymentEvent.__table__.create(bind=conn, checkfirst=True)
+    for index in PaymentEvent.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+def _payments_reconcile(conn):
+    _add_column(conn, Payment.__tablename__, "last_checked_at", "TIMESTAMP")
+    _add_column(conn, Payment.__tablename__, "next_check_at", "TIMESTAMP")
+    for index in Payment.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+# (version, description, apply(conn)) in order; never renumber or edit one that has shipped
+MIGRATIONS = [
+    (1, "baseline tables", _baseline),
+    (2, "users.verification_code, users.is_verified", _users_verification),
+    (3, "chat_history (user_id, timestamp, id) index", _chat_history_indexes),
+    (4, "message_count.window_start", _message_count_window),
+    (5, "email_outbox table", _email_outbox),
+    (6, "payment_events table", _payment_events),
+    (7, "payments.last_checked_at, payments.next_check_at", _payments_reconcile),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    try:
+        with conn.begin_nested():
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except Exception:
+        return 0  # no schema_version table yet
+
+
+def migrate():
+    """Apply pending migrations, each in its own transaction. Returns the resulting version."""
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, "
+                              "description VARCHAR, applied_at TIMESTAMP)"))
+        for version, description, apply in MIGRATIONS:
+            with conn.begin():
+                if conn.dialect.name == "postgresql":
+                    # Serialize concurrent deploys/workers; the lock ends with the transaction
+                    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_version'))"))
+                if version <= current_version(conn):
+                    continue
+                apply(conn)
+                conn.execute(text("INSERT INTO schema_version (version, description, applied_at) "
+                                  "VALUES (:version, :description, :applied_at)"),
+                             {"version": version, "description": description, "applied_at": datetime.utcnow()})
+            print(f"🧱 Applied migration {version}: {description}")
+        return current_version(conn)
+
+
+def check_schema():
+    """Startup hook: one version lookup, and migrations only when the database is behind."""
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version >= LATEST:
+        return
+    if not MIGRATE_ON_STARTUP:
+        print(f"⚠️ Database schema is at version {version}, code expects {LATEST}. Run `python migrations.py`.")
+        return
+    migrate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", choices=["migrate", "status"], default="migrate")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        with engine.connect() as conn:
+            print(f"Schema version {current_version(conn)} (latest {LATEST})")
+    else:
+        print(f"Schema version {migrate()}")
+
+
+if __name__ == "__main__":
+    main()
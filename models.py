@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -38,11 +38,17 @@ class ChatMessage(Base):
 
     user = relationship("User")
 
+    # History reads are "this user's turns, newest first"; id breaks timestamp ties for keyset paging
+    __table_args__ = (
+        Index("ix_chat_history_user_id_timestamp", "user_id", "timestamp", "id"),
+    )
+
 # models.py
 class MessageCount(Base):
     __tablename__ = "message_count"
     user_id = Column(String, primary_key=True)
     count = Column(Integer, default=0)
+    window_start = Column(DateTime, nullable=True)
 
 # models.py
 class Payment(Base):
@@ -53,6 +59,60 @@ class Payment(Base):
     tier = Column(String, nullable=False)
     status = Column(String, default="waiting")
     created_at = Column(DateTime, default=datetime.utcnow)
+    last_checked_at = Column(DateTime, nullable=True)  # last NowPayments lookup by the reconciler
+    next_check_at = Column(DateTime, nullable=True)    # NULL = due now
 
     user = relationship("User", back_populates="payments")  # ✅ Add this
 
+    # The reconciler's "open payments due for a check" scan
+    __table_args__ = (
+        Index("ix_payments_status_next_check_at", "status", "next_check_at"),
+    )
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    covered_until_id = Column(Integer, nullable=False, default=0)  # last chat_history.id folded in
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class EmailOutbox(Base):
+    """Emails waiting to be sent (or kept a while after), written in the same transaction as the change
+    that needs them; email_outbox.py delivers them."""
+    __tablename__ = "email_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    html = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | sent | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+    provider_id = Column(String, nullable=True)  # Resend email id
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    # The dispatcher's "due" scan
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class PaymentEvent(Base):
+    """Append-only log of NowPayments IPNs, one row per (payment, status); payment_events.py applies them."""
+    __tablename__ = "payment_events"
+    id = Column(Integer, primary_key=True, index=True)  # arrival order, which is apply order
+    payment_id = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    order_id = Column(String, nullable=True)
+    payload = Column(Text, nullable=False)  # the raw IPN body
+    received_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)  # NULL until applied
+    result = Column(String, nullable=True)  # granted | duplicate | ignored
+
+    __table_args__ = (
+        UniqueConstraint("payment_id", "status", name="uq_payment_events_payment_status"),
+        Index("ix_payment_events_processed_at_id", "processed_at", "id"),
+    )
@@ -0,0 +1,116 @@
+"""Password hashing off the request path.
+
+bcrypt is deliberately slow (~250 ms at cost 12), so hashing inline lets a
+login burst take over the threadpool and starve unrelated endpoints. Every
+hash and check here runs in a small process pool instead: at most
+PASSWORD_HASH_WORKERS hashes run at once, and extra callers wait their turn
+without holding a request thread (async endpoints) or the event loop.
+
+BCRYPT_ROUNDS sets the cost for new hashes. When it changes, a successful
+login re-hashes the password at the new cost (`averify_and_update`), so
+existing users migrate as they log in. PASSWORD_HASH_WORKERS=0 hashes in a
+thread instead, for hosts without multiprocessing (serverless).
+
+There is deliberately no blocking API: a sync handler waiting on the pool
+would hold a threadpool thread for the whole hash, which is the starvation
+this module exists to prevent.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _secret(password: str) -> bytes:
+    # bcrypt only reads 72 bytes; older bcrypt releases truncated silently, newer ones raise
+    return password.encode()[:72]
+
+
+def _rounds(hashed: str) -> int:
+    try:
+        return int(hashed.split("$")[2])  # $2b$12$<salt+hash>
+    except (IndexError, ValueError):
+        return 0
+
+
+def needs_rehash(hashed: str, rounds: int = None) -> bool:
+    return _rounds(hashed) != (rounds or BCRYPT_ROUNDS)
+
+
+# Run in the pool workers: module-level so they pickle, and this module stays cheap to import
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(_secret(password), bcrypt.gensalt(rounds)).decode()
+
+
+def _check(password: str, hashed: str) -> bool:
+    try:
+        return bcrypt.checkpw(_secret(password), hashed.encode())
+    except ValueError:
+        return False  # malformed hash
+
+
+def _verify_and_update(password: str, hashed: str, rounds: int):
+    ok = _check(password, hashed)
+    if ok and needs_rehash(hashed, rounds):
+        return True, _hash(password, rounds)
+    return ok, None
+
+
+def _get_pool():
+    global _pool, PASSWORD_HASH_WORKERS
+    if _pool is None and PASSWORD_HASH_WORKERS > 0:
+        with _pool_lock:
+            if _pool is None and PASSWORD_HASH_WORKERS > 0:
+                try:
+                    # spawn: forking a process that already runs threads and an event loop isn't safe
+                    _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+                except (OSError, NotImplementedError) as e:
+                    print(f"⚠️ No process pool for password hashing, using threads: {e}")
+                    PASSWORD_HASH_WORKERS = 0
+    return _pool
+
+
+async def _run(fn, *args):
+    pool = _get_pool()
+    if pool is None:
+        return await asyncio.to_thread(fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+async def ahash_password(password: str) -> str:
+    return await _run(_hash, password, BCRYPT_ROUNDS)
+
+
+async def averify_and_update(password: str, hashed: str):
+    """(matches, new_hash). new_hash is set when the password matched but was hashed at another cost;
+    store it in place of the old one."""
+    return await _run(_verify_and_update, password, hashed, BCRYPT_ROUNDS)
+
+
+async def averify_password(password: str, hashed: str) -> bool:
+    return await _run(_check, password, hashed)
+
+
+def start_pool():
+    """Start the worker processes now rather than on the first login."""
+    pool = _get_pool()
+    if pool is not None:
+        for future in [pool.submit(_rounds, "") for _ in range(PASSWORD_HASH_WORKERS)]:
+            future.result()
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,247 @@
+"""NowPayments IPN ingestion: store first, apply in the background.
+
+The webhook checks the signature, appends the event to payment_events and
+answers. A repeat IPN for the same (payment_id, status) hits the unique
+constraint and is acknowledged without doing anything. PaymentEventWorker
+applies stored events in arrival order:
+- it updates the payment's status;
+- for confirmed/finished it grants the tier (once per payment).
+
+Access is granted from the event's received_at, not from when it's applied,
+so catching up after an outage gives the same expiry as applying it live.
+A replay re-applies status changes only; a payment is never granted twice.
+
+On Postgres only one worker applies events at a time (advisory lock), which
+keeps them in order across app instances.
+
+    python payment_events.py process                 # apply pending events once (cron / serverless)
+    python payment_events.py status
+    python payment_events.py replay --since 2025-06-01 [--payment-id X]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import AsyncSessionLocal, dispose_engines, get_async_engine
+from entitlements import entitlement_cache
+from models import AccessControl, Payment, PaymentEvent, User
+
+PAYMENT_EVENT_WORKER = os.getenv("PAYMENT_EVENT_WORKER", "1") == "1"
+PAYMENT_EVENT_BATCH = int(os.getenv("PAYMENT_EVENT_BATCH", "100"))
+PAYMENT_EVENT_POLL_INTERVAL = float(os.getenv("PAYMENT_EVENT_POLL_INTERVAL", "5"))  # seconds; new events also wake it
+PAYMENT_EVENT_DEBOUNCE_MS = float(os.getenv("PAYMENT_EVENT_DEBOUNCE_MS", "50"))  # gather a burst into one batch
+
+GRANT_STATUSES = ("confirmed", "finished")
+FINAL_STATUSES = ("finished", "failed", "refunded", "expired")
+TIER_DAYS = {"tier1": 1, "tier2": 7, "tier3": 30}
+
+events = PaymentEvent.__table__
+
+
+def is_valid_event(payload: dict) -> bool:
+    """An IPN needs both parts of its dedupe key; without them every such IPN would share one slot."""
+    return bool(payload.get("payment_id")) and bool(payload.get("payment_status"))
+
+
+async def record_event(db, raw_body: bytes, payload: dict) -> bool:
+    """Append an IPN to the log in `db` (caller commits). False if this (payment_id, status) was already stored."""
+    if not is_valid_event(payload):
+        raise ValueError("payment event without payment_id or payment_status")
+    values = {
+        "payment_id": str(payload["payment_id"]),
+        "status": str(payload["payment_status"]),
+        "order_id": str(payload["order_id"]) if payload.get("order_id") is not None else None,
+        "payload": raw_body.decode("utf-8", "replace"),
+        "received_at": datetime.utcnow(),
+    }
+    insert = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    statement = insert(events).values(**values).on_conflict_do_nothing(index_elements=["payment_id", "status"])
+    return (await db.execute(statement)).rowcount == 1
+
+
+class PaymentEventWorker:
+    """Background loop applying stored IPNs; see the module docstring."""
+
+    def __init__(self, batch_size=PAYMENT_EVENT_BATCH, poll_interval=PAYMENT_EVENT_POLL_INTERVAL,
+                 debounce_ms=PAYMENT_EVENT_DEBOUNCE_MS):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.debounce = debounce_ms / 1000
+        self._loop = None
+        self._wake = None
+        self._task = None
+        self._stopping = False
+        self.stats = {"applied": 0, "granted": 0, "duplicates": 0, "ignored": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.running:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+
+    def wake(self):
+        if self.running:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                if not self._stopping:
+                    await asyncio.sleep(self.debounce)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.process()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print("Payment event worker error:", e)
+
+    async def process(self) -> int:
+        """Apply pending events until none are left. Returns how many were applied."""
+        applied = 0
+        while True:
+            count = await self._process_batch()
+            applied += count
+            if count < self.batch_size:
+                return applied
+
+    async def _process_batch(self) -> int:
+        async with AsyncSessionLocal() as db:
+            if db.get_bind().dialect.name == "postgresql":
+                # Another instance is applying events; it will get to these too
+                locked = await db.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext('payment_events'))"))
+                if not locked:
+                    return 0
+            batch = (await db.scalars(
+                select(PaymentEvent).where(PaymentEvent.processed_at.is_(None)).order_by(PaymentEvent.id).limit(self.batch_size)
+            )).all()
+            if not batch:
+                return 0
+
+            # Everything the batch touches is read up front and written in one flush, so the
+            # transaction (and SQLite's write lock) lasts a few statements, whatever the batch size
+            payment_ids = {event.payment_id for event in batch}
+            user_ids = {(event.order_id or "").partition(":")[0] for event in batch}
+            payments = {p.payment_id: p for p in await db.scalars(select(Payment).where(Payment.payment_id.in_(payment_ids)))}
+            granted_payments = set(await db.scalars(
+                select(PaymentEvent.payment_id).where(PaymentEvent.payment_id.in_(payment_ids), PaymentEvent.result == "granted")
+            ))
+            # A grant for an unknown user would fail the FK and, with it, the whole batch, every tick
+            known_users = set(await db.scalars(select(User.id).where(User.id.in_(user_ids))))
+            access_rows = {}
+            for access in await db.scalars(select(AccessControl).where(AccessControl.user_id.in_(user_ids))):
+                access_rows.setdefault(access.user_id, access)
+
+            granted = {}
+            now = datetime.utcnow()
+            for event in batch:
+                event.result = self._apply(db, event, payments, granted_payments, known_users, access_rows, granted)
+                event.processed_at = now
+            for user_id in granted:
+                await entitlement_cache.notify(db, user_id)
+            await db.commit()
+
+        # The cache is per process, so it's only filled once the grants are committed
+        for user_id, (tier, expires) in granted.items():
+            entitlement_cache.put(user_id, tier, expires)
+        for event in batch:
+            self.stats["applied"] += 1
+            self.stats[{"granted": "granted", "duplicate": "duplicates"}.get(event.result, "ignored")] += 1
+        return len(batch)
+
+    def _apply(self, db, event, payments, granted_payments, known_users, access_rows, granted) -> str:
+        payment = payments.get(event.payment_id)
+        # A late "confirming" must not move a finished payment back
+        if payment is not None and (event.status == "refunded" or payment.status not in FINAL_STATUSES):
+            payment.status = event.status
+        if event.result == "granted":
+            # Replayed: the grant was made when this event was first applied. Making it again would
+            # overwrite whatever the user bought since with this older, possibly shorter, grant
+            return "granted"
+        if event.status not in GRANT_STATUSES:
+            return "ignored"
+        user_id, _, tier_id = (event.order_id or "").partition(":")
+        if not user_id or tier_id not in TIER_DAYS:
+            return "ignored"
+        if user_id not in known_users:
+            print(f"⚠️ Payment {event.payment_id} is for unknown user {user_id}; not granted")
+            return "ignored"
+        # confirmed and then finished are one purchase: grant once
+        if event.payment_id in granted_payments:
+            return "duplicate"
+        granted_payments.add(event.payment_id)
+
+        expires = event.received_at + timedelta(days=TIER_DAYS[tier_id])
+        access = access_rows.get(user_id)
+        if access is None:
+            access = access_rows[user_id] = AccessControl(user_id=user_id)
+            db.add(access)
+        access.tier = tier_id
+        access.expires_at = expires
+        granted[user_id] = (tier_id, expires)
+        print(f"✅ Access granted to {user_id} for {tier_id}")
+        return "granted"
+
+
+payment_event_worker = PaymentEventWorker()
+
+
+async def replay(since: datetime = None, payment_id: str = None) -> int:
+    """Mark stored events unapplied again so the worker re-applies them, in their original order.
+
+    Status changes are applied again; grants are not. Events that granted access keep their
+    "granted" result, which stops the worker from granting that payment a second time.
+    """
+    statement = update(events).values(processed_at=None, result=case((events.c.result == "granted", "granted")))
+    if since is not None:
+        statement = statement.where(events.c.received_at >= since)
+    if payment_id is not None:
+        statement = statement.where(events.c.payment_id == payment_id)
+    async with get_async_engine().begin() as conn:
+        return (await conn.execute(statement)).rowcount
+
+
+async def _main(args):
+    try:
+        if args.command == "status":
+            async with get_async_engine().connect() as conn:
+                pending = await conn.scalar(select(func.count()).select_from(events).where(events.c.processed_at.is_(None)))
+                total = await conn.scalar(select(func.count()).select_from(events))
+            print(f"{pending} of {total} payment events pending")
+            return
+        if args.command == "replay":
+            since = datetime.fromisoformat(args.since) if args.since else None
+            print(f"🔁 {await replay(since, args.payment_id)} payment events queued for replay")
+        print(f"💸 Applied {await PaymentEventWorker().process()} payment events")
+    finally:
+        await dispose_engines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["process", "status", "replay"])
+    parser.add_argument("--since", help="replay events received at or after this ISO date/time")
+    parser.add_argument("--payment-id", help="replay only this payment's events")
+    args = parser.parse_args()
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Background reconciliation of open NowPayments payments.
+
+Frontends poll /check-payment while a crypto payment is pending. That
+endpoint now only reads the payments table; this loop keeps the table
+current instead. Every tick it takes the open payments that are due
+(status not final, next_check_at passed), looks them up at NowPayments and
+schedules the next check by age: every 15 s for a new payment, backing off
+to hourly for old ones (PAYMENT_RECONCILE_SCHEDULE). Lookups run at most
+NOWPAYMENTS_CONCURRENCY at a time and NOWPAYMENTS_RPS per second. A 429 ends
+the tick early.
+
+NowPayments has no lookup-by-ids batch call, so a batch is a rate-limited
+round of single-payment lookups.
+
+A status change is recorded as a payment event (see payment_events.py), so
+it is applied, and access granted, exactly like the matching IPN. Whichever
+arrives second is a duplicate.
+
+A tick reads the due payments and ends that transaction, does the lookups
+with no transaction open, then writes the results in a second, short one.
+On Postgres one instance reconciles at a time (a session-level advisory
+lock, so the NOWPAYMENTS_RPS budget is shared by all instances). Serverless
+deploys set PAYMENT_RECONCILER=0 and run a tick from cron:
+
+    python payment_reconciler.py
+"""
+import asyncio
+import bisect
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, or_, select, text, update
+from database import AsyncSessionLocal, dispose_engines, get_async_engine
+from http_clients import get_async_client, shutdown_clients
+from models import Payment
+from payment_events import FINAL_STATUSES, PaymentEventWorker, payment_event_worker, record_event
+
+PAYMENT_RECONCILER = os.getenv("PAYMENT_RECONCILER", "1") == "1"
+PAYMENT_RECONCILE_TICK = float(os.getenv("PAYMENT_RECONCILE_TICK", "5"))  # seconds between scans
+PAYMENT_RECONCILE_BATCH = int(os.getenv("PAYMENT_RECONCILE_BATCH", "100"))  # payments per tick
+NOWPAYMENTS_CONCURRENCY = int(os.getenv("NOWPAYMENTS_CONCURRENCY", "5"))
+NOWPAYMENTS_RPS = float(os.getenv("NOWPAYMENTS_RPS", "5"))
+# "max_age:interval,..." in seconds: check every `interval` while the payment is younger than `max_age`
+PAYMENT_RECONCILE_SCHEDULE = os.getenv("PAYMENT_RECONCILE_SCHEDULE", "600:15,3600:60,86400:600,604800:3600")
+PAYMENT_RECONCILE_MAX_INTERVAL = 86400  # beyond the last age in the schedule
+
+payments = Payment.__table__
+
+
+def _parse_schedule(spec: str):
+    steps = sorted(tuple(float(x) for x in item.split(":")) for item in spec.split(",") if item.strip())
+    return [age for age, _ in steps], [interval for _, interval in steps]
+
+
+_AGES, _INTERVALS = _parse_schedule(PAYMENT_RECONCILE_SCHEDULE)
+
+
+def check_interval(age: timedelta) -> timedelta:
+    """How long to wait before looking up a payment of this age again."""
+    i = bisect.bisect_right(_AGES, age.total_seconds())
+    return timedelta(seconds=_INTERVALS[i] if i < len(_INTERVALS) else PAYMENT_RECONCILE_MAX_INTERVAL)
+
+
+class _RateLimiter:
+    """Spaces calls at least 1/rate seconds apart."""
+
+    def __init__(self, rate: float):
+        self.spacing = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.spacing
+
+
+class RateLimited(Exception):
+    pass
+
+
+class PaymentReconciler:
+    """Background loop keeping open payments' status current; see the module docstring."""
+
+    def __init__(self, tick=PAYMENT_RECONCILE_TICK, batch_size=PAYMENT_RECONCILE_BATCH,
+                 concurrency=NOWPAYMENTS_CONCURRENCY, rps=NOWPAYMENTS_RPS):
+        self.tick = tick
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._limiter = _RateLimiter(rps)  # shared by ticks and check_now calls
+        self._task = None
+        self._stopping = asyncio.Event()
+        self.stats = {"ticks": 0, "lookups": 0, "changes": 0, "upstream_errors": 0, "rate_limited": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.running:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.reconcile()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print("Payment reconciler error:", e)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+
+    @asynccontextmanager
+    async def _exclusive(self):
+        """Yields whether this instance may reconcile now. On Postgres only one at a time may.
+
+        The advisory lock is session-level, on a connection of its own that is
+        left idle (no open transaction) while the lookups run. Behind a
+        transaction-mode pooler (pgbouncer, Supabase :6543) session locks
+        don't hold; run the reconciler from a single place there.
+        """
+        engine = get_async_engine()
+        if engine.dialect.name != "postgresql":
+            yield True
+            return
+        async with engine.connect() as conn:
+            locked = await conn.scalar(text("SELECT pg_try_advisory_lock(hashtext('payment_reconciler'))"))
+            await conn.commit()
+            try:
+                yield locked
+            finally:
+                if locked:
+                    try:
+                        await conn.execute(text("SELECT pg_advisory_unlock(hashtext('payment_reconciler'))"))
+                        await conn.commit()
+                    except Exception:
+                        # Never hand a connection still holding the lock back to the pool
+                        await conn.invalidate()
+                        raise
+
+    async def reconcile(self) -> int:
+        """One tick: look up every due open payment (up to batch_size). Returns how many changed status."""
+        self.stats["ticks"] += 1
+        async with self._exclusive() as locked:
+            if not locked:
+                return 0
+            now = datetime.utcnow()
+            async with AsyncSessionLocal() as db:
+                due = (await db.scalars(
+                    select(Payment)
+                    .where(or_(Payment.status.is_(None), Payment.status.notin_(FINAL_STATUSES)),
+                           or_(Payment.next_check_at.is_(None), Payment.next_check_at <= now))
+                    .order_by(Payment.next_check_at.nulls_first())
+                    .limit(self.batch_size)
+                )).all()
+            if not due:
+                return 0
+            # No transaction is open during the rate-limited lookups
+            return await self._apply(due, await self._lookup_all([p.payment_id for p in due]))
+
+    async def check_now(self, db, payment: Payment) -> bool:
+        """Look one payment up right away (when no reconciler loop runs in this process). True if it changed.
+
+        Ends `db`'s transaction first, so it isn't held open during the lookup.
+        """
+        await db.commit()
+        changed = await self._apply([payment], await self._lookup_all([payment.payment_id]))
+        await db.refresh(payment)
+        return bool(changed)
+
+    async def _apply(self, due, statuses) -> int:
+        """Record the lookup results in one short transaction. Returns how many payments changed status."""
+        changed = 0
+        checked_at = datetime.utcnow()
+        schedule = []
+        async with AsyncSessionLocal() as db:
+            for payment in due:
+                if payment.payment_id not in statuses:
+                    continue  # not looked up (rate limited); stays due
+                status = statuses[payment.payment_id]
+                schedule.append({
+                    "pid": payment.payment_id,
+                    "checked_at": checked_at,
+                    "next_check_at": checked_at + check_interval(checked_at - (payment.created_at or checked_at)),
+                })
+                if status and status != payment.status:
+                    changed += 1
+                    body = json.dumps({"payment_id": payment.payment_id, "payment_status": status,
+                                       "order_id": f"{payment.user_id}:{payment.tier}", "source": "reconciler"})
+                    await record_event(db, body.encode(), json.loads(body))
+            if schedule:
+                await db.execute(
+                    update(payments).where(payments.c.payment_id == bindparam("pid"))
+                    .values(last_checked_at=bindparam("checked_at"), next_check_at=bindparam("next_check_at")),
+                    schedule,
+                )
+            await db.commit()
+
+        self.stats["changes"] += changed
+        if changed:
+            if payment_event_worker.running:
+                payment_event_worker.wake()
+            else:
+                await PaymentEventWorker().process()
+        return changed
+
+    async def _lookup_all(self, payment_ids):
+        """payment_id -> status (None when the lookup failed) for the ids that were looked up."""
+        gate = asyncio.Semaphore(self.concurrency)
+        results = {}
+        stop = False
+
+        async def one(payment_id):
+            nonlocal stop
+            async with gate:
+                if stop:
+                    return
+                await self._limiter.wait()
+                try:
+                    results[payment_id] = await self._lookup(payment_id)
+                except RateLimited:
+                    stop = True  # back off until the next tick
+
+        await asyncio.gather(*(one(pid) for pid in payment_ids))
+        return results
+
+    async def _lookup(self, payment_id: str):
+        self.stats["lookups"] += 1
+        try:
+            res = await get_async_client("nowpayments").get(f"/payment/{payment_id}")
+        except Exception as e:
+            self.stats["upstream_errors"] += 1
+            print(f"NowPayments lookup failed for {payment_id}:", e)
+            return None
+        if res.status_code == 429:
+            self.stats["rate_limited"] += 1
+            raise RateLimited()
+        if res.status_code != 200:
+            self.stats["upstream_errors"] += 1
+            return None
+        return res.json().get("payment_status")
+
+
+payment_reconciler = PaymentReconciler()
+
+
+async def _tick():
+    try:
+        print(f"💸 {await PaymentReconciler().reconcile()} payments changed status")
+    finally:
+        await shutdown_clients()
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(_tick())
@@ -0,0 +1,156 @@
+"""Persona registry: system prompts and reply flourishes, loaded from personas/*.json.
+
+Each file is one persona:
+
+    {"name": "Lily", "version": 2,
+     "system_prompt": "..." or ["paragraph", "paragraph", ...],
+     "flourishes": ["...", ...]}
+
+Bump "version" whenever the prompt changes; it shows up in /debug-llm next to
+the cache numbers, so a drop in cached tokens can be matched to an edit.
+
+Everything a request needs is computed once per load:
+- the normalised system prompt;
+- its estimated token count;
+- the flourish lists.
+Every request for a persona version therefore starts with the same bytes,
+which keeps the provider's prompt cache warm. The directory is rescanned at
+most every PERSONAS_RELOAD_INTERVAL seconds: changed files are reloaded and
+personas whose file was deleted are dropped. A file that fails to load
+keeps its previous version, and unknown names get "Default".
+
+Persona.record_usage() takes the `usage` block of each completion and tracks
+how much of the prompt the provider served from its cache
+(prompt_tokens_details.cached_tokens).
+"""
+import json
+import os
+import time
+from collections import deque
+from tokens import estimate_tokens
+
+PERSONAS_DIR = os.getenv("PERSONAS_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "personas")
+PERSONAS_RELOAD_INTERVAL = float(os.getenv("PERSONAS_RELOAD_INTERVAL", "5"))  # seconds between directory scans
+DEFAULT_PERSONA = "Default"
+
+
+def _normalise(text: str) -> str:
+    # Editors differ in line endings and trailing spaces; the bytes sent must not
+    return "\n".join(line.rstrip() for line in text.replace("\r\n", "\n").strip().split("\n"))
+
+
+class Persona:
+    __slots__ = ("name", "version", "system_prompt", "system_tokens", "flourishes",
+                 "requests", "prompt_tokens", "cached_tokens", "recent_shares")
+
+    def __init__(self, name, version, system_prompt, flourishes):
+        if isinstance(system_prompt, list):
+            system_prompt = "\n\n".join(system_prompt)
+        self.name = name
+        self.version = version
+        self.system_prompt = _normalise(system_prompt)
+        self.system_tokens = estimate_tokens(self.system_prompt)
+        self.flourishes = tuple((line, line.lower()) for line in flourishes)
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.recent_shares = deque(maxlen=200)
+
+    def record_usage(self, usage: dict):
+        """Count one completion's prompt tokens and how many of them came from the provider's cache."""
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached
+        if prompt_tokens:
+            self.recent_shares.append(cached / prompt_tokens)
+            print(f"🧊 Prompt cache ({self.name}): {cached}/{prompt_tokens} tokens cached ({cached / prompt_tokens:.0%})")
+
+    def stats(self) -> dict:
+        shares = sorted(self.recent_shares)
+        return {
+            "version": self.version,
+            "system_tokens": self.system_tokens,
+            "requests": self.requests,
+            "cached_share": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+            "recent_cached_share_p50": round(shares[len(shares) // 2], 3) if shares else None,
+        }
+
+
+def _load_file(path: str) -> Persona:
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    name = spec.get("name") or os.path.splitext(os.path.basename(path))[0]
+    return Persona(name, spec.get("version", 1), spec["system_prompt"], spec.get("flourishes", []))
+
+
+class PersonaRegistry:
+    """Personas by name, reloaded when their files change; see the module docstring."""
+
+    def __init__(self, directory=PERSONAS_DIR, reload_interval=PERSONAS_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._personas = {}
+        self._mtimes = {}  # path -> mtime when last loaded
+        self._names = {}   # path -> name of the persona it holds
+        self._checked_at = 0.0
+        self.reload()
+
+    def reload(self) -> int:
+        """Load new and changed persona files and drop deleted ones. Returns how many personas changed."""
+        self._checked_at = time.monotonic()
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+        except OSError as e:
+            print("⚠️ Persona directory not readable, keeping the current personas:", e)
+            return 0
+        personas = dict(self._personas)
+        loaded = 0
+        present = {entry.path for entry in entries}
+        for path in [p for p in self._mtimes if p not in present]:
+            del self._mtimes[path]
+            name = self._names.pop(path, None)
+            if name is None or name in self._names.values():
+                continue  # broken file, or the persona also lives in another file
+            if name == DEFAULT_PERSONA:
+                print(f"⚠️ Persona file for {name} removed, keeping the loaded version as the fallback")
+                continue
+            personas.pop(name, None)
+            loaded += 1
+            print(f"🎭 Persona {name} removed ({os.path.basename(path)} deleted)")
+        for entry in entries:
+            mtime = entry.stat().st_mtime
+            if self._mtimes.get(entry.path) == mtime:
+                continue
+            self._mtimes[entry.path] = mtime  # a broken file is reported once, not every scan
+            try:
+                persona = _load_file(entry.path)
+            except Exception as e:
+                print(f"⚠️ Persona file {entry.name} not loaded, keeping the previous version:", e)
+                continue
+            previous = personas.get(persona.name)
+            if previous is not None and previous.system_prompt == persona.system_prompt:
+                # Same prompt, same cache behaviour: keep counting where we were
+                for counter in ("requests", "prompt_tokens", "cached_tokens", "recent_shares"):
+                    setattr(persona, counter, getattr(previous, counter))
+            personas[persona.name] = persona
+            renamed_from = self._names.get(entry.path)
+            self._names[entry.path] = persona.name
+            if renamed_from not in (None, persona.name, DEFAULT_PERSONA) and renamed_from not in self._names.values():
+                personas.pop(renamed_from, None)
+            loaded += 1
+            print(f"🎭 Persona {persona.name} v{persona.version} loaded ({persona.system_tokens} prompt tokens)")
+        self._personas = personas  # swapped whole, so readers see old or new, never half
+        return loaded
+
+    def get(self, name: str) -> Persona:
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        return self._personas.get(name) or self._personas[DEFAULT_PERSONA]
+
+    def stats(self) -> dict:
+        return {name: persona.stats() for name, persona in self._personas.items()}
+
+
+persona_registry = PersonaRegistry()
@@ -0,0 +1,119 @@
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam, column, DateTime, Integer, String
+from sqlalchemy.ext.asyncio import AsyncSession
+from entitlements import entitlement_cache
+
+# Messages per window for each tier. Tiers not listed here are unlimited;
+# window_hours null means the count never resets. Override with e.g.
+#   CHAT_QUOTAS='{"free": {"limit": 5, "window_hours": 24}, "tier1": {"limit": 300, "window_hours": 24}}'
+DEFAULT_QUOTAS = {"free": {"limit": 5, "window_hours": None}}
+CHAT_QUOTAS = {**DEFAULT_QUOTAS, **json.loads(os.getenv("CHAT_QUOTAS") or "{}")}
+
+_statements = {}
+
+
+def _consume_sql(dialect: str):
+    """One statement: resolve the user's active tier and count a message if its quota allows.
+
+    Returns a (count, tier, expires_at) row when the message is allowed and
+    nothing when the quota is used up. Unlimited tiers (no limit) leave the
+    count and window as they are, so a plan that lapses falls back to an
+    untouched free quota. Works as-is on Postgres and SQLite >=
+    3.35 (both support WITH ... INSERT ... ON CONFLICT ... RETURNING).
+    """
+    if dialect in _statements:
+        return _statements[dialect]
+
+    # Postgres needs typed NULLs in CASE; SQLite must not CAST to TIMESTAMP (numeric affinity)
+    pg = dialect == "postgresql"
+    ts = (lambda e: f"CAST({e} AS TIMESTAMP)") if pg else (lambda e: e)
+    num = (lambda e: f"CAST({e} AS INTEGER)") if pg else (lambda e: e)
+
+    tiers = list(CHAT_QUOTAS)
+    limit_cases = " ".join(f"WHEN :tier_{i} THEN {num(f':limit_{i}')}" for i in range(len(tiers)))
+    cutoff_cases = " ".join(f"WHEN :tier_{i} THEN {ts(f':cutoff_{i}')}" for i in range(len(tiers)))
+    expired = ("((SELECT cutoff FROM q) IS NOT NULL AND (message_count.window_start IS NULL "
+               "OR message_count.window_start < (SELECT cutoff FROM q)))")
+
+    sql = text(f"""
+        WITH lvl AS (
+            SELECT COALESCE(a.tier, 'free') AS tier, a.expires_at
+            FROM (SELECT 1 AS one) d
+            LEFT JOIN (SELECT tier, expires_at FROM access_control
+                       WHERE user_id = :user_id AND expires_at > :now
+                       ORDER BY expires_at DESC LIMIT 1) a ON 1 = 1
+        ),
+        q AS (
+            SELECT tier, expires_at,
+                   CASE tier {limit_cases} ELSE {num('NULL')} END AS lim,
+                   CASE tier {cutoff_cases} ELSE {ts('NULL')} END AS cutoff
+            FROM lvl
+        )
+        INSERT INTO message_count (user_id, count, window_start)
+        SELECT :user_id, CASE WHEN q.lim IS NULL THEN 0 ELSE 1 END, :now FROM q WHERE q.lim IS NULL OR q.lim > 0
+        ON CONFLICT (user_id) DO UPDATE SET
+            count = CASE WHEN (SELECT lim FROM q) IS NULL THEN message_count.count
+                         WHEN {expired} THEN 1 ELSE message_count.count + 1 END,
+            window_start = CASE WHEN (SELECT lim FROM q) IS NULL THEN message_count.window_start
+                                WHEN {expired} THEN excluded.window_start ELSE message_count.window_start END
+        WHERE (SELECT lim FROM q) IS NULL OR message_count.count < (SELECT lim FROM q) OR {expired}
+        RETURNING message_count.count AS count, (SELECT tier FROM q) AS tier,
+                  (SELECT expires_at FROM q) AS expires_at
+    """).bindparams(
+        bindparam("user_id", type_=String),
+        bindparam("now", type_=DateTime),
+        *[bindparam(f"tier_{i}", type_=String) for i in range(len(tiers))],
+        *[bindparam(f"limit_{i}", type_=Integer) for i in range(len(tiers))],
+        *[bindparam(f"cutoff_{i}", type_=DateTime) for i in range(len(tiers))],
+    ).columns(column("count", Integer), column("tier", String), column("expires_at", DateTime))
+    _statements[dialect] = sql
+    return sql
+
+
+def _unlimited(tier: str) -> bool:
+    return CHAT_QUOTAS.get(tier, {}).get("limit") is None
+
+
+def _params(user_id: str, now: datetime) -> dict:
+    params = {"user_id": user_id, "now": now}
+    for i, (tier, quota) in enumerate(CHAT_QUOTAS.items()):
+        hours = quota.get("window_hours")
+        params[f"tier_{i}"] = tier
+        params[f"limit_{i}"] = quota.get("limit")
+        params[f"cutoff_{i}"] = now - timedelta(hours=hours) if hours else None
+    return params
+
+
+async def consume_message(db: AsyncSession, user_id: str):
+    """Check entitlement and take one message from the user's quota, atomically.
+
+    Returns (allowed, tier, counted); tier is None when the message was
+    refused, and counted says whether a message was taken from a quota (only
+    then is there anything for refund_message to give back). Users with a
+    cached grant on an unlimited tier skip the database entirely.
+    """
+    entitlement = entitlement_cache.get(user_id)
+    if entitlement is not None and entitlement.active and _unlimited(entitlement.tier):
+        return True, entitlement.tier, False
+
+    statement = _consume_sql(db.bind.dialect.name)
+    row = (await db.execute(statement, _params(user_id, datetime.utcnow()))).first()
+    await db.commit()
+    if row is None:
+        return False, None, False
+    entitlement_cache.put(user_id, row.expires_at and row.tier, row.expires_at)
+    return True, row.tier, not _unlimited(row.tier)
+
+
+async def refund_message(db: AsyncSession, user_id: str):
+    """Give back a message taken by consume_message (e.g. the request was shed before running).
+
+    Only call this when consume_message reported the message as counted.
+    """
+    await db.execute(
+        text("UPDATE message_count SET count = count - 1 WHERE user_id = :user_id AND count > 0"),
+        {"user_id": user_id},
+    )
+    await db.commit()
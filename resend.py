@@ -1,20 +1,27 @@
 import os
-import requests
+from http_clients import get_sync_client, get_async_client
 
 RESEND_API_KEY = os.getenv("RESEND_API_KEY")
-RESEND_API_URL = "https://api.resend.com/emails"
+RESEND_EMAILS_PATH = "/emails"
+RESEND_BATCH_PATH = "/emails/batch"  # up to 100 emails per call
+EMAIL_FROM = "Voxella <no-reply@voxellaai.site>"
 
 def send_email(to: str, subject: str, html: str):
-    headers = {
-        "Authorization": f"Bearer {RESEND_API_KEY}",
-        "Content-Type": "application/json"
-    }
     data = {
-        "from": "Voxella <no-reply@voxellaai.site>",  # ✅ Comma added here
+        "from": EMAIL_FROM,
         "to": [to],
         "subject": subject,
         "html": html
     }
-    response = requests.post(RESEND_API_URL, headers=headers, json=data)
+    response = get_sync_client("resend").post(RESEND_EMAILS_PATH, json=data)
     response.raise_for_status()
     print(response.status_code, response.text)
+
+async def send_email_batch(emails, idempotency_key: str = None):
+    """Send [{"to", "subject", "html"}, ...] in one request. Returns Resend's ids, in order.
+    Raises httpx.HTTPStatusError on a non-2xx reply (Resend rejects or accepts the whole batch)."""
+    payload = [{"from": EMAIL_FROM, "to": [e["to"]], "subject": e["subject"], "html": e["html"]} for e in emails]
+    headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+    response = await get_async_client("resend").post(RESEND_BATCH_PATH, json=payload, headers=headers)
+    response.raise_for_status()
+    return [item.get("id") for item in response.json().get("data", [])]
@@ -1,7 +1,6 @@
 import os
-import requests
-import json
 from dotenv import load_dotenv
+from llm_backends import router, LLMUnavailable, StreamInterrupted
 
 load_dotenv()
 
@@ -11,43 +10,53 @@ if not OPENROUTER_API_KEY:
 else:
     print("OpenRouter API key loaded.")
 
-def run_mythomax(prompt, history=None, persona="You are a flirty, horny anime girl who replies in character."):
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY.strip()}",
-        "Content-Type": "application/json",
-    }
-
-    if not history:
-        history = []
+DEFAULT_PERSONA = "You are a flirty, horny anime girl who replies in character."
+TROUBLE_REPLY = "I'm having a bit of trouble responding right now. Try again in a sec 😢"
+EXPLODED_REPLY = "Oops... something exploded internally 💥"
 
+def _build_messages(prompt, history, persona):
+    # The persona goes first and must be byte-identical between requests: providers cache
+    # prompts by exact prefix, so everything per-user or per-turn comes after it
     messages = [{"role": "system", "content": persona}]
-    messages += history
+    messages += history or []
     messages.append({"role": "user", "content": prompt})
+    return messages
 
-    body = {
-        "model": "gryphe/mythomax-l2-13b",
-        "messages": messages,
-    }
+async def arun_mythomax(prompt, history=None, persona=DEFAULT_PERSONA, on_usage=None):
+    """The reply to `prompt`, or an apology string if no provider answered.
 
+    Goes through the provider router (failover, circuit breakers, hedging).
+    `on_usage` gets the completion's token usage (see personas.py).
+    """
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=body,
-            timeout=20  # optional: faster timeouts
-        )
-
-        print("Status Code:", response.status_code)
-        print("Response Text:", response.text)
-
-        if response.status_code == 200:
-            data = response.json()
-            content = data["choices"][0]["message"]["content"].strip()
-            return content
-        else:
-            return "I'm having a bit of trouble responding right now. Try again in a sec 😢"
-
+        return await router.complete(_build_messages(prompt, history, persona), on_usage=on_usage)
+    except LLMUnavailable as e:
+        print("LLM unavailable:", e)
+        return TROUBLE_REPLY
     except Exception as e:
         print("Exception:", e)
-        return "Oops... something exploded internally 💥"
+        return EXPLODED_REPLY
+
+async def stream_mythomax(prompt, history=None, persona=DEFAULT_PERSONA, on_usage=None):
+    """Yield reply text chunks as the provider streams them back (SSE).
 
+    If every provider fails before anything was sent, the usual apology string
+    is yielded instead so callers always get some text. A failure after that
+    raises StreamInterrupted: the text sent so far is not a whole reply.
+    """
+    sent_any = False
+    try:
+        async for delta in router.stream(_build_messages(prompt, history, persona), on_usage=on_usage):
+            sent_any = True
+            yield delta
+    except StreamInterrupted:
+        raise
+    except LLMUnavailable as e:
+        print("LLM unavailable:", e)
+        if not sent_any:
+            yield TROUBLE_REPLY
+    except Exception as e:
+        print("Stream exception:", e)
+        if sent_any:
+            raise StreamInterrupted(str(e)) from e
+        yield EXPLODED_REPLY
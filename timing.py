@@ -0,0 +1,55 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Off by default: stage names and durations are internal details
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING", "0") == "1"
+
+_stages = ContextVar("stages", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block of request handling; reported in the Server-Timing header."""
+    stages = _stages.get()
+    if stages is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+class ServerTimingMiddleware:
+    """Plain ASGI middleware adding `Server-Timing: <stage>;dur=<ms>, ...` to responses.
+
+    Only stages finished before the response starts are reported, so for
+    streamed replies the generation itself is not included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SERVER_TIMING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stages = {}
+        token = _stages.set(stages)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                stages["total"] = (time.perf_counter() - start) * 1000
+                value = ", ".join(f"{name};dur={ms:.1f}" for name, ms in stages.items())
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _stages.reset(token)
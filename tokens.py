@@ -0,0 +1,6 @@
+"""Rough token counts for prompt budgeting. No imports, so any module can use it."""
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 chars per token for English; good enough for budgeting without a tokenizer
+    return len(text) // 4 + 1
@@ -0,0 +1,135 @@
+"""Trigger phrases: which categories (audio, image, ...) a prompt asks for.
+
+Every trigger list is compiled into one regex per persona. A persona's lists
+are the shared ("*") lists plus its own. match() scans the prompt once and
+returns every category it hit.
+
+Phrases match whole words, so "hard" no longer fires on "hardware". Common
+endings are allowed: "kiss" matches "kisses"/"kissing", "hard" matches
+"harder". A phrase ending in "*" matches any ending ("fuck*" matches
+"fucking"). The words of a multi-word phrase may be separated by any
+whitespace.
+
+The lists come from TRIGGERS_FILE, a JSON object when set:
+
+    {"*": {"audio": ["moan", "kiss"], "image": ["pic", "nudes"]},
+     "Lily": {"audio": ["cuddle"]}}
+
+It is re-read when its mtime changes, checked at most every
+TRIGGERS_RELOAD_INTERVAL seconds. A file that fails to load keeps the
+previous lists. Without the file, the lists below (the ones main.py used to
+hardcode) apply.
+"""
+import json
+import os
+import re
+import time
+
+TRIGGERS_FILE = os.getenv("TRIGGERS_FILE", "")
+TRIGGERS_RELOAD_INTERVAL = float(os.getenv("TRIGGERS_RELOAD_INTERVAL", "5"))  # seconds between mtime checks
+
+ANY_PERSONA = "*"
+DEFAULT_TRIGGERS = {
+    ANY_PERSONA: {
+        "audio": ["fuck", "touch", "kiss", "moan", "suck", "lick", "turn me on", "horny", "naughty", "wet", "hard"],
+        "image": ["pic", "pics", "nudes", "photo", "image", "images", "nude", "picture", "pictures"],
+    },
+}
+
+_ENDINGS = r"(?:s|es|ed|d|er|ing|in|y)?"
+
+
+def _phrase_pattern(phrase: str) -> str:
+    phrase = phrase.strip().lower()
+    prefix = phrase.endswith("*")
+    words = [re.escape(word) for word in phrase.rstrip("*").split()]
+    return r"\s+".join(words) + (r"\w*" if prefix else _ENDINGS + r"\b")
+
+
+def _compile(lists: dict):
+    """(regex, group name -> categories, all categories) for category -> phrases.
+
+    A phrase in several categories is in one group standing for all of them.
+    """
+    categories_of = {}
+    for category, phrases in lists.items():
+        for phrase in phrases:
+            if phrase.strip():
+                categories_of.setdefault(phrase.strip().lower(), set()).add(category)
+    groups = {}
+    for phrase, categories in categories_of.items():
+        groups.setdefault(frozenset(categories), []).append(phrase)
+    names, alternatives = {}, []
+    for i, (categories, phrases) in enumerate(groups.items()):
+        names[f"g{i}"] = categories
+        # Longest first so "turn me on" wins over a shorter phrase starting at the same place
+        body = "|".join(_phrase_pattern(p) for p in sorted(phrases, key=len, reverse=True))
+        alternatives.append(f"(?P<g{i}>{body})")
+    if not alternatives:
+        return None, {}, frozenset()
+    # Match lowercased text rather than use IGNORECASE, and rule out most positions up front with
+    # the word boundary and a first-letter check: together about 3x faster than naive alternation
+    first_letters = re.escape("".join(sorted({p[0] for p in categories_of})))
+    regex = re.compile(rf"\b(?=[{first_letters}])(?:{'|'.join(alternatives)})")
+    return regex, names, frozenset(lists)
+
+
+class TriggerEngine:
+    """Compiled trigger lists with mtime-based reload; see the module docstring."""
+
+    def __init__(self, path=TRIGGERS_FILE, reload_interval=TRIGGERS_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._compiled = {}  # persona -> _compile() result
+        self.reloads = 0
+        self.load(DEFAULT_TRIGGERS)
+        if path:
+            self.reload()
+
+    def load(self, config: dict):
+        """Compile a {persona: {category: [phrases]}} mapping and swap it in."""
+        shared = config.get(ANY_PERSONA, {})
+        compiled = {ANY_PERSONA: _compile(shared)}
+        for persona, lists in config.items():
+            if persona != ANY_PERSONA:
+                merged = {c: list(shared.get(c, [])) + list(lists.get(c, [])) for c in {*shared, *lists}}
+                compiled[persona] = _compile(merged)
+        self._compiled = compiled  # one assignment, so a match running meanwhile sees old or new, never half
+        self.reloads += 1
+
+    def reload(self) -> bool:
+        """Re-read TRIGGERS_FILE if it changed. True if new lists were loaded."""
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return False
+            with open(self.path) as f:
+                config = json.load(f)
+            self.load(config)
+        except Exception as e:
+            print("⚠️ Trigger lists not reloaded, keeping the current ones:", e)
+            return False
+        self._mtime = mtime
+        print(f"🎯 Trigger lists loaded from {self.path}")
+        return True
+
+    def match(self, text: str, persona: str = ANY_PERSONA) -> frozenset:
+        """Every category with a phrase in `text`, using `persona`'s lists (the shared ones if it has none)."""
+        if self.path and time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        compiled = self._compiled
+        regex, names, categories = compiled.get(persona) or compiled[ANY_PERSONA]
+        if regex is None or not text:
+            return frozenset()
+        hits = set()
+        for m in regex.finditer(text.lower()):
+            hits |= names[m.lastgroup]
+            if len(hits) == len(categories):
+                break  # nothing left to find
+        return frozenset(hits)
+
+
+trigger_engine = TriggerEngine()
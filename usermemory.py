@@ -1,29 +1,91 @@
 import json
 import os
+import sqlite3
+import sys
+import threading
 from datetime import datetime
 
-STRUCTURED_MEMORY_FILE = "user_memory.json"
+# Structured per-user facts (name, preferences, last_seen, ...) in an embedded
+# SQLite database in WAL mode: one indexed row per user, readers never block,
+# and writers in any thread or process are serialized by SQLite itself.
+PROFILE_DB_PATH = os.getenv("PROFILE_DB_PATH", "user_memory.db")
+PROFILE_BUSY_TIMEOUT_MS = int(os.getenv("PROFILE_BUSY_TIMEOUT_MS", "5000"))
+STRUCTURED_MEMORY_FILE = "user_memory.json"  # legacy store, see import_structured_memory
 
-def load_structured_memory():
-    if not os.path.exists(STRUCTURED_MEMORY_FILE):
-        return {}
-    with open(STRUCTURED_MEMORY_FILE, "r") as f:
-        return json.load(f)
+_local = threading.local()
+
+
+def _connect(path=None):
+    path = path or PROFILE_DB_PATH
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == path:
+        return conn
+    conn = sqlite3.connect(path, timeout=PROFILE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS user_profiles ("
+        "user_id TEXT PRIMARY KEY, data TEXT NOT NULL DEFAULT '{}', updated_at TEXT)"
+    )
+    _local.conn, _local.path = conn, path
+    return conn
+
+
+def _json_path(key: str) -> str:
+    # SQLite takes a quoted label verbatim, up to the next '"', with no escapes. A key containing
+    # '"' can't be addressed at all (json_set would silently skip it), so it is refused up front.
+    if '"' in key:
+        raise ValueError(f"Profile keys can't contain '\"': {key!r}")
+    return '$."' + key + '"'
 
-def save_structured_memory(memory):
-    with open(STRUCTURED_MEMORY_FILE, "w") as f:
-        json.dump(memory, f, indent=2)
 
 def get_user_profile(user_id):
-    memory = load_structured_memory()
-    return memory.get(user_id, {})
+    row = _connect().execute("SELECT data FROM user_profiles WHERE user_id = ?", (user_id,)).fetchone()
+    return json.loads(row[0]) if row else {}
+
 
 def update_user_profile(user_id, updates):
-    memory = load_structured_memory()
-    user_data = memory.get(user_id, {})
-    user_data.update(updates)
-    user_data["last_seen"] = datetime.now().isoformat()
-    memory[user_id] = user_data
-    save_structured_memory(memory)
+    """Merge `updates` into the profile (top-level keys, like dict.update) in one atomic statement.
+
+    Raises ValueError for a key containing '"'.
+    """
+    updates = {str(key): value for key, value in updates.items()}
+    updates["last_seen"] = datetime.now().isoformat()
+    assignments = ", ".join("?, json(?)" for _ in updates)
+    params = []
+    for key, value in updates.items():
+        params += [_json_path(key), json.dumps(value)]
+    _connect().execute(
+        f"INSERT INTO user_profiles (user_id, data, updated_at) VALUES (?, ?, ?) "
+        f"ON CONFLICT (user_id) DO UPDATE SET data = json_set(data, {assignments}), updated_at = excluded.updated_at",
+        [user_id, json.dumps(updates), updates["last_seen"], *params],
+    )
+
+
+def import_structured_memory(path=STRUCTURED_MEMORY_FILE, batch_size=5000):
+    """Copy profiles from a legacy user_memory.json. Users already in the store keep their (newer) data."""
+    with open(path, "r") as f:
+        memory = json.load(f)
+    conn = _connect()
+    imported = 0
+    items = list(memory.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.executemany(
+                "INSERT INTO user_profiles (user_id, data, updated_at) VALUES (?, ?, ?) ON CONFLICT (user_id) DO NOTHING",
+                [(user_id, json.dumps(data), data.get("last_seen")) for user_id, data in batch],
+            )
+            imported += cursor.rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    print(f"✅ Imported {imported} of {len(items)} profiles from {path} into {PROFILE_DB_PATH}")
+    return imported
 
 
+if __name__ == "__main__":
+    # python usermemory.py [user_memory.json]
+    import_structured_memory(sys.argv[1] if len(sys.argv) > 1 else STRUCTURED_MEMORY_FILE)
@@ -0,0 +1,175 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+import numpy as np
+from embeddings import aembed, model_slug, model_loaded, warm_model
+
+# Long-term recall of past chat turns by meaning: local (default), pinecone, or off
+VECTOR_MEMORY_BACKEND = os.getenv("VECTOR_MEMORY_BACKEND", "local")
+VECTOR_MEMORY_DIR = os.getenv("VECTOR_MEMORY_DIR", "vector_memory")
+VECTOR_MEMORY_TOP_K = int(os.getenv("VECTOR_MEMORY_TOP_K", "4"))
+VECTOR_MEMORY_MIN_SCORE = float(os.getenv("VECTOR_MEMORY_MIN_SCORE", "0.35"))
+
+
+class LocalVectorStore:
+    """Per-user embedding files searched in-process through np.memmap.
+
+    Each user has three append-only files: `.f32` (unit vectors, one row per
+    turn), `.jsonl` (the turn text) and `.idx` (int64 byte offset of each
+    row's jsonl line). A row only counts once its offset is in `.idx`, so
+    readers never see a half-written turn. Appends from several workers are
+    serialized with flock on `.idx`.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _base(self, user_id: str) -> str:
+        digest = hashlib.sha1(user_id.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def add(self, user_id: str, vectors: np.ndarray, payloads):
+        base = self._base(user_id)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        row_bytes = vectors.shape[1] * 4
+        with open(base + ".idx", "ab") as idx:
+            fcntl.flock(idx, fcntl.LOCK_EX)
+            try:
+                committed = idx.seek(0, os.SEEK_END) // 8
+                idx.truncate(committed * 8)
+                with open(base + ".f32", "ab") as vec, open(base + ".jsonl", "ab") as meta:
+                    vec.truncate(committed * row_bytes)  # drop rows of an append that died halfway
+                    vec.seek(0, os.SEEK_END)
+                    offsets = []
+                    for payload in payloads:
+                        offsets.append(meta.tell())
+                        meta.write(json.dumps(payload, ensure_ascii=False).encode() + b"\n")
+                    vec.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                    meta.flush()
+                    vec.flush()
+                idx.write(np.asarray(offsets, dtype=np.int64).tobytes())
+                idx.flush()
+            finally:
+                fcntl.flock(idx, fcntl.LOCK_UN)
+
+    def search(self, user_id: str, vector: np.ndarray, k: int):
+        """Top-k (cosine score, payload) for the user, best first."""
+        base = self._base(user_id)
+        dim = vector.shape[-1]
+        try:
+            offsets = np.fromfile(base + ".idx", dtype=np.int64)
+            rows = min(len(offsets), os.path.getsize(base + ".f32") // (dim * 4))
+        except FileNotFoundError:
+            return []
+        if rows == 0:
+            return []
+        matrix = np.memmap(base + ".f32", dtype=np.float32, mode="r", shape=(rows, dim))
+        scores = matrix @ vector
+        k = min(k, rows)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        with open(base + ".jsonl", "rb") as meta:
+            for row in top:
+                meta.seek(int(offsets[row]))
+                results.append((float(scores[row]), json.loads(meta.readline())))
+        return results
+
+
+class PineconeVectorStore:
+    """Same interface on a Pinecone index, one namespace per user."""
+
+    def __init__(self):
+        self._index = None
+
+    def _get_index(self, dim: int):
+        if self._index is None:
+            from pinecone import Pinecone
+            from vector_utils import init_index
+            pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+            self._index = init_index(pc, name=os.getenv("PINECONE_INDEX", "sextbot-index"), dimension=dim)
+        return self._index
+
+    def add(self, user_id: str, vectors: np.ndarray, payloads):
+        self._get_index(vectors.shape[1]).upsert(
+            vectors=[{"id": uuid.uuid4().hex, "values": v.tolist(), "metadata": p} for v, p in zip(vectors, payloads)],
+            namespace=user_id,
+        )
+
+    def search(self, user_id: str, vector: np.ndarray, k: int):
+        res = self._get_index(vector.shape[-1]).query(
+            vector=vector.tolist(), top_k=k, namespace=user_id, include_metadata=True
+        )
+        return [(match.score, dict(match.metadata)) for match in res.matches]
+
+
+def _make_store():
+    if VECTOR_MEMORY_BACKEND == "local":
+        return LocalVectorStore(os.path.join(VECTOR_MEMORY_DIR, model_slug()))
+    if VECTOR_MEMORY_BACKEND == "pinecone":
+        return PineconeVectorStore()
+    return None
+
+
+store = _make_store()
+
+
+def _disable(e: ImportError):
+    global store
+    store = None
+    print(f"⚠️ Vector memory disabled, embedding model unavailable: {e}")
+
+
+async def warm_memory():
+    """Load the embedding model at startup, so the first /chat doesn't load it inline."""
+    if store is None:
+        return
+    try:
+        await asyncio.to_thread(warm_model)
+        print("🧠 Embedding model loaded")
+    except ImportError as e:
+        _disable(e)
+    except Exception as e:
+        print("⚠️ Embedding model not loaded, recall is off until it is:", e)
+
+
+def _turn_text(user_message: str, bot_reply: str) -> str:
+    return f"User: {user_message}\nCompanion: {bot_reply}"
+
+
+async def remember_turn(user_id: str, user_message: str, bot_reply: str):
+    """Embed a finished turn and add it to the user's memory (meant for a background task)."""
+    if store is None:
+        return
+    try:
+        vectors = await aembed([_turn_text(user_message, bot_reply)])
+        payload = {"user_message": user_message, "bot_reply": bot_reply, "timestamp": datetime.utcnow().isoformat()}
+        await asyncio.to_thread(store.add, user_id, vectors, [payload])
+    except ImportError as e:
+        _disable(e)
+    except Exception as e:
+        print("Vector memory write error:", e)
+
+
+async def recall(user_id: str, query: str, k: int = VECTOR_MEMORY_TOP_K):
+    """Past turns most similar to `query`, best first, as payload dicts.
+
+    Empty when disabled or failing, and until the model is loaded: a request
+    never waits for the load (see warm_memory()); remember_turn loads it lazily.
+    """
+    if store is None or not query or not model_loaded():
+        return []
+    try:
+        vector = (await aembed([query]))[0]
+        hits = await asyncio.to_thread(store.search, user_id, vector, k)
+    except ImportError as e:
+        _disable(e)
+        return []
+    except Exception as e:
+        print("Vector memory recall error:", e)
+        return []
+    return [payload for score, payload in hits if score >= VECTOR_MEMORY_MIN_SCORE]
@@ -1,12 +1,12 @@
 from pinecone import ServerlessSpec
 
-def init_index(pc):
-    if "sextbot-index" not in pc.list_indexes().names():
+def init_index(pc, name="sextbot-index", dimension=1536):
+    # dimension must match the embedding model (384 for the default all-MiniLM-L6-v2, see embeddings.py)
+    if name not in pc.list_indexes().names():
         pc.create_index(
-            name="sextbot-index",
-            dimension=1536,  # Adjust if your embedding size is different
+            name=name,
+            dimension=dimension,
             metric="cosine",
             spec=ServerlessSpec(cloud="aws", region="us-west-2")
         )
-    return pc.Index("sextbot-index")
-
+    return pc.Index(name)
@@ -0,0 +1,136 @@
+import asyncio
+import os
+from collections import defaultdict, deque
+from datetime import datetime
+from sqlalchemy import insert
+from database import get_async_engine
+from models import ChatMessage
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "1") == "1"  # turn off for serverless deploys
+CHAT_FLUSH_BATCH = int(os.getenv("CHAT_FLUSH_BATCH", "200"))
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "0.5"))  # seconds
+CHAT_MAX_PENDING = int(os.getenv("CHAT_MAX_PENDING", "20000"))
+CHAT_FLUSH_USE_COPY = os.getenv("CHAT_FLUSH_USE_COPY", "1") == "1"  # Postgres only
+
+COLUMNS = ["user_id", "user_message", "bot_reply", "timestamp"]
+
+
+class PendingMessage:
+    """An accepted but not yet flushed chat turn. Looks enough like a ChatMessage for history reads."""
+
+    __slots__ = ("user_id", "user_message", "bot_reply", "timestamp")
+    id = None
+
+    def __init__(self, user_id, user_message, bot_reply, timestamp):
+        self.user_id = user_id
+        self.user_message = user_message
+        self.bot_reply = bot_reply
+        self.timestamp = timestamp
+
+    def params(self) -> dict:
+        return {c: getattr(self, c) for c in COLUMNS}
+
+
+class ChatWriteBuffer:
+    """Write-behind buffer for chat_history inserts.
+
+    Turns are queued in memory and written in bulk (COPY on Postgres,
+    multi-row INSERT elsewhere) every `flush_interval` seconds or as soon as
+    `max_batch` are waiting. Failed flushes keep the rows and retry on the
+    next tick; past `max_pending` rows, writers wait for a flush instead of
+    queueing more. `pending_for` lets history reads include a user's own
+    unflushed turns. The buffer is per process: a hard crash loses at most
+    one flush interval of turns, and another worker won't see them until
+    they're flushed.
+    """
+
+    def __init__(self, max_batch=CHAT_FLUSH_BATCH, flush_interval=CHAT_FLUSH_INTERVAL, max_pending=CHAT_MAX_PENDING):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._by_user = defaultdict(deque)
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+        self.stats = {"flushes": 0, "rows": 0, "failures": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.running:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write out everything still pending."""
+        if self._task is not None:
+            # Let an in-progress flush finish rather than cancelling it mid-write
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        if not await self.flush():
+            print(f"⚠️ Chat write buffer: {len(self._pending)} turns could not be flushed on shutdown")
+
+    async def add(self, user_id: str, user_message: str, bot_reply: str):
+        if len(self._pending) >= self.max_pending:
+            await self.flush()  # backpressure while the DB is slow or down
+        message = PendingMessage(user_id, user_message, bot_reply, datetime.utcnow())
+        self._pending.append(message)
+        self._by_user[user_id].append(message)
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    def pending_for(self, user_id: str):
+        """This user's unflushed turns, oldest first."""
+        return list(self._by_user.get(user_id, ()))
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """Write all pending turns. Returns False if a batch failed (it stays queued)."""
+        async with self._lock:
+            while self._pending:
+                batch = [self._pending[i] for i in range(min(self.max_batch, len(self._pending)))]
+                try:
+                    await self._insert(batch)
+                except Exception as e:
+                    self.stats["failures"] += 1
+                    print("Chat write buffer flush error:", e)
+                    return False
+                for message in batch:
+                    self._pending.popleft()
+                    user_queue = self._by_user[message.user_id]
+                    user_queue.popleft()
+                    if not user_queue:
+                        del self._by_user[message.user_id]
+                self.stats["flushes"] += 1
+                self.stats["rows"] += len(batch)
+        return True
+
+    async def _insert(self, batch):
+        engine = get_async_engine()
+        async with engine.begin() as conn:
+            if engine.dialect.name == "postgresql" and CHAT_FLUSH_USE_COPY:
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    ChatMessage.__tablename__,
+                    records=[tuple(getattr(m, c) for c in COLUMNS) for m in batch],
+                    columns=COLUMNS,
+                )
+            else:
+                await conn.execute(insert(ChatMessage), [m.params() for m in batch])
+
+
+chat_writes = ChatWriteBuffer()